@@ -0,0 +1,27 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+// Status of a queued report job; getReport's 202 response points here
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ jobId: string }> }
+) {
+  try {
+    const { jobId } = await params;
+
+    const response = await fetch(
+      process.env.NEXT_PRIVATE_REPORTGEN_CHATBOT + '/jobs/' + encodeURIComponent(jobId),
+      { cache: 'no-store' }
+    );
+
+    // Pass the job (or the 404 for an unknown id) through as is
+    const data = await response.json();
+    return NextResponse.json(data, { status: response.status });
+
+  } catch (error) {
+    console.error('Error in getReport job status API route:', error);
+    return NextResponse.json(
+      { error: 'Internal server error' },
+      { status: 500 }
+    );
+  }
+}
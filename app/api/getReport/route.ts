@@ -38,8 +38,18 @@ export async function POST(request: NextRequest) {
     
     console.log('Successfully received response from external API');
 
+    // A 202 Accepted is a queued report job: point the client at the status
+    // route of this app (the backend's /jobs URL is not reachable from the browser)
+    if (response.status === 202 && data.jobId) {
+      const statusUrl = `/api/getReport/jobs/${encodeURIComponent(data.jobId)}`;
+      return NextResponse.json(
+        { ...data, statusUrl },
+        { status: 202, headers: { Location: statusUrl } }
+      );
+    }
+
     // Return the data from the external API
-    return NextResponse.json(data);
+    return NextResponse.json(data, { status: response.status });
 
   } catch (error) {
     console.error('Error in getReport API route:', error);
@@ -0,0 +1,203 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+from metrics import ADMISSION_REJECTED
+
+load_dotenv()
+
+# Priority classes: lower wins. Chat is someone waiting on a reply, reports can wait.
+INTERACTIVE = 0
+BATCH = 1
+CLASS_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Total LLM-heavy requests running at once, across both classes
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "8"))
+# Slots only interactive requests may use, so reports can never take all of them
+ADMISSION_INTERACTIVE_RESERVE = int(os.getenv("ADMISSION_INTERACTIVE_RESERVE", "2"))
+# Requests waiting per class before new ones are turned away with a 429
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Requests one authId may have running or waiting, per class
+ADMISSION_PER_USER = {
+    INTERACTIVE: int(os.getenv("ADMISSION_PER_USER_CHAT", "2")),
+    BATCH: int(os.getenv("ADMISSION_PER_USER_REPORTS", "1")),
+}
+# Hold time assumed for Retry-After until real samples come in
+DEFAULT_HOLD_SECONDS = {INTERACTIVE: 5.0, BATCH: 60.0}
+HOLD_SAMPLES = 128
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing when a request should be answered with 429"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One admitted request; release() is idempotent"""
+
+    def __init__(self, controller, authId, priority):
+        self.controller = controller
+        self.authId = authId
+        self.priority = priority
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Global cap on in-flight LLM-heavy requests with per-authId limits and
+    strict priority between classes.
+
+    Free slots always go to the highest-priority waiter first, and batch work
+    can only use `max_inflight - interactive_reserve` of them, so a burst of
+    reports never delays chat by more than one slot hand-off. When a class's
+    queue is full (or a user is over their limit) the caller gets Overloaded,
+    with a Retry-After estimated from the queue depth ahead of it and the
+    recent average hold time of that class.
+    """
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, interactive_reserve=ADMISSION_INTERACTIVE_RESERVE,
+                 max_queue=ADMISSION_MAX_QUEUE, per_user=ADMISSION_PER_USER):
+        self.max_inflight = max_inflight
+        self.interactive_reserve = min(interactive_reserve, max_inflight - 1)
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.inflight = defaultdict(int)
+        self._users = defaultdict(int)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._holds = {priority: deque(maxlen=HOLD_SAMPLES) for priority in CLASS_NAMES}
+        self.admitted = defaultdict(int)
+        self.rejected = defaultdict(int)
+
+    def _capacity(self, priority):
+        if priority == INTERACTIVE:
+            return self.max_inflight
+        return self.max_inflight - self.interactive_reserve
+
+    def _total_inflight(self):
+        return sum(self.inflight.values())
+
+    def _can_run(self, priority):
+        # Batch may not eat into the interactive reserve
+        return self._total_inflight() < self._capacity(priority) and (
+            priority == INTERACTIVE or self.inflight[BATCH] < self._capacity(BATCH)
+        )
+
+    def _queued(self, up_to_priority=None):
+        return sum(
+            1 for priority, _, future in self._waiters
+            if not future.done() and (up_to_priority is None or priority <= up_to_priority)
+        )
+
+    def _avg_hold(self, priority):
+        holds = self._holds[priority]
+        return sum(holds) / len(holds) if holds else DEFAULT_HOLD_SECONDS[priority]
+
+    def retry_after(self, priority):
+        """Seconds until a new request of this class would likely get a slot"""
+        ahead = self._queued(priority) + 1
+        return max(1, math.ceil(ahead * self._avg_hold(priority) / self._capacity(priority)))
+
+    def _reject(self, priority, reason, message):
+        self.rejected[priority] += 1
+        ADMISSION_REJECTED.labels(priority=CLASS_NAMES[priority], reason=reason).inc()
+        raise Overloaded(message, self.retry_after(priority))
+
+    async def acquire(self, authId, priority, reject=True):
+        """
+        Wait for a slot and return a Ticket. With reject=True (HTTP routes)
+        raises Overloaded instead of waiting behind a full queue; with
+        reject=False (background jobs) always waits.
+        """
+        user_key = (authId, priority)
+        if reject and authId and self._users[user_key] >= self.per_user[priority]:
+            self._reject(priority, "per_user", "Too many requests in progress for this user")
+
+        no_one_ahead = self._queued(priority) == 0
+        if not (no_one_ahead and self._can_run(priority)):
+            if reject and self._queued(priority) >= self.max_queue:
+                self._reject(priority, "queue_full", "Server is busy, try again later")
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            self._users[user_key] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                self._users[user_key] -= 1
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as the caller went away
+                    self.inflight[priority] -= 1
+                    self._wake()
+                else:
+                    future.cancel()
+                raise
+        else:
+            self.inflight[priority] += 1
+            self._users[user_key] += 1
+
+        self.admitted[priority] += 1
+        return Ticket(self, authId, priority)
+
+    @asynccontextmanager
+    async def slot(self, authId, priority, reject=True):
+        ticket = await self.acquire(authId, priority, reject)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _release(self, ticket):
+        self.inflight[ticket.priority] -= 1
+        user_key = (ticket.authId, ticket.priority)
+        self._users[user_key] -= 1
+        if self._users[user_key] <= 0:
+            del self._users[user_key]
+        self._holds[ticket.priority].append(time.monotonic() - ticket.started)
+        self._wake()
+
+    def _wake(self):
+        # Hand free slots to waiters in (priority, arrival) order
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_run(priority):
+                break
+            heapq.heappop(self._waiters)
+            self.inflight[priority] += 1
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            CLASS_NAMES[priority]: {
+                "capacity": self._capacity(priority),
+                "inflight": self.inflight[priority],
+                "queued": sum(1 for p, _, f in self._waiters if p == priority and not f.done()),
+                "admitted": self.admitted[priority],
+                "rejected": self.rejected[priority],
+                "avg_hold_s": round(self._avg_hold(priority), 2),
+                "retry_after_s": self.retry_after(priority),
+            }
+            for priority in CLASS_NAMES
+        }
+
+
+admission = AdmissionController()
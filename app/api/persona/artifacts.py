@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "3600"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class Artifact:
+    __slots__ = ("id", "data", "filename", "content_type", "etag", "created")
+
+    def __init__(self, data, filename, content_type, artifact_id=None):
+        # The id doubles as the download token, so it must not be guessable
+        self.id = artifact_id or uuid.uuid4().hex
+        self.data = data
+        self.filename = filename
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        self.created = time.time()
+
+    def handle(self, expires=True):
+        """
+        What the JSON routes return in place of the inline document. Job
+        results pass expires=False: their document is kept with the job
+        (JobQueue.save_artifact), so the link outlives this process.
+        """
+        handle = {
+            "id": self.id,
+            "url": f"/reports/{self.id}",
+            "filename": self.filename,
+            "contentType": self.content_type,
+            "size": len(self.data),
+            "etag": self.etag,
+        }
+        if expires:
+            handle["expiresIn"] = int(max(0, self.created + ARTIFACT_TTL_SECONDS - time.time()))
+        return handle
+
+
+class ArtifactStore:
+    """
+    Finished documents kept in memory for download. Entries expire after
+    ARTIFACT_TTL_SECONDS, and the oldest are dropped first once the total size
+    passes ARTIFACT_MAX_BYTES.
+    """
+
+    def __init__(self, ttl=ARTIFACT_TTL_SECONDS, max_bytes=ARTIFACT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._size = 0
+
+    def put(self, data, filename, content_type="application/pdf", artifact_id=None):
+        # bytes(data) is a no-op for bytes, so the rendered buffer is shared, not copied
+        artifact = Artifact(bytes(data), filename, content_type, artifact_id)
+        with self._lock:
+            self._items[artifact.id] = artifact
+            self._size += len(artifact.data)
+            self._evict()
+        return artifact
+
+    def get(self, artifact_id):
+        with self._lock:
+            self._evict()
+            return self._items.get(artifact_id)
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl
+        while self._items:
+            oldest = next(iter(self._items.values()))
+            if oldest.created >= cutoff and self._size <= self.max_bytes:
+                break
+            self._items.popitem(last=False)
+            self._size -= len(oldest.data)
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range: bytes=...` header.
+
+    Returns:
+        tuple: (start, end) inclusive, None if the header should be ignored
+        (absent, malformed or multi-range), or "unsatisfiable".
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,136 @@
+"""
+Replay a fixture corpus through candidate models and compare them per task.
+
+    python bench.py
+    python bench.py --models gemini-2.0-flash,gemini-2.0-flash-lite --tasks emotion,summary --repeat 5
+
+Each fixture line is {"task": ..., "contents": ...}. For tasks with a
+registered instruction preamble (info, graph, rag, chat, ...) contents is
+only the per-call data, as in production. Reports latency percentiles and
+the share of replies that pass the task's output check; use it before
+changing an entry in routing.ROUTES.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from google.genai import types
+
+import chat  # noqa: F401  (registers the chat preamble)
+import conv  # noqa: F401  (registers the persona / rag preambles)
+from conv import EMOTIONS
+from context_cache import prefix_cache
+from json_repair import parse_json
+from llm import generate_text
+from routing import ROUTES, route_model
+from schemas import PersonaExtraction, JournalEntryAnalysis, JournalBatchAnalysis
+
+# Call sites that pass a response_schema in production
+SCHEMAS = {
+    "persona_extraction": PersonaExtraction,
+    "persona_merge": PersonaExtraction,
+    "journal_entry": JournalEntryAnalysis,
+    "journal_batch": JournalBatchAnalysis,
+}
+JSON_TASKS = {"info", "graph", "chat_extraction", "rag"}
+
+
+def is_valid(task, text):
+    """Does the reply pass what the call site needs from it?"""
+    if task == "emotion":
+        data = parse_json(text, task, default=None)
+        return isinstance(data, dict) and all(
+            isinstance(data.get(emotion), (int, float)) and 0 <= data[emotion] <= 1 for emotion in EMOTIONS
+        )
+    if task in SCHEMAS:
+        try:
+            SCHEMAS[task].model_validate(parse_json(text, task))
+            return True
+        except ValueError:
+            return False
+    if task in JSON_TASKS:
+        return isinstance(parse_json(text, task, default=None), dict)
+    return bool(text and text.strip())
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an unsorted list
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+async def run_one(fixture, model, slots):
+    task = fixture["task"]
+    prefix = prefix_cache.get(task)
+    config = None
+    if task in SCHEMAS:
+        config = types.GenerateContentConfig(response_mime_type="application/json", response_schema=SCHEMAS[task])
+    async with slots:
+        started = time.perf_counter()
+        try:
+            text = await generate_text(
+                fixture["contents"], task=task, model=model, config=config, cache=False, hedge=False,
+                vertex=prefix.vertex if prefix else False, prefix=task if prefix else None,
+            )
+        except Exception as e:
+            return task, model, None, False, str(e)
+        return task, model, time.perf_counter() - started, is_valid(task, text), None
+
+
+async def bench(fixtures, models, repeat, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    runs = [
+        run_one(fixture, model or route_model(fixture["task"]), slots)
+        for fixture in fixtures
+        for model in models
+        for _ in range(repeat)
+    ]
+    results = {}
+    for task, model, seconds, valid, error in await asyncio.gather(*runs):
+        row = results.setdefault((task, model), {"latencies": [], "valid": 0, "errors": []})
+        if seconds is not None:
+            row["latencies"].append(seconds * 1000)
+        row["valid"] += valid
+        if error:
+            row["errors"].append(error)
+    return results
+
+
+def report(results):
+    print(f"{'task':<20}{'model':<28}{'n':>4}{'valid':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for (task, model), row in sorted(results.items()):
+        n = len(row["latencies"]) + len(row["errors"])
+        cells = [percentile(row["latencies"], pct) for pct in (50, 90, 99)]
+        cells = "".join(f"{cell:>9.0f}" if cell is not None else f"{'-':>9}" for cell in cells)
+        print(f"{task:<20}{model:<28}{n:>4}{row['valid'] / n:>8.0%}{cells}{len(row['errors']):>8}")
+    for (task, model), row in sorted(results.items()):
+        for error in sorted(set(row["errors"])):
+            print(f"{task} / {model}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default="bench_fixtures.jsonl")
+    parser.add_argument("--models", default="", help="comma-separated; default: each task's routed model")
+    parser.add_argument("--tasks", default="", help="comma-separated; default: every task in the fixtures")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with open(args.fixtures) as f:
+        fixtures = [json.loads(line) for line in f if line.strip()]
+    if args.tasks:
+        fixtures = [fixture for fixture in fixtures if fixture["task"] in args.tasks.split(",")]
+    unknown = {fixture["task"] for fixture in fixtures} - set(ROUTES)
+    if unknown:
+        print(f"No route for {sorted(unknown)}; they use the default model")
+    models = args.models.split(",") if args.models else [None]
+
+    report(asyncio.run(bench(fixtures, models, args.repeat, args.concurrency)))
+
+
+if __name__ == "__main__":
+    main()
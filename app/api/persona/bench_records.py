@@ -0,0 +1,121 @@
+"""
+Compare the old dict + DataFrame journal path with JournalRecords.
+
+    python bench_records.py
+    python bench_records.py --sizes 100,1000 --repeat 5
+
+Times and traces the allocations of the data handling around a MindLog
+report, with no LLM calls or chart drawing: building the analyzed entries,
+shipping them to the render pool (pickle), the per-entry walks of
+generate_visualizations and generate_pdf_report, and the persona prompt
+dicts. The old path built a DataFrame on each side of the pool and walked
+it with iterrows().
+"""
+import argparse
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from journal_engine import EMOTIONS, JournalRecord
+
+
+def fake_entries(n, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    words = "today felt long work sleep friends anxious calm walk family deadline hopeful tired".split()
+    rows = []
+    for i in range(n):
+        rows.append((
+            f"entry-{i}",
+            f"Entry {i}",
+            start + timedelta(hours=12 * i),
+            " ".join(rng.choice(words) for _ in range(120)),
+            "- " + " ".join(rng.choice(words) for _ in range(200)),
+            "- " + " ".join(rng.choice(words) for _ in range(30)),
+            {emotion: round(rng.random(), 2) for emotion in EMOTIONS},
+        ))
+    return rows
+
+
+def old_path(rows):
+    # Dicts, {**entry, ...} per analysis, a DataFrame per pool call, iterrows() walks
+    entries = [{"entry_id": r[0], "title": r[1], "date": r[2], "content": r[3]} for r in rows]
+    results = [{**entry, "analysis": r[4], "summary": r[5], "emotions": r[6]} for entry, r in zip(entries, rows)]
+    payload = pickle.loads(pickle.dumps(results))
+
+    chart_df = pd.DataFrame(payload)
+    texts, emotions = [], []
+    for _, row in chart_df.iterrows():
+        texts.append(f"{row['title']} {row.get('content', '')} {row.get('analysis', '')}")
+        emotions.append({**row["emotions"], "date": row["date"].date()})
+    emotion_df = pd.DataFrame(emotions)
+    emotion_df[EMOTIONS].mean()
+
+    pdf_df = pd.DataFrame(pickle.loads(pickle.dumps(results)))
+    summaries = pdf_df["summary"].astype(str).tolist()
+    for _, row in pdf_df.iterrows():
+        str(row["summary"]) if pd.notna(row["summary"]) else ""
+
+    persona = [{k: v for k, v in result.items() if k != "content"} for result in results]
+    return len(texts), len(summaries), len(persona)
+
+
+def new_path(rows):
+    records = [JournalRecord(r[0], r[1], r[2], r[3]).analyzed(r[4], r[5], r[6]) for r in rows]
+    payload = pickle.loads(pickle.dumps(records))
+
+    texts, emotions = [], []
+    for record in payload:
+        texts.append(f"{record.title} {record.content or ''} {record.analysis or ''}")
+        emotions.append({**record.emotions, "date": record.date.date()})
+    emotion_df = pd.DataFrame(emotions)
+    emotion_df[EMOTIONS].mean()
+
+    pdf_records = pickle.loads(pickle.dumps(records))
+    summaries = [str(record.summary) for record in pdf_records]
+    for record in pdf_records:
+        str(record.summary) if record.summary is not None else ""
+
+    persona = [record.to_dict(content=False) for record in records]
+    return len(texts), len(summaries), len(persona)
+
+
+def measure(fn, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,300,1000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8}{'old ms':>10}{'new ms':>10}{'speedup':>9}{'old KiB':>11}{'new KiB':>11}{'saved':>8}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        rows = fake_entries(size)
+        old_ms, old_kib = measure(old_path, rows, args.repeat)
+        new_ms, new_kib = measure(new_path, rows, args.repeat)
+        print(
+            f"{size:>8}{old_ms:>10.1f}{new_ms:>10.1f}{old_ms / new_ms:>8.1f}x"
+            f"{old_kib:>11.0f}{new_kib:>11.0f}{1 - new_kib / old_kib:>8.0%}"
+        )
+    as_dict = sys.getsizeof({slot: None for slot in JournalRecord.__slots__})
+    print(f"one entry, shallow: dict {as_dict} bytes, JournalRecord {sys.getsizeof(JournalRecord('x'))} bytes")
+
+
+if __name__ == "__main__":
+    main()
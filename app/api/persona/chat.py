@@ -1,53 +1,59 @@
 import os
-from google import genai
 from google.genai import types
+from llm import stream_text
+from prompts import PromptBuilder
+from context_cache import prefix_cache
 
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "hackathons-423418-ca6c603344c4.json"
-def reflection_chatbot(user_info=None, user_message=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
 
-    model = "gemini-2.0-flash"  # Use a supported Gemini model
+THERAPIST_PERSONA = """From now on, you will take on the persona of a compassionate and skilled therapist, dedicated to providing a safe, supportive, and nonjudgmental space for personal growth. Your role is to help me explore my thoughts, emotions, and behaviors, offering guidance that aligns with my values and goals. You use a client-centered, evidence-based approach, tailoring your responses to my unique needs.
+
+The user message holds My Information and then my message to you.
+"""
 
-    # Format user inputs into the system prompt
-    system_prompt = f"""From now on, you will take on the persona of a compassionate and skilled therapist, dedicated to providing a safe, supportive, and nonjudgmental space for personal growth. Your role is to help me explore my thoughts, emotions, and behaviors, offering guidance that aligns with my values and goals. You use a client-centered, evidence-based approach, tailoring your responses to my unique needs.
+# Set up the RAG tool (if applicable)
+CHAT_TOOLS = [
+    types.Tool(
+        retrieval=types.Retrieval(
+            vertex_rag_store=types.VertexRagStore(
+                rag_resources=[
+                    types.VertexRagStoreRagResource(
+                        rag_corpus="projects/hackathons-423418/locations/us-central1/ragCorpora/4749045807062188032"
+                    )
+                ]
+            )
+        )
+    )
+]
 
-My Information:
-{user_info if user_info else "No user information provided."} 
+# Persona and retrieval tool are cached together as the chat preamble (see context_cache.py)
+prefix_cache.register("chat", THERAPIST_PERSONA, tools=CHAT_TOOLS, vertex=True)
 
-User Message:
-{user_message if user_message else "No user message provided."}
-"""
+
+async def reflection_chatbot_stream(user_info=None, user_message=None):
+    """
+    Yield (text, usage_metadata) for each chunk as Gemini produces it.
+    usage_metadata is None except on the chunks that carry token counts.
+    """
+    # Per-call part of the prompt (the stored persona is trimmed if it is over budget)
+    user_prompt = (
+        PromptBuilder("chat")
+        .data("My Information", user_info, empty="No user information provided.")
+        .text("\nUser Message:\n" + (user_message if user_message else "No user message provided."))
+        .build()
+    )
 
     # Create prompt content
     contents = [
         types.Content(
             role="user",
             parts=[
-                types.Part(text=system_prompt)
+                types.Part(text=user_prompt)
             ]
         )
     ]
 
-    # Set up the RAG tool (if applicable)
-    tools = [
-        types.Tool(
-            retrieval=types.Retrieval(
-                vertex_rag_store=types.VertexRagStore(
-                    rag_resources=[
-                        types.VertexRagStoreRagResource(
-                            rag_corpus="projects/hackathons-423418/locations/us-central1/ragCorpora/4749045807062188032"
-                        )
-                    ]
-                )
-            )
-        )
-    ]
-
     # Generation configuration
     generate_content_config = types.GenerateContentConfig(
         temperature=0.7,
@@ -60,18 +66,17 @@ User Message:
             types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
         ],
-        tools=tools,
     )
 
+    # Forward the model stream chunk by chunk
+    async for text, usage in stream_text(contents, task="chat", config=generate_content_config, vertex=True, prefix="chat"):
+        yield text, usage
+
+
+async def reflection_chatbot(user_info=None, user_message=None):
     # Collect response from model stream
     response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
+    async for text, _ in reflection_chatbot_stream(user_info=user_info, user_message=user_message):
+        response_text += text
     
     return response_text
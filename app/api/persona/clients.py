@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "secrets/service.json")
+VERTEX_PROJECT = os.getenv("VERTEX_PROJECT", "hackathons-423418")
+VERTEX_LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")  # Make sure this matches your RAG corpus location
+# "on" swaps both Gemini clients for the offline stand-in in fake_genai.py (load tests, no network)
+FAKE_GENAI = os.getenv("FAKE_GENAI", "off")
+
+
+class ClientRegistry:
+    """
+    Owns the long-lived Firestore and Gemini clients for the whole process.
+
+    Clients are created on first use (or by warm_up at startup) and handed out
+    to every caller afterwards, so gRPC channels, auth tokens and TLS sessions
+    are reused instead of rebuilt per request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._stats = {}
+        self._cred = None
+
+    def _get(self, name, factory):
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    started = time.perf_counter()
+                    client = factory()
+                    self._clients[name] = client
+                    self._stats[name] = {
+                        "created": 1,
+                        "reused": 0,
+                        "createMs": round(1000 * (time.perf_counter() - started), 1),
+                        "warmupMs": None,
+                    }
+                    return client
+        self._stats[name]["reused"] += 1
+        return client
+
+    def credentials(self):
+        if self._cred is None:
+            import firebase_admin
+            from firebase_admin import credentials
+
+            self._cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(self._cred)
+        return self._cred
+
+    def firestore(self):
+        def create():
+            from google.cloud import firestore
+
+            cred = self.credentials()
+            return firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+
+        return self._get("firestore", create)
+
+    def genai(self):
+        """Gemini Developer API client (API key)"""
+        def create():
+            if FAKE_GENAI == "on":
+                from fake_genai import FakeClient
+
+                return FakeClient()
+            from google import genai
+
+            return genai.Client(api_key=os.getenv("NEXT_PUBLIC_GEMINI_API_KEY"))
+
+        return self._get("genai", create)
+
+    def vertex(self):
+        """Vertex AI client, needed for the RAG corpus tools"""
+        def create():
+            if FAKE_GENAI == "on":
+                from fake_genai import FakeClient
+
+                return FakeClient()
+            from google import genai
+
+            return genai.Client(vertexai=True, project=VERTEX_PROJECT, location=VERTEX_LOCATION)
+
+        return self._get("vertex", create)
+
+    async def warm_up(self):
+        """
+        Create every client and make one cheap call on each so the first real
+        request does not pay for channel setup and token fetches. Gemini is
+        warmed through client.aio, the transport every LLM call uses.
+        """
+        from pools import run_in_pool
+        from routing import DEFAULT_MODEL
+
+        checks = {
+            "firestore": lambda: run_in_pool(
+                "firestore", lambda: self.firestore().collection("users").document("_warmup").get()
+            ),
+            "genai": lambda: self.genai().aio.models.get(model=DEFAULT_MODEL),
+            "vertex": lambda: self.vertex().aio.models.get(model=DEFAULT_MODEL),
+        }
+        for name, check in checks.items():
+            reused = self._stats.get(name, {}).get("reused", 0)
+            started = time.perf_counter()
+            try:
+                await check()
+            except Exception as e:
+                print(f"Warm-up of {name} client failed: {e}")
+                continue
+            stat = self._stats[name]
+            stat["warmupMs"] = round(1000 * (time.perf_counter() - started), 1)
+            # The warm-up call itself is not a reuse by a request
+            stat["reused"] = reused
+
+    def stats(self):
+        return {name: dict(stat) for name, stat in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            for name, client in self._clients.items():
+                close = getattr(client, "close", None)
+                if close is not None:
+                    try:
+                        close()
+                    except Exception as e:
+                        print(f"Error closing {name} client: {e}")
+            self._clients.clear()
+
+
+registry = ClientRegistry()
+
+
+def get_firestore():
+    return registry.firestore()
+
+
+def get_genai():
+    return registry.genai()
+
+
+def get_vertex():
+    return registry.vertex()
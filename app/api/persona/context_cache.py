@@ -0,0 +1,206 @@
+"""
+Gemini context caching for the static instruction preambles (see PrefixCache).
+
+Off by default. Gemini only caches content above a per-model token minimum
+(CACHE_MIN_TOKENS: 4096 for the gemini-2.0 models the summary, emotion and
+persona routes use), and every preamble registered today is a few hundred
+tokens, so with the shipped routes each lookup would just report "too_small"
+and send the preamble inline. Set CONTEXT_CACHE=on once a preamble, or a route
+to a model with a lower minimum, reaches the threshold; /context-caches shows
+each preamble's tokens against its model's minimum.
+"""
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from google.genai import types
+
+from clients import get_genai, get_vertex
+from prompts import count_tokens
+from routing import route_model
+from metrics import CONTEXT_CACHE_LOOKUPS
+
+load_dotenv()
+
+# "on" caches preambles that reach their model's minimum; "off" sends every preamble inline
+CONTEXT_CACHE = os.getenv("CONTEXT_CACHE", "off")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Extend a cache once it has less than this left, so calls never race its expiry
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+# Gemini rejects cached content below a model-specific token minimum (a 400 on create);
+# shorter preambles are sent inline without trying. Set CONTEXT_CACHE_MIN_TOKENS to override
+CACHE_MIN_TOKENS = {
+    "gemini-1.5": 32768,
+    "gemini-2.0": 4096,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+CACHE_MIN_TOKENS_DEFAULT = 4096
+CONTEXT_CACHE_MIN_TOKENS = os.getenv("CONTEXT_CACHE_MIN_TOKENS")
+# After a failed create, send the preamble inline for this long before trying again
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("CONTEXT_CACHE_RETRY_SECONDS", "3600"))
+
+# Errors that mean the cache we referenced is gone or unusable
+STALE_CACHE_CODES = {400, 403, 404}
+
+
+class Prefix:
+    __slots__ = ("name", "system_instruction", "model", "tools", "vertex",
+                 "tokens", "cache_name", "expires_at", "retry_at", "lock")
+
+    def __init__(self, name, system_instruction, model, tools, vertex):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.model = model
+        self.tools = tools
+        self.vertex = vertex
+        self.tokens = count_tokens(system_instruction)
+        self.cache_name = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self.lock = None
+
+
+def min_cache_tokens(model):
+    """Smallest cached content `model` accepts, by longest matching name prefix"""
+    if CONTEXT_CACHE_MIN_TOKENS:
+        return int(CONTEXT_CACHE_MIN_TOKENS)
+    matches = [family for family in CACHE_MIN_TOKENS if model.split("/")[-1].startswith(family)]
+    return CACHE_MIN_TOKENS[max(matches, key=len)] if matches else CACHE_MIN_TOKENS_DEFAULT
+
+
+class PrefixCache:
+    """
+    Static instruction preambles (and their tools) registered once and kept
+    as Gemini cached content, so calls send only the per-user suffix.
+
+    Caches are created lazily on first use, extended shortly before they
+    expire, re-created when a call finds them gone, and deleted on shutdown.
+    Whenever no cache is available the same preamble is sent inline as the
+    system instruction, so callers never depend on caching working.
+    """
+
+    def __init__(self):
+        self._prefixes = {}
+
+    def register(self, name, system_instruction, model=None, tools=None, vertex=False):
+        # Caches are per model: by default the one routing.py sends this task to
+        self._prefixes[name] = Prefix(name, system_instruction, model or route_model(name), tools, vertex)
+
+    def get(self, name):
+        return self._prefixes.get(name)
+
+    def _client(self, prefix):
+        return get_vertex() if prefix.vertex else get_genai()
+
+    def inline_config(self, name, config=None):
+        """config with the preamble and tools sent inline (also what the response cache keys on)"""
+        prefix = self._prefixes[name]
+        update = {"system_instruction": prefix.system_instruction}
+        if prefix.tools:
+            update["tools"] = prefix.tools
+        if config is None:
+            return types.GenerateContentConfig(**update)
+        return config.model_copy(update=update)
+
+    @staticmethod
+    def cached_config(cache_name, config):
+        """config referencing the cache; system_instruction and tools must then come only from it"""
+        return config.model_copy(update={"cached_content": cache_name, "system_instruction": None, "tools": None})
+
+    async def lookup(self, name, model):
+        """Name of a live cache for this prefix, or None to send it inline"""
+        prefix = self._prefixes.get(name)
+        if CONTEXT_CACHE != "on" or prefix is None or prefix.model != model:
+            return None
+        if prefix.tokens < min_cache_tokens(model):
+            # Too short to cache at all; not an error, so nothing to log or retry
+            CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="too_small").inc()
+            return None
+        now = time.time()
+        if prefix.cache_name and now < prefix.expires_at - CONTEXT_CACHE_REFRESH_MARGIN:
+            CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="hit").inc()
+            return prefix.cache_name
+        if now < prefix.retry_at:
+            CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="inline").inc()
+            return None
+
+        if prefix.lock is None:
+            prefix.lock = asyncio.Lock()
+        async with prefix.lock:
+            # Another caller may have refreshed it while we waited
+            if prefix.cache_name and time.time() < prefix.expires_at - CONTEXT_CACHE_REFRESH_MARGIN:
+                return prefix.cache_name
+            try:
+                if prefix.cache_name and time.time() < prefix.expires_at:
+                    await self._extend(prefix)
+                    CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="extended").inc()
+                else:
+                    await self._create(prefix)
+                    CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="created").inc()
+            except Exception as e:
+                print(f"Context cache for {name} unavailable, sending it inline: {e}")
+                prefix.cache_name = None
+                prefix.retry_at = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+                CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="failed").inc()
+                return None
+        return prefix.cache_name
+
+    async def _create(self, prefix):
+        cached = await self._client(prefix).aio.caches.create(
+            model=prefix.model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"persona-{prefix.name}",
+                system_instruction=prefix.system_instruction,
+                tools=prefix.tools,
+                ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+            ),
+        )
+        prefix.cache_name = cached.name
+        prefix.expires_at = time.time() + CONTEXT_CACHE_TTL_SECONDS
+
+    async def _extend(self, prefix):
+        try:
+            await self._client(prefix).aio.caches.update(
+                name=prefix.cache_name,
+                config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"),
+            )
+            prefix.expires_at = time.time() + CONTEXT_CACHE_TTL_SECONDS
+        except Exception:
+            # Expired or deleted under us: make a new one
+            await self._create(prefix)
+
+    def invalidate(self, name):
+        """A call found the cache gone; the next lookup re-creates it"""
+        prefix = self._prefixes.get(name)
+        if prefix is not None:
+            prefix.cache_name = None
+            prefix.expires_at = 0.0
+            CONTEXT_CACHE_LOOKUPS.labels(prefix=name, result="invalidated").inc()
+
+    async def close(self):
+        # Stop paying for cache storage once this process stops serving
+        for prefix in self._prefixes.values():
+            if prefix.cache_name:
+                try:
+                    await self._client(prefix).aio.caches.delete(name=prefix.cache_name)
+                except Exception as e:
+                    print(f"Error deleting context cache {prefix.name}: {e}")
+                prefix.cache_name = None
+
+    def stats(self):
+        now = time.time()
+        return {
+            name: {
+                "cache": prefix.cache_name,
+                "expiresIn": int(prefix.expires_at - now) if prefix.cache_name else None,
+                "inlineFor": int(prefix.retry_at - now) if prefix.retry_at > now else 0,
+                "model": prefix.model,
+                "tokens": prefix.tokens,
+                "minTokens": min_cache_tokens(prefix.model),
+            }
+            for name, prefix in self._prefixes.items()
+        }
+
+
+prefix_cache = PrefixCache()
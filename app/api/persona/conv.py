@@ -1,10 +1,5 @@
 import os
 from dotenv import load_dotenv
-from google import genai
-import json
-import re
-import pandas as pd
-from google import genai
 from google.genai import types
 
 
@@ -12,11 +7,11 @@ from google.genai import types
 # Load environment variables from .env file
 load_dotenv()
 
-# Read the API key from the environment
-api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
-
-# Initialize the genai client with the API key
-client = genai.Client(api_key=api_key)
+# Gemini calls go through the async facade in llm.py (shared clients, cache, concurrency cap)
+from llm import generate_json, stream_text
+from prompts import PromptBuilder, compact_json
+from context_cache import prefix_cache
+from schemas import PersonaExtraction
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "secrets/hackathons-423418-ca6c603344c4.json"
 
@@ -26,8 +21,7 @@ EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
 # Initialize Gemini client with API key from environment
 # client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-def extract_information_gemini(json_data):
-    prompt = """
+INFO_INSTRUCTIONS = """
 ```
 #role  
 You are a structured data extraction system designed to parse and format JSON data into a well-defined schema. Your purpose is to ensure accuracy, consistency, and adherence to the specified format while allowing flexibility in the fields within each section.  
@@ -94,32 +88,8 @@ Extract relevant information from the provided JSON and return the data strictly
 -take your time , ill give you a treat if you do not hallucinate.
  Input:
 """
-        
-    
-    #
-    prompt += json.dumps(json_data, indent=2)
-
-    # Use the correct Gemini model
-      
-    response = client.models.generate_content(
-    model="gemini-2.0-flash",
-    contents=prompt,
-      )
-
-    extracted_data=response.text
-    if isinstance(extracted_data, str):
-            
-          extracted_data = re.sub(r"```json\n|\n```", "", extracted_data).strip()
-            
-            
-          extracted_data = json.loads(extracted_data)
-          return extracted_data
-    return {}
-
-def extract_graph_info(json_data):
-    # Extract graph information from the JSON data
-  
-    prompt = """
+
+GRAPH_INSTRUCTIONS = """
 # Role  
 You are a structured data extraction and inference system designed to parse user psychological profiles and generate a scored JSON schema. Your goal is to ensure accuracy, completeness, and logical scoring even when exact numeric values are not provided.
 
@@ -160,52 +130,128 @@ Extract all relevant information that relates to **self-perception**, **relation
 
 """
 
+PERSONA_INSTRUCTIONS = """
+# Role
+You are a structured data extraction and inference system for psychological profiles.
 
+# Task
+From the input, fill both parts of the response schema:
 
-    prompt += json.dumps(json_data, indent=4)
+## info
+- Each section holds { "label", "value" } pairs for the fields relevant to it, chosen from the input.
+- If a field is missing, include it with "value": "Not Provided" instead of skipping it.
+- Keep every value in its correct section. If some values are null, infer them logically when possible.
 
-    # Use the correct Gemini model
-  
-        
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
+## graph
+- selfPerception, relationships and symptoms: at least 3 entries each, with field names chosen from the context.
+- Scores and severities are integers from 1 to 10. When not stated, infer them from the language and emotional tone:
+  a negative or concerning tone means a lower score, neutral means 5-6, positive or resilient means higher.
+- Symptom severity is higher when the symptom is described in strong or persistent terms.
+- Do not leave any section empty; if data is insufficient, give your best estimate.
 
-    extracted_data=response.text
-    if isinstance(extracted_data, str):
-        
-        extracted_data = re.sub(r"```json\n|\n```", "", extracted_data).strip()
-        
-        
-        extracted_data = json.loads(extracted_data)
-        return extracted_data
-    return {}
+Do not hallucinate facts that are not supported by the input.
 
+# Input:
+"""
 
+MERGE_INSTRUCTIONS = """
+# Role
+You maintain a structured psychological profile that is kept up to date as new data arrives.
 
+# Task
+The input holds the CURRENT PROFILE (info and graph, already in the response schema) and the NEW DATA
+gathered since it was built: new questionnaire answers and/or analyses of new journal entries.
+Return the complete updated profile in the same schema:
+- Keep every existing entry unless the new data contradicts or supersedes it.
+- Update values, scores and severities only where the new data gives evidence; leave the rest as they are.
+- Add entries for anything new (facts, relationships, symptoms).
+- Replace "Not Provided" values when the new data supplies them.
+- Scores and severities are integers from 1 to 10.
 
+Do not hallucinate facts that are not supported by the current profile or the new data.
 
+# Input:
+"""
 
-def generate_rag(chat_data=None, journal_analysis=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
+# Static preambles, sent as system instructions (and kept as Gemini cached content with CONTEXT_CACHE=on; see context_cache.py)
+prefix_cache.register("info", INFO_INSTRUCTIONS)
+prefix_cache.register("graph", GRAPH_INSTRUCTIONS)
+prefix_cache.register("persona_extraction", PERSONA_INSTRUCTIONS)
+prefix_cache.register("persona_merge", MERGE_INSTRUCTIONS)
+
+
+async def extract_information_gemini(json_data, cache=True):
+    # INFO_INSTRUCTIONS travel as the cached system instruction; only the data is sent here
+    prompt = PromptBuilder("info").data("", json_data).build()
+
+    # Parsed (and repaired if needed) as the reply streams in
+    return await generate_json(prompt, task="info", cache=cache, prefix="info")
 
-    model = "gemini-2.0-flash"  # Use a supported Gemini model
+async def extract_graph_info(json_data, cache=True):
+    # Extract graph information from the JSON data (GRAPH_INSTRUCTIONS are the cached preamble)
+    prompt = PromptBuilder("graph").data("", json_data).build()
 
-    # Format user inputs into the system prompt
-    system_prompt = f"""You are an advanced mental health reasoning agent tasked with developing a comprehensive psychological profile based on user data.
+    return await generate_json(prompt, task="graph", cache=cache, prefix="graph")
 
-# USER CHAT DATA
-{chat_data if chat_data else "No chat data provided."}
+async def extract_persona(json_data, cache=True):
+    """
+    Info and graph extraction in one structured-output call.
 
-# JOURNAL ANALYSIS
-{journal_analysis if journal_analysis else "No journal analysis provided."}
+    Gemini is given the PersonaExtraction schema as response_schema, so the
+    reply is JSON in that shape; it is parsed as it streams in (a reply cut
+    off at the token limit is closed up) and validated before use.
 
-Using all the information above, create a detailed psychological profile with the following components:
+    Returns:
+        tuple: (info, graph) dicts, shaped like extract_information_gemini and extract_graph_info output
+
+    Raises:
+        pydantic.ValidationError: if the reply does not match the schema
+        ValueError: if the reply holds no JSON at all
+    """
+    prompt = PromptBuilder("persona_extraction").data("", json_data).build()
+
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=PersonaExtraction,
+    )
+    extracted = PersonaExtraction.model_validate(
+        await generate_json(prompt, task="persona_extraction", config=config, cache=cache, prefix="persona_extraction")
+    )
+    return extracted.info.model_dump(), extracted.graph.model_dump()
+
+async def merge_persona(info, graph, chat_delta=None, journal_delta=None, cache=True):
+    """
+    Fold new questionnaire answers and journal analyses into an existing
+    persona with one structured-output call, instead of rebuilding it.
+
+    Returns:
+        tuple: (info, graph) dicts, shaped like extract_persona output
+
+    Raises:
+        pydantic.ValidationError: if the reply does not match the schema
+    """
+    # The current profile is sent whole (fixed text); only the new data may be trimmed to fit
+    prompt = (
+        PromptBuilder("persona_merge")
+        .text("# CURRENT PROFILE\n" + compact_json({"info": info, "graph": graph}))
+        .data("NEW QUESTIONNAIRE ANSWERS", chat_delta, empty="None.")
+        .data("NEW JOURNAL ANALYSIS", journal_delta, oldest_first=False, empty="None.")
+        .build()
+    )
+
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=PersonaExtraction,
+    )
+    merged = PersonaExtraction.model_validate(
+        await generate_json(prompt, task="persona_merge", config=config, cache=cache, prefix="persona_merge")
+    )
+    return merged.info.model_dump(), merged.graph.model_dump()
+
+
+RAG_INSTRUCTIONS = """You are an advanced mental health reasoning agent tasked with developing a comprehensive psychological profile based on user data.
+
+The user message holds the USER CHAT DATA and the JOURNAL ANALYSIS. Using all of that information, create a detailed psychological profile with the following components:
 
 1. EXTRACTED INFORMATION: Clearly organize factual information from the user's responses.
 2. SYMPTOM ANALYSIS: Identify potential mental health conditions based on reported symptoms and compare to clinical criteria.
@@ -218,31 +264,44 @@ For each section, detail your reasoning process and highlight any uncertainties
 Format the output as JSON with these sections as keys.
 """
 
+# Set up the RAG tool (if applicable)
+RAG_TOOLS = [
+    types.Tool(
+        retrieval=types.Retrieval(
+            vertex_rag_store=types.VertexRagStore(
+                rag_resources=[
+                    types.VertexRagStoreRagResource(
+                        rag_corpus="projects/hackathons-423418/locations/us-central1/ragCorpora/4749045807062188032"
+                    )
+                ]
+            )
+        )
+    )
+]
+
+# The instructions and the retrieval tool are cached together; tools cannot be sent alongside a cache
+prefix_cache.register("rag", RAG_INSTRUCTIONS, tools=RAG_TOOLS, vertex=True)
+
+
+async def generate_rag(chat_data=None, journal_analysis=None):
+    # Only the user data is sent per call; the oldest journal analyses go first if it is over budget
+    user_data = (
+        PromptBuilder("rag")
+        .data("USER CHAT DATA", chat_data, empty="No chat data provided.")
+        .data("JOURNAL ANALYSIS", journal_analysis, oldest_first=False, empty="No journal analysis provided.")
+        .build()
+    )
+
     # Create prompt content
     contents = [
         types.Content(
             role="user",
             parts=[
-                types.Part(text=system_prompt)
+                types.Part(text=user_data)
             ]
         )
     ]
 
-    # Set up the RAG tool (if applicable)
-    tools = [
-        types.Tool(
-            retrieval=types.Retrieval(
-                vertex_rag_store=types.VertexRagStore(
-                    rag_resources=[
-                        types.VertexRagStoreRagResource(
-                            rag_corpus="projects/hackathons-423418/locations/us-central1/ragCorpora/4749045807062188032"
-                        )
-                    ]
-                )
-            )
-        )
-    ]
-
     # Generation configuration
     generate_content_config = types.GenerateContentConfig(
         temperature=0.7,
@@ -255,18 +314,11 @@ Format the output as JSON with these sections as keys.
             types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
         ],
-        tools=tools,
     )
 
-    # Collect response from model stream
+    # Collect response from model stream (retrieval results can change, so never cached)
     response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
-    
+    async for text, _ in stream_text(contents, task="rag", config=generate_content_config, vertex=True, prefix="rag"):
+        response_text += text
+
     return response_text
\ No newline at end of file
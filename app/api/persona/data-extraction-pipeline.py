@@ -1,23 +1,16 @@
-import os
+import asyncio
 from dotenv import load_dotenv
-import google.generativeai as genai
 import json
 
+# Gemini calls go through the async facade in llm.py, like the service's own
+from llm import generate_text
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini client with API key from environment
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-response = client.models.generate_content(
-    model="gemini-2.0-flash",
-    contents="Explain how AI works",
-    
-)
 
 
-
-def json_to_md(json_data):
+async def json_to_md(json_data):
     """
     Convert JSON data to Markdown format using Gemini API.
     """
@@ -52,16 +45,13 @@ def json_to_md(json_data):
 
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-        )
-        return response.text if response else "Error generating Markdown."
+        text = await generate_text(prompt, task="json_to_md")
+        return text if text else "Error generating Markdown."
     except Exception as e:
         return f"Error: {str(e)}"
 
 
-def extract_information_gemini(json_data):
+async def extract_information_gemini(json_data):
     prompt = """
 **#role**  
 You are an advanced data extraction system designed to process therapy questionnaire responses and convert them into structured JSON format. Your goal is to extract key details while maintaining accuracy, completeness, and logical structuring.  
@@ -89,27 +79,26 @@ You are an advanced data extraction system designed to process therapy questionn
     """
     prompt += json.dumps(json_data, indent=4)
 
-    # Use the correct Gemini model
-  
-    response = client.models.generate_content(
-    model="gemini-2.0-flash",
-    contents=prompt,
-)
+    # Model and settings come from the chat_extraction route (routing.py)
+    text = await generate_text(prompt, task="chat_extraction")
+
+    return text if text else "{}"  # Ensure safe JSON parsing
 
-    return response.text if response else "{}"  # Ensure safe JSON parsing
+if __name__ == "__main__":
+    # Load JSON Data
+    with open('therapy_questionnaire.json', 'r') as file:
+        data = json.load(file)
 
-# Load JSON Data
-with open('therapy_questionnaire.json', 'r') as file:
-    data = json.load(file)
+    async def run():
+        return await asyncio.gather(extract_information_gemini(data), json_to_md(data))
 
-extracted_data = extract_information_gemini(data)
-md_format = json_to_md(data)
+    extracted_data, md_format = asyncio.run(run())
 
-# Save Markdown output to a file
-with open("output.md", "w", encoding="utf-8") as f:
-    f.write(md_format)
+    # Save Markdown output to a file
+    with open("output.md", "w", encoding="utf-8") as f:
+        f.write(md_format)
 
-# Print confirmation message
-print("Markdown file saved as output.md")
+    # Print confirmation message
+    print("Markdown file saved as output.md")
 
 # TODO : It takes chat responses, from the chatbot model , so sort the naming shit 
\ No newline at end of file
@@ -1,3 +1,4 @@
+import io
 import os
 from dotenv import load_dotenv
 from google import genai
@@ -21,6 +22,7 @@ import json
 import firebase_admin
 from firebase_admin import credentials
 from google.cloud import firestore
+from google.api_core.exceptions import NotFound
 import re
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -38,25 +40,23 @@ from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
 # Load environment variables
 load_dotenv()
 
-# Read the API key from the environment
-api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
-
-# Initialize the genai client with the API key
-client = genai.Client(api_key=api_key)
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "secrets/hackathons-423418-ca6c603344c4.json"
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("secrets/service.json")
-firebase_admin.initialize_app(cred)
-
-# Initialize Firestore client using the same credentials
-db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+# Gemini and Firestore clients are process-wide singletons owned by clients.py
+from clients import get_firestore
+from metrics import stage
+from llm import generate_text, generate_json
+from json_repair import strip_fences
+from journal_engine import analyze_entries, JournalRecord, JOURNAL_STORE
+from prompts import PromptBuilder
+from pools import run_in_pool
+import asyncio
 
 EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
 
 
-def json_to_md(json_data):
+async def json_to_md(json_data, cache=True):
     """
     Convert JSON data to Markdown format using Gemini API.
     """
@@ -86,16 +86,14 @@ def json_to_md(json_data):
 
 
 
-    """+ json.dumps(json_data, indent=4)
+    """
+    prompt = PromptBuilder("json_to_md").text(prompt).data("", json_data).build()
     
 
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-        )
-        return response.text if response else "Error generating Markdown."
+        text = await generate_text(prompt, task="json_to_md", cache=cache)
+        return text if text else "Error generating Markdown."
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -106,13 +104,14 @@ from weasyprint import HTML, CSS
 import markdown2
 from weasyprint import HTML, CSS
 
-def save_to_pdf(markdown_content, file_name="output.pdf", logo_path="logo.svg"):
+def save_to_pdf(markdown_content, file_name=None, logo_path="logo.svg"):
     """
     Save Markdown content to a PDF file with enhanced styling and a logo.
 
     Args:
         markdown_content (str): The Markdown content to be saved.
-        file_name (str): Name of the output PDF file.
+        file_name (str): Name of the output PDF file. If None the PDF is
+            rendered in memory and its bytes are returned.
         logo_path (str): Path to the logo image (SVG or PNG).
     """
 
@@ -215,6 +214,8 @@ def save_to_pdf(markdown_content, file_name="output.pdf", logo_path="logo.svg"):
     # Generate PDF
     html = HTML(string=full_html_content, base_url=".")
     css = CSS(string=css_content)
+    if file_name is None:
+        return html.write_pdf(stylesheets=[css])
     html.write_pdf(file_name, stylesheets=[css])
 
     print(f"✅ PDF saved as {file_name}")
@@ -222,7 +223,17 @@ def save_to_pdf(markdown_content, file_name="output.pdf", logo_path="logo.svg"):
 
 
 
-def data_chat_extraction(authId, response_format="json"):
+async def fetch_user_history(authId):
+    """userHistory of the user document, or None if the document or the field is missing"""
+    doc_ref = get_firestore().collection('users').document(authId)
+    with stage("firestore_read"):
+        doc = await run_in_pool("firestore", doc_ref.get)
+    if not doc.exists:
+        return None
+    return doc.to_dict().get('userHistory')
+
+
+async def data_chat_extraction(authId, response_format="json", cache=True, user_history=None):
     prompt = """
 **#role**  
 You are an advanced data extraction system designed to process therapy questionnaire responses and convert them into structured JSON format. Your goal is to extract key details while maintaining accuracy, completeness, and logical structuring.  
@@ -251,46 +262,25 @@ You are an advanced data extraction system designed to process therapy questionn
 Input:
 """
 
-    document_id = authId
-    doc_ref = db.collection('users').document(document_id)
-    doc = doc_ref.get()
-
-    if not doc.exists:
-        return {"error": "Document not found"}
-
-    data = doc.to_dict()
-    user_history = data.get('userHistory')
+    # Callers that already read userHistory (see dataSync.updatePersona) pass it in
+    if user_history is None:
+        user_history = await fetch_user_history(authId)
 
     if not user_history:
         return {"error": "User history not found"}
 
-    prompt += json.dumps(user_history, indent=2)
-
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
-
-    response_text = response.candidates[0].content.parts[0].text.strip()
-    response_text = response_text.replace("```json", "").replace("```", "")
+    # Oldest questionnaire answers are dropped first if the history is over budget
+    prompt = PromptBuilder("chat_extraction").text(prompt).data("", user_history).build()
 
     if response_format == "json":
-        try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            json_match = re.search(r"{[\s\S]*}", response_text)
-            if json_match:
-                try:
-                    json_str = json_match.group(0)
-                    return json.loads(json_str)
-                except:
-                    pass
-            return {
-                "error": "Could not parse response",
-                "raw_response": response_text,
-            }
-    else:
-        return response_text
+        # Fences, trailing prose and truncated output are repaired while the reply streams in
+        extracted = await generate_json(prompt, task="chat_extraction", cache=cache, default=None)
+        if extracted is None:
+            return {"error": "Could not parse response"}
+        return extracted
+
+    response_text = (await generate_text(prompt, task="chat_extraction", cache=cache)).strip()
+    return strip_fences(response_text)
 
 
 
@@ -300,121 +290,155 @@ import json
 from google.cloud import firestore
 
 
-def analyze_with_llm(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
+async def analyze_with_llm(prompt, system_prompt="You are an expert psychologist analyzing journal entries.", task="journal_analysis", cache=True):
     full_prompt = f"{system_prompt}\n\n{prompt}"
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[full_prompt],  # <-- must be a list of strings or Part instances
-       
-    )
+    # task only labels the call in metrics (journal_analysis, summary, emotion, executive_summary)
+    return await generate_text([full_prompt], task=task, cache=cache)  # <-- must be a list of strings or Part instances
 
-    return response.text
 
+# Field of a journal entry doc holding its analysis (see journal_engine.stored_record)
+STORED_ANALYSIS = "analysisCache"
+# Journal entries read per Firestore page
+JOURNAL_PAGE_SIZE = int(os.getenv("JOURNAL_PAGE_SIZE", "100"))
 
-# Your analysis pipeline
-def analyze_journal_entries(authId):
-    # Firestore client
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-    # Fetch latest 10 journal entries for the user
-    journal_ref = db.collection("users").document(authId).collection("journalEntries")
-    query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(5)
-    snapshot = query.stream()
-
-    # Convert to DataFrame-compatible structure
-    records = []
-    for doc in snapshot:
-        data = doc.to_dict()
-        records.append({
-            "_id": doc.id,
-            "title": data.get("title", ""),
-            "date": data.get("date"),
-            "content": data.get("content", "")
-        })
 
-    if not records:
-        return pd.DataFrame()
+def _stored_field(analysis):
+    return {STORED_ANALYSIS: {**analysis, "analyzedAt": firestore.SERVER_TIMESTAMP}}
 
-    entries_df = pd.DataFrame(records)
 
-    # Your existing analysis logic continues here
-    analysis_results = []
-    for _, entry in entries_df.iterrows():
-        analysis_prompt = f"""
-        Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
+def save_journal_analyses(journal_ref, analyses):
+    """
+    Write fresh per-entry analyses onto their journal entry docs, 500 per
+    batch (the Firestore limit). update() rather than set(), so an entry the
+    user deleted while it was being analyzed is not recreated.
+    """
+    db = get_firestore()
+    items = list(analyses.items())
+    for start in range(0, len(items), 500):
+        chunk = items[start:start + 500]
+        batch = db.batch()
+        for entry_id, analysis in chunk:
+            batch.update(journal_ref.document(entry_id), _stored_field(analysis))
+        try:
+            batch.commit()
+        except NotFound:
+            # A batch is all or nothing: write the rest one by one, skipping deleted entries
+            for entry_id, analysis in chunk:
+                try:
+                    journal_ref.document(entry_id).update(_stored_field(analysis))
+                except NotFound:
+                    pass
 
-        Title: {entry['title']}
-        Date: {entry['date']}
-        Content: {entry['content']}
 
-        Provide a concise yet comprehensive analysis covering:
-        1. Emotional state (primary and secondary emotions)
-        2. Cognitive patterns (positive/negative, rational/irrational)
-        3. Stress indicators and coping mechanisms
-        4. Notable behavioral patterns
-        5. Key concerns or growth opportunities
-        6. Specific recommendations for improvement
+def _journal_ref(authId):
+    return get_firestore().collection("users").document(authId).collection("journalEntries")
 
-        Format your response with clear bullet points for each category.
-        """
-        analysis_text = analyze_with_llm(analysis_prompt)
 
-        summary_prompt = f"""
-        Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-        {analysis_text}
+async def fetch_journal_entries(authId, limit=None, since=None):
+    """
+    The newest `limit` journal entries (all of them if limit is None), only
+    those dated after `since` if given. Read in pages of JOURNAL_PAGE_SIZE.
 
-        Focus on the most important takeaways that the journal writer should pay attention to.
-        Format as bullet points.
-        """
-        summary_text = analyze_with_llm(summary_prompt)
+    Returns:
+        tuple: (records, stored): JournalRecords newest first, and entry_id ->
+        the analysis stored on that entry (None if it has none)
+    """
+    query = _journal_ref(authId)
+    if since is not None:
+        query = query.where("date", ">", since)
+    query = query.order_by("date", direction=firestore.Query.DESCENDING)
+
+    records, stored = [], {}
+    last = None
+    with stage("firestore_read"):
+        while limit is None or len(records) < limit:
+            size = JOURNAL_PAGE_SIZE if limit is None else min(JOURNAL_PAGE_SIZE, limit - len(records))
+            page = query.limit(size) if last is None else query.start_after(last).limit(size)
+            snapshot = await run_in_pool("firestore", lambda: list(page.stream()))
+            for doc in snapshot:
+                data = doc.to_dict()
+                records.append(JournalRecord(doc.id, data.get("title", ""), data.get("date"), data.get("content", "")))
+                stored[doc.id] = data.get(STORED_ANALYSIS)
+            if len(snapshot) < size:
+                break
+            last = snapshot[-1]
+    return records, stored
+
+
+async def analyze_stored(authId, records, stored):
+    """analyze_entries, reusing analyses stored on the entries and storing the new ones"""
+    if JOURNAL_STORE != "on":
+        return await analyze_entries(records)
+
+    async def save(analyses):
+        with stage("firestore_write"):
+            await run_in_pool("firestore", save_journal_analyses, _journal_ref(authId), analyses)
+
+    return await analyze_entries(records, stored=stored, save=save)
 
-        emotion_prompt = f"""
-        Analyze this journal entry and quantify the emotional content:
-        {entry['content']}
 
-        Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-        {EMOTIONS}
-        Example: {{"Joy": 0.5, "Sadness": 0.3, ...}}
-        """
-        try:
-            emotion_json = analyze_with_llm(
-                emotion_prompt,
-                system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-            )
-            emotion_data = json.loads(emotion_json.strip("`").replace("json\n", ""))
-        except:
-            emotion_data = {e: 0 for e in EMOTIONS}
+# Your analysis pipeline
+async def analyze_journal_entries(authId, since=None):
+    """
+    Analyze the latest 5 journal entries, or every entry dated after `since`
+    (an incremental persona update passes its watermark).
+
+    An entry whose analysis fails holds back itself and every newer entry,
+    so a watermark set from `through` never skips it: the next update
+    fetches them again (reusing the stored analyses of those that worked).
+
+    Returns:
+        tuple: (analyses, through): one dict per entry, newest first, and the
+        date of the newest entry covered (`since` if none)
+    """
+    records, stored = await fetch_journal_entries(authId, 5 if since is None else None, since)
+    if not records:
+        return [], since
 
-        analysis_results.append({
-            "entry_id": entry["_id"],
-            "date": entry["date"],
-            "title": entry["title"],
-            "analysis": analysis_text,
-            "summary": summary_text,
-            "emotions": emotion_data,
-        })
+    # Entries run in parallel; one that fails is left out instead of failing the refresh.
+    # Unedited entries reuse the analysis stored with them
+    analysis_results = await analyze_stored(authId, records, stored)
 
-    return json.dumps(analysis_results, indent=2, default=str)
+    analyzed = {record.entry_id for record in analysis_results}
+    failed = [record.date for record in records if record.entry_id not in analyzed]
+    if failed:
+        oldest_failure = min(failed)
+        analysis_results = [record for record in analysis_results if record.date < oldest_failure]
+    through = analysis_results[0].date if analysis_results else since
+
+    # Dicts without the raw text, newest entry first; generate_rag serializes them compactly
+    return [record.to_dict(content=False) for record in analysis_results], through
 
 
 # Set modern visualization style
 plt.style.use('seaborn-v0_8-whitegrid')
 sns.set_palette("viridis")
 
-def analyze_with_llm_1(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
+async def analyze_with_llm_1(prompt, system_prompt="You are an expert psychologist analyzing journal entries.", task="journal_analysis", cache=True):
     full_prompt = f"{system_prompt}\n\n{prompt}"
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[full_prompt],  # <-- must be a list of strings or Part instances
-       
-    )
+    # task only labels the call in metrics (journal_analysis, summary, emotion, executive_summary)
+    return await generate_text([full_prompt], task=task, cache=cache)  # <-- must be a list of strings or Part instances
+
+def _png_bytes():
+    # Render the current matplotlib figure to PNG in memory and close it
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png", dpi=300, bbox_inches="tight")
+    plt.close()
+    return buffer.getvalue()
+
+def generate_visualizations(records):
+    """
+    Generate professional visualizations with proper error handling
 
-    return response.text
+    Args:
+        records (list): Analyzed JournalRecords; only the per-chart numbers
+            become DataFrames, for the daily means
 
-def generate_visualizations(analysis_df,filename):
-    """Generate professional visualizations with proper error handling"""
+    Returns:
+        list: (chart_name, png_bytes) tuples, in report order
+    """
     try:
         nltk.download("vader_lexicon", quiet=True)
         sia = SentimentIntensityAnalyzer()
@@ -422,7 +446,7 @@ def generate_visualizations(analysis_df,filename):
         print(f"Error initializing sentiment analyzer: {e}")
         return []
 
-    chart_paths = []
+    charts = []
     
     # Set consistent color palette and style
     colors_palette = ["#4361EE", "#3A0CA3", "#7209B7", "#F72585", "#4CC9F0"]
@@ -433,14 +457,14 @@ def generate_visualizations(analysis_df,filename):
 
     # 1. Sentiment Trend Chart
     sentiment_scores = []
-    for _, row in analysis_df.iterrows():
+    for record in records:
         try:
-            text = f"{row['title']} {row.get('content', '')} {row.get('analysis', '')}"
+            text = f"{record.title} {record.content or ''} {record.analysis or ''}"
             sentiment = sia.polarity_scores(text)
-            sentiment["date"] = row["date"].date() if hasattr(row["date"], 'date') else row["date"]
+            sentiment["date"] = record.date.date() if hasattr(record.date, 'date') else record.date
             sentiment_scores.append(sentiment)
         except Exception as e:
-            print(f"Error analyzing sentiment for entry {row.get('title')}: {e}")
+            print(f"Error analyzing sentiment for entry {record.title}: {e}")
 
     if not sentiment_scores:
         print("Warning: No valid sentiment scores generated")
@@ -529,28 +553,26 @@ def generate_visualizations(analysis_df,filename):
 
 
     plt.tight_layout()
-    plt.savefig(f"{filename}-mood_trend.png", dpi=300, bbox_inches="tight")
-    chart_paths.append(f"{filename}-mood_trend.png")
-    plt.close()
+    charts.append(("mood_trend", _png_bytes()))
 
     # 2. Emotion Analysis
     try:
         # Process emotion data with validation
         valid_emotions = []
-        for _, row in analysis_df.iterrows():
-            if isinstance(row.get("emotions"), dict):
+        for record in records:
+            if isinstance(record.emotions, dict):
                 emotions = {
                     k: float(v)
-                    for k, v in row["emotions"].items()
+                    for k, v in record.emotions.items()
                     if k in EMOTIONS and 0 <= float(v) <= 1
                 }
                 if emotions:
-                    emotions["date"] = row["date"].date() if hasattr(row["date"], 'date') else row["date"]
+                    emotions["date"] = record.date.date() if hasattr(record.date, 'date') else record.date
                     valid_emotions.append(emotions)
 
         if not valid_emotions:
             print("Warning: No valid emotion data found")
-            return chart_paths
+            return charts
 
         emotion_df = pd.DataFrame(valid_emotions)
 
@@ -591,9 +613,7 @@ def generate_visualizations(analysis_df,filename):
         ax.spines['right'].set_visible(False)
         ax.grid(axis='x', linestyle='--', alpha=0.3)
         plt.tight_layout()
-        plt.savefig(f"{filename}-emotional_composition.png", dpi=300, bbox_inches="tight")
-        chart_paths.append(f"{filename}-emotional_composition.png")
-        plt.close()
+        charts.append(("emotional_composition", _png_bytes()))
 
         # 3. Emotion Radar Chart with improved styling
         if len(emotion_df) > 1:
@@ -620,8 +640,7 @@ def generate_visualizations(analysis_df,filename):
                 ax.plot([angles[i], angles[i]], [0, 1], color="grey", alpha=0.1, linewidth=0.5)
 
             # Plot each day with custom styling
-            for i, (_, row) in enumerate(emotion_df.iterrows()):
-                values = row[categories].values.flatten().tolist()
+            for i, (date, values) in enumerate(zip(emotion_df["date"], emotion_df[categories].to_numpy().tolist())):
                 values += values[:1]
                 
                 # Plot line
@@ -630,7 +649,7 @@ def generate_visualizations(analysis_df,filename):
                     values,
                     linewidth=2,
                     linestyle="solid",
-                    label=str(row["date"]),
+                    label=str(date),
                     color=colors_palette[i % len(colors_palette)],
                     alpha=0.8,
                 )
@@ -663,14 +682,12 @@ def generate_visualizations(analysis_df,filename):
             )
             
             plt.tight_layout()
-            plt.savefig(f"{filename}-emotion_radar.png", dpi=300, bbox_inches="tight")
-            chart_paths.append(f"{filename}-emotion_radar.png")
-            plt.close()
+            charts.append(("emotion_radar", _png_bytes()))
 
     except Exception as e:
         print(f"Error generating emotion charts: {e}")
 
-    return chart_paths
+    return charts
 
 def format_text_for_pdf(text):
     """Convert markdown-style formatting to ReportLab HTML tags"""
@@ -714,15 +731,45 @@ def add_centered_svg_logo(elements, svg_path, target_width=2.5*inch):
         elements.append(Spacer(1, 20))
     except Exception as e:
         print(f"Error loading SVG: {e}")
-def generate_pdf_report(analysis_df, chart_paths,filename):
-    """Generate comprehensive PDF report with enhanced UI"""
-    #fstring for filename={filename}-ss
+async def build_executive_summary(summaries):
+    """Ask the LLM for the executive summary that opens the MindLog report"""
+    all_summaries = "\n".join(str(s) for s in summaries) if summaries else "No summary data available"
 
+    summary_prompt = f"""Create a well-structured executive summary from these insights:
+        {all_summaries}
+        
+        Return formatted with clear sections:
+        ### Key Patterns
+        - Bullet point 1
+        - Bullet point 2
+        
+        ### Emotional Trends  
+        - Bullet point 1
+        - Bullet point 2
+        
+        ### Recommendations
+        - Bullet point 1
+        - Bullet point 2
+        """
+
+    return await analyze_with_llm_1(summary_prompt, task="executive_summary")
+
+def generate_pdf_report(records, charts, executive_summary=None):
+    """
+    Generate comprehensive PDF report with enhanced UI
+
+    Args:
+        records (list): Analyzed JournalRecords, newest first
+        charts (list): (chart_name, png_bytes) tuples from generate_visualizations
 
+    Returns:
+        bytes: The PDF document
+    """
+    buffer = io.BytesIO()
 
     # Enhanced page setup
     doc = SimpleDocTemplate(
-        f"{filename}-journal_analysis_report.pdf",
+        buffer,
         pagesize=letter,
         rightMargin=50,
         leftMargin=50,
@@ -895,8 +942,8 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
 
     # Enhanced date range handling
     try:
-        if "date" in analysis_df.columns and len(analysis_df) > 0:
-            dates = pd.to_datetime(analysis_df["date"])
+        if records:
+            dates = pd.to_datetime([record.date for record in records])
             date_min = dates.min().strftime("%B %d, %Y")
             date_max = dates.max().strftime("%B %d, %Y")
             if date_min == date_max:
@@ -914,7 +961,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
     
     # Add summary stats box
     stats_data = [
-        ['📊 Total Entries', str(len(analysis_df))],
+        ['📊 Total Entries', str(len(records))],
         ['📈 Analysis Type', 'Comprehensive Psychological Assessment'],
         ['🎯 Focus Areas', 'Emotions • Patterns • Insights • Recommendations']
     ]
@@ -941,29 +988,11 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
 
     # Generate comprehensive summary
     try:
-        if "summary" in analysis_df.columns:
-            all_summaries = "\n".join(analysis_df["summary"].astype(str))
-        else:
-            all_summaries = "No summary data available"
-
-        summary_prompt = f"""Create a well-structured executive summary from these insights:
-        {all_summaries}
-        
-        Return formatted with clear sections:
-        ### Key Patterns
-        - Bullet point 1
-        - Bullet point 2
-        
-        ### Emotional Trends  
-        - Bullet point 1
-        - Bullet point 2
-        
-        ### Recommendations
-        - Bullet point 1
-        - Bullet point 2
-        """
-
-        executive_summary = analyze_with_llm_1(summary_prompt)
+        # The executive summary is normally produced up front (see
+        # collect_mindlog_analysis) so this function can run without LLM access
+        if executive_summary is None:
+            summaries = [str(record.summary) for record in records]
+            executive_summary = asyncio.run(build_executive_summary(summaries))
         
         # Process summary with enhanced formatting
         current_section = None
@@ -1016,20 +1045,20 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
     elements.append(Paragraph("📝 <b>Detailed Entry Analysis</b>", styles['SectionHeader']))
     elements.append(Spacer(1, 15))
 
-    if "title" in analysis_df.columns and "summary" in analysis_df.columns:
-        for idx, (_, row) in enumerate(analysis_df.iterrows(), 1):
+    if records:
+        for idx, record in enumerate(records, 1):
             # Enhanced date handling
             try:
-                if hasattr(row["date"], 'strftime'):
-                    date_str = row["date"].strftime("%A, %B %d, %Y")
+                if hasattr(record.date, 'strftime'):
+                    date_str = record.date.strftime("%A, %B %d, %Y")
                 else:
-                    date_str = str(row["date"])
+                    date_str = str(record.date)
             except:
                 date_str = "Unknown date"
 
             # Entry header with numbering and enhanced styling
             entry_header = Paragraph(
-                f"<b>Entry #{idx}: {row['title']}</b>", 
+                f"<b>Entry #{idx}: {record.title}</b>", 
                 styles['EntryHeader']
             )
             elements.append(entry_header)
@@ -1040,7 +1069,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
             elements.append(Spacer(1, 8))
 
             # Process summary with enhanced bullet points
-            summary_text = str(row["summary"]) if pd.notna(row["summary"]) else ""
+            summary_text = str(record.summary) if record.summary is not None else ""
             for line_num, line in enumerate(summary_text.split("\n"), 1):
                 line = line.strip()
                 if line:
@@ -1067,7 +1096,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
             elements.append(Spacer(1, 15))
             
             # Add separator between entries
-            if idx < len(analysis_df):
+            if idx < len(records):
                 separator_line = Table([['']], colWidths=[6*inch])
                 separator_line.setStyle(TableStyle([
                     ('BACKGROUND', (0,0), (-1,-1), colors_theme['accent']),
@@ -1081,7 +1110,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
         )
 
     # Enhanced Visualizations Section
-    if chart_paths:
+    if charts:
         elements.append(PageBreak())
         elements.append(
             Paragraph("📊 <b>Psychological Trends Visualization</b>", styles['SectionHeader'])
@@ -1112,12 +1141,8 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
             }
         }
 
-        for idx, chart_path in enumerate(chart_paths, 1):
-            chart_info = None
-            for key, info in chart_descriptions.items():
-                if key in chart_path:
-                    chart_info = info
-                    break
+        for idx, (chart_name, chart_png) in enumerate(charts, 1):
+            chart_info = chart_descriptions.get(chart_name)
             
             if chart_info:
                 # Chart title
@@ -1131,7 +1156,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
             # Insert chart with enhanced styling
             try:
                 # Create a frame around the image
-                img_table = Table([[Image(chart_path, width=6*inch, height=4*inch)]], 
+                img_table = Table([[Image(io.BytesIO(chart_png), width=6*inch, height=4*inch)]], 
                                 colWidths=[6.5*inch])
                 img_table.setStyle(TableStyle([
                     ('ALIGN', (0,0), (-1,-1), 'CENTER'),
@@ -1147,9 +1172,9 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
                 elements.append(Spacer(1, 25))
                 
             except Exception as e:
-                print(f"Could not include image {chart_path}: {e}")
+                print(f"Could not include image {chart_name}: {e}")
                 elements.append(
-                    Paragraph(f"⚠️ Chart visualization unavailable: {chart_path}", 
+                    Paragraph(f"⚠️ Chart visualization unavailable: {chart_name}", 
                              styles['HighlightBox'])
                 )
                 elements.append(Spacer(1, 15))
@@ -1176,7 +1201,7 @@ def generate_pdf_report(analysis_df, chart_paths,filename):
 
     # Generate enhanced PDF
     doc.build(elements)
-    return f"{filename}-journal_analysis_report.pdf"
+    return buffer.getvalue()
 
 
 
@@ -1201,6 +1226,70 @@ def format_text_for_pdf(text):
     return text
 
 
+async def collect_mindlog_analysis(authId, numdays):
+    """
+    I/O half of the MindLog report: fetch journal entries and run the LLM analysis
+
+    Args:
+        authId (str): User authentication ID for Firestore query
+        numdays (int): Number of most recent entries to analyze
+
+    Returns:
+        tuple: (analysis_results, executive_summary), or None when the user has no entries;
+        analysis_results are JournalRecords, newest first
+    """
+    # Step 1: Retrieve journal entries from Firestore
+    print("Step 1/4: Retrieving journal entries...")
+    records, stored = await fetch_journal_entries(authId, numdays)
+
+    if not records:
+        print("No journal entries found for this user.")
+        return None
+
+    print(f"Retrieved {len(records)} entries.")
+
+    # Step 2: Analyze entries with LLM (entries in parallel, see journal_engine.py);
+    # entries unchanged since the last report reuse their stored analysis
+    print("Step 2/4: Analyzing entries...")
+    analysis_results = await analyze_stored(authId, records, stored)
+
+    try:
+        executive_summary = await build_executive_summary([r.summary for r in analysis_results])
+    except Exception as e:
+        print(f"Error generating summary: {e}")
+        executive_summary = ""
+    print("Analysis complete.")
+
+    return analysis_results, executive_summary
+
+
+def render_mindlog_charts(analysis_results):
+    """Step 3 of the MindLog report; no network calls, safe for a worker process"""
+    print("Step 3/4: Generating visualizations...")
+    charts = generate_visualizations(analysis_results)
+    print(f"Created {len(charts)} charts.")
+    return charts
+
+
+def build_mindlog_pdf(analysis_results, charts, executive_summary):
+    """Step 4 of the MindLog report; no network calls, safe for a worker process"""
+    print("Step 4/4: Generating PDF report...")
+    report_pdf = generate_pdf_report(analysis_results, charts, executive_summary=executive_summary)
+    print(f"\nReport successfully generated ({len(report_pdf)} bytes)")
+    return report_pdf
+
+
+def render_mindlog_report(analysis_results, executive_summary):
+    """
+    CPU half of the MindLog report: charts + PDF, entirely in memory.
+
+    Returns:
+        bytes: The PDF document
+    """
+    charts = render_mindlog_charts(analysis_results)
+    return build_mindlog_pdf(analysis_results, charts, executive_summary)
+
+
 def gen_mindlogpdf(authId,numdays,filename):
     """
     Main function to generate psychological journal analysis PDF report
@@ -1215,111 +1304,14 @@ def gen_mindlogpdf(authId,numdays,filename):
     print("--------------------------------")
     
     try:
-        # Step 1: Retrieve journal entries from Firestore
-        print("Step 1/4: Retrieving journal entries...")
-        # Use the already initialized db from your setup
-        
-        journal_ref = db.collection("users").document(authId).collection("journalEntries")
-        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(numdays)
-        snapshot = query.stream()
-
-        # Convert to DataFrame-compatible structure
-        records = []
-        for doc in snapshot:
-            data = doc.to_dict()
-            records.append({
-                "entry_id": doc.id,
-                "title": data.get("title", ""),
-                "date": data.get("date"),
-                "content": data.get("content", "")
-            })
-
-        if not records:
-            print("No journal entries found for this user.")
+        collected = asyncio.run(collect_mindlog_analysis(authId, numdays))
+        if collected is None:
             return None
 
-        entries_df = pd.DataFrame(records)
-        print(f"Retrieved {len(entries_df)} entries.")
-
-        # Step 2: Analyze entries with LLM
-        print("Step 2/4: Analyzing entries...")
-        analysis_results = []
-        
-        for _, entry in entries_df.iterrows():
-            # Comprehensive psychological analysis
-            analysis_prompt = f"""
-            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
-
-            Title: {entry['title']}
-            Date: {entry['date']}
-            Content: {entry['content']}
-
-            Provide a concise yet comprehensive analysis covering:
-            1. Emotional state (primary and secondary emotions)
-            2. Cognitive patterns (positive/negative, rational/irrational)
-            3. Stress indicators and coping mechanisms
-            4. Notable behavioral patterns
-            5. Key concerns or growth opportunities
-            6. Specific recommendations for improvement
-
-            Format your response with clear bullet points for each category.
-            """
-            analysis_text = analyze_with_llm_1(analysis_prompt)
-
-            # Generate summary
-            summary_prompt = f"""
-            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-            {analysis_text}
-
-            Focus on the most important takeaways that the journal writer should pay attention to.
-            Format as bullet points.
-            """
-            summary_text = analyze_with_llm_1(summary_prompt)
-
-            # Emotion quantification
-            emotion_prompt = f"""
-            Analyze this journal entry and quantify the emotional content:
-            {entry['content']}
-
-            Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-            {EMOTIONS}
-            Example: {{"Joy": 0.5, "Sadness": 0.3, "Anger": 0.1, "Fear": 0.2, "Surprise": 0.0, "Disgust": 0.0, "Trust": 0.4, "Anticipation": 0.3}}
-            """
-            try:
-                emotion_json = analyze_with_llm_1(
-                    emotion_prompt,
-                    system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-                )
-                # Clean the JSON response
-                emotion_json_clean = emotion_json.strip().strip('`').replace('json\n', '').replace('json', '')
-                emotion_data = json.loads(emotion_json_clean)
-            except Exception as e:
-                print(f"Error parsing emotion data: {e}")
-                emotion_data = {e: 0 for e in EMOTIONS}
-
-            analysis_results.append({
-                "entry_id": entry["entry_id"],
-                "date": entry["date"],
-                "title": entry["title"],
-                "content": entry["content"],
-                "analysis": analysis_text,
-                "summary": summary_text,
-                "emotions": emotion_data,
-            })
-
-        analysis_df = pd.DataFrame(analysis_results)
-        print("Analysis complete.")
-
-        # Step 3: Generate visualizations
-        print("Step 3/4: Generating visualizations...")
-        chart_paths = generate_visualizations(analysis_df,filename)
-        print(f"Created {len(chart_paths)} charts.")
-
-        # Step 4: Generate PDF report
-        print("Step 4/4: Generating PDF report...")
-        report_path = generate_pdf_report(analysis_df, chart_paths,filename)
-        print(f"\nReport successfully generated: {report_path}")
-        
+        analysis_results, executive_summary = collected
+        report_path = f"{filename}-journal_analysis_report.pdf"
+        with open(report_path, "wb") as f:
+            f.write(render_mindlog_report(analysis_results, executive_summary))
         return report_path
 
     except Exception as e:
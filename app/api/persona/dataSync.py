@@ -1,47 +1,66 @@
 import asyncio
-from data import data_chat_extraction, analyze_journal_entries
-from conv import extract_information_gemini, generate_rag, extract_graph_info
+from data import data_chat_extraction, analyze_journal_entries, fetch_user_history
+from conv import extract_information_gemini, generate_rag, extract_graph_info, extract_persona, merge_persona
+from pools import run_in_pool
+from singleflight import SingleFlight, FirestoreLeaseBackend, LocalLeaseBackend, LEASE_BACKEND
 
-import firebase_admin
-from firebase_admin import credentials
 from google.cloud import firestore
+from clients import get_firestore
+from metrics import stage, PERSONA_UPDATES
+import hashlib
 import json
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("service.json")
+load_dotenv()
+
+# "combined": info + graph in one structured-output call; "separate": the two original prompts
+PERSONA_EXTRACTION = os.getenv("PERSONA_EXTRACTION", "combined")
+# "incremental": merge only data newer than the persona's watermark; "full": always rebuild
+PERSONA_UPDATE = os.getenv("PERSONA_UPDATE", "incremental")
+# Merges in a row before the next refresh rebuilds from scratch, so drift cannot pile up
+PERSONA_MAX_MERGES = int(os.getenv("PERSONA_MAX_MERGES", "20"))
 
 def isPersonaUpdateNeeded(authId=None, updateRequired=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+    db = get_firestore()
 
     if updateRequired is not None:
         # If updated is provided, update the user's persona update status
         user_ref = db.collection("users").document(authId)
-        user_ref.set({"updatePersona": updateRequired}, merge=True)
+        with stage("firestore_write"):
+            user_ref.set({"updatePersona": updateRequired}, merge=True)
         return updateRequired
 
     user_ref = db.collection("users").document(authId)
-    user_doc = user_ref.get()
+    with stage("firestore_read"):
+        user_doc = user_ref.get()
     if user_doc.exists:
         updateNeeded = user_doc.to_dict().get("updatePersona", True)
         return updateNeeded
     return True
 
-def personaInfo(authId=None, newInfo=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+def personaInfo(authId=None, newInfo=None, watermark=None):
+    db = get_firestore()
 
     user_ref = db.collection("users").document(authId)
     persona_ref = user_ref.collection("persona")
-    doc_snapshots = persona_ref.get()
+    with stage("firestore_read"):
+        doc_snapshots = persona_ref.get()
     
     if(newInfo is not None):
         # If newInfo is provided, update or create the document
-        if doc_snapshots:
-            # Update the first document if it exists
-            first_doc = doc_snapshots[0]
-            first_doc.reference.set({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP}, merge=True)
-        else:
-            # Create a new document with the provided info
-            persona_ref.add({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP})
+        with stage("firestore_write"):
+            fields = {"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP}
+            if watermark is not None:
+                fields["Watermark"] = watermark
+            if doc_snapshots:
+                # Update the first document if it exists
+                first_doc = doc_snapshots[0]
+                first_doc.reference.set(fields, merge=True)
+            else:
+                # Create a new document with the provided info
+                persona_ref.add(fields)
 
     # If no newInfo is provided, just retrieve the existing info
     # Initialize persona_info_value to None
@@ -54,28 +73,238 @@ def personaInfo(authId=None, newInfo=None):
             persona_info_value = first_doc_data.get("Info") # Get the "Info" field
     # print(f"Persona Info Value: {persona_info_value}")  # Debugging line to check the value
     return persona_info_value
-    
-async def updatePersona(authId=None, user_message=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
 
-    # Step 1: Extract chat + journal data using authId
-    chat_data = data_chat_extraction(authId, "json")
-    journal_json = analyze_journal_entries(authId)
+def personaRecord(authId=None):
+    """
+    The stored persona document: "Info" (the persona JSON string), "Date"
+    (when it was written) and "Watermark" (the inputs folded into it; absent
+    for personas written before incremental updates, which the next refresh
+    rebuilds).
+
+    Returns:
+        dict: the document's fields, empty if the user has no persona yet
+    """
+    db = get_firestore()
+
+    with stage("firestore_read"):
+        doc_snapshots = db.collection("users").document(authId).collection("persona").limit(1).get()
+    if not doc_snapshots:
+        return {}
+    return doc_snapshots[0].to_dict() or {}
 
-    # Step 2: Generate combined RAG result
-    rag_result = generate_rag(chat_data=chat_data, journal_analysis=journal_json)
 
-    # Step 3: Extract info + graph in parallel
-    info_task = asyncio.to_thread(extract_information_gemini, rag_result)
-    graph_task = asyncio.to_thread(extract_graph_info, rag_result)
-    info_json, graph_json = await asyncio.gather(info_task, graph_task)
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
-    # Step 4: Store the extracted info and graph in Firestore
+def historyMark(history):
+    # Which userHistory answers a persona includes: list length or map keys, plus a digest to spot edits
+    if isinstance(history, dict):
+        return {"historyKeys": sorted(history), "historyDigest": _digest(history)}
+    if isinstance(history, list):
+        return {"historyCount": len(history), "historyDigest": _digest(history)}
+    return {"historyDigest": _digest(history)}
+
+def historyDelta(history, watermark):
+    """
+    userHistory answers added since the watermark (empty if none).
+
+    Returns None when answers already folded into the persona were edited or
+    removed: a merge cannot take those back out, so only a rebuild is correct.
+    """
+    if isinstance(history, dict) and "historyKeys" in watermark:
+        seen = set(watermark["historyKeys"])
+        old = {key: value for key, value in history.items() if key in seen}
+        delta = {key: value for key, value in history.items() if key not in seen}
+    elif isinstance(history, list) and "historyCount" in watermark:
+        old = history[:watermark["historyCount"]]
+        delta = history[watermark["historyCount"]:]
+        if len(old) < watermark["historyCount"]:
+            return None
+    else:
+        old, delta = history, []
+    if _digest(old) != watermark.get("historyDigest"):
+        return None
+    return delta
+
+def _journal_mark(date):
+    # Firestore needs a plain datetime for the next `date > since` query
+    return date.to_pydatetime() if hasattr(date, "to_pydatetime") else date
+
+async def storePersona(authId, info_json, graph_json, watermark):
     temp = {"Info": info_json, "Graph": graph_json}
     temp_string = json.dumps(temp)
-    personaInfo(authId, newInfo=temp_string)
+    await run_in_pool("firestore", personaInfo, authId, newInfo=temp_string, watermark=watermark)
+    # The stored persona is current again
+    await run_in_pool("firestore", isPersonaUpdateNeeded, authId, updateRequired=False)
+
+async def updatePersona(authId=None, user_message=None, full=False):
+    """
+    Bring the stored persona up to date.
+
+    By default only the chat answers and journal entries newer than the
+    persona's watermark are fetched and merged into it, so the cost follows
+    the size of the change. full=True, PERSONA_UPDATE=full, a missing
+    watermark, edited history or PERSONA_MAX_MERGES merges in a row all
+    rebuild it from the whole history instead.
+    """
+    if not full and PERSONA_UPDATE == "incremental":
+        record = await run_in_pool("firestore", personaRecord, authId)
+        persona_raw, watermark = record.get("Info"), record.get("Watermark")
+        if persona_raw and watermark and watermark.get("merges", 0) < PERSONA_MAX_MERGES:
+            merged = await mergePersona(authId, json.loads(persona_raw), watermark)
+            if merged is not None:
+                return merged
+    return await rebuildPersona(authId)
+
+async def mergePersona(authId, persona, watermark):
+    """Fold the deltas since `watermark` into `persona`; None if it needs a rebuild instead"""
+    user_history, (journal_delta, journal_through) = await asyncio.gather(
+        fetch_user_history(authId), analyze_journal_entries(authId, since=watermark.get("journalDate"))
+    )
+    history_delta = historyDelta(user_history, watermark)
+    if history_delta is None:
+        return None
+
+    info_json, graph_json = persona.get("Info"), persona.get("Graph")
+    if not history_delta and not journal_delta:
+        # Nothing new since the last refresh: no model call at all
+        await run_in_pool("firestore", isPersonaUpdateNeeded, authId, updateRequired=False)
+        PERSONA_UPDATES.labels(mode="unchanged").inc()
+        return info_json, graph_json
+
+    try:
+        info_json, graph_json = await merge_persona(info_json, graph_json, history_delta, journal_delta)
+    except Exception as e:
+        # Schema mismatch: start over from the full history rather than keep a bad merge
+        print(f"Incremental persona merge failed, rebuilding: {e}")
+        return None
+
+    watermark = {
+        **historyMark(user_history),
+        "journalDate": _journal_mark(journal_through),
+        "merges": watermark.get("merges", 0) + 1,
+    }
+    await storePersona(authId, info_json, graph_json, watermark)
+    PERSONA_UPDATES.labels(mode="merged").inc()
+    return info_json, graph_json
+
+
+async def rebuildPersona(authId):
+    # Step 1: Extract chat + journal data using authId (independent, so in parallel)
+    user_history = await fetch_user_history(authId)
+    chat_data, (journal_json, journal_through) = await asyncio.gather(
+        data_chat_extraction(authId, "json", user_history=user_history), analyze_journal_entries(authId)
+    )
+
+    # Step 2: Generate combined RAG result
+    rag_result = await generate_rag(chat_data=chat_data, journal_analysis=journal_json)
+
+    # Step 3: Extract info + graph
+    info_json, graph_json = await extractPersona(rag_result)
+
+    # Step 4: Store the extracted info and graph, with the watermark later merges start from
+    watermark = {**historyMark(user_history), "journalDate": _journal_mark(journal_through), "merges": 0}
+    await storePersona(authId, info_json, graph_json, watermark)
+    PERSONA_UPDATES.labels(mode="rebuilt").inc()
+
+    return info_json, graph_json
+
+
+async def extractPersona(rag_result):
+    if PERSONA_EXTRACTION == "combined":
+        try:
+            return await extract_persona(rag_result)
+        except Exception as e:
+            # Schema mismatch or a model without structured output: use the two separate prompts
+            print(f"Combined persona extraction failed, falling back to separate calls: {e}")
+
+    return await asyncio.gather(extract_information_gemini(rag_result), extract_graph_info(rag_result))
+
+
+# One persona refresh per authId at a time, shared by every caller
+persona_flight = SingleFlight(
+    LocalLeaseBackend() if LEASE_BACKEND == "local" else FirestoreLeaseBackend(get_firestore)
+)
+
+async def storedPersona(authId):
+    # The persona another worker just refreshed, or None if it is still stale
+    if await run_in_pool("firestore", isPersonaUpdateNeeded, authId):
+        return None
+    persona_raw = await run_in_pool("firestore", personaInfo, authId)
+    if not persona_raw:
+        return None
+    persona_data = json.loads(persona_raw)
+    return persona_data.get("Info"), persona_data.get("Graph")
+
+async def refreshPersona(authId, full=False):
+    """
+    updatePersona with per-authId single-flight: concurrent callers, in this
+    process or in other workers, share one pipeline run and its result. A
+    full refresh does not settle for an incremental one already running; it
+    runs its own rebuild after it.
+    """
+    return await persona_flight.run(
+        authId,
+        lambda: updatePersona(authId, full=full),
+        None if full else (lambda: storedPersona(authId)),
+        strong=full,
+    )
+
+
+# Stale-while-revalidate: at most this many background refreshes run at once
+PERSONA_REFRESH_CONCURRENCY = int(os.getenv("PERSONA_REFRESH_CONCURRENCY", "2"))
+_refresh_slots = None
+_revalidating = set()
+_background = set()
+
+async def _revalidate(authId):
+    global _refresh_slots
+    if _refresh_slots is None:
+        _refresh_slots = asyncio.Semaphore(PERSONA_REFRESH_CONCURRENCY)
+    try:
+        async with _refresh_slots:
+            await refreshPersona(authId)
+    except Exception as e:
+        print(f"Background persona refresh failed for {authId}: {e}")
+    finally:
+        _revalidating.discard(authId)
+
+def revalidatePersona(authId):
+    """
+    Schedule a background refresh unless one is already pending for authId.
+
+    Returns:
+        bool: True if a refresh is pending or running for this user
+    """
+    if authId in _revalidating or persona_flight.inflight(authId):
+        return True
+    _revalidating.add(authId)
+    task = asyncio.create_task(_revalidate(authId))
+    # Keep a reference so the task is not garbage collected mid-flight
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return True
+
+async def stalePersona(authId):
+    """
+    Last stored persona for immediate use, refreshing it in the background if
+    it is flagged as outdated.
+
+    Returns:
+        tuple: (info, age_seconds, refreshing). info is None and age_seconds
+        None when the user has no persona yet.
+    """
+    record, update_needed = await asyncio.gather(
+        run_in_pool("firestore", personaRecord, authId),
+        run_in_pool("firestore", isPersonaUpdateNeeded, authId),
+    )
+    info, date = record.get("Info"), record.get("Date")
 
-    # Step 5: update the user's persona update status
-    isPersonaUpdateNeeded(authId,updateRequired=False) 
+    age_seconds = None
+    if isinstance(date, datetime):
+        age_seconds = round((datetime.now(timezone.utc) - date).total_seconds(), 1)
 
-    return info_json, graph_json
\ No newline at end of file
+    refreshing = False
+    if update_needed or info is None:
+        refreshing = revalidatePersona(authId)
+    return info, age_seconds, refreshing
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+import time
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from google.genai import types
+
+from schemas import PersonaInfo
+
+load_dotenv()
+
+# Offline stand-in for google.genai.Client, switched on with FAKE_GENAI=on (see clients.py).
+# Replies are canned but shaped like the real ones for every prompt in conv.py, chat.py
+# and data.py, so the whole pipeline can be load-tested without network or quota.
+
+# Median time for a whole reply, and the spread of the lognormal it is drawn from
+FAKE_GENAI_LATENCY_MS = float(os.getenv("FAKE_GENAI_LATENCY_MS", "800"))
+FAKE_GENAI_LATENCY_SIGMA = float(os.getenv("FAKE_GENAI_LATENCY_SIGMA", "0.4"))
+# Share of the reply time spent before the first streamed chunk
+FAKE_GENAI_FIRST_CHUNK = float(os.getenv("FAKE_GENAI_FIRST_CHUNK", "0.25"))
+FAKE_GENAI_CHUNK_CHARS = int(os.getenv("FAKE_GENAI_CHUNK_CHARS", "64"))
+# Share of calls that fail, and the HTTP codes they fail with
+FAKE_GENAI_ERROR_RATE = float(os.getenv("FAKE_GENAI_ERROR_RATE", "0"))
+FAKE_GENAI_ERROR_CODES = [int(code) for code in os.getenv("FAKE_GENAI_ERROR_CODES", "429,503").split(",")]
+# Seeds the latency / error draws; reply text depends only on the prompt
+FAKE_GENAI_SEED = int(os.getenv("FAKE_GENAI_SEED", "0"))
+
+EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
+
+# (marker in the system instruction or prompt, kind of reply), first match wins
+MARKERS = [
+    ("structured data extraction and inference system for psychological profiles", "persona"),
+    ("kept up to date as new data arrives", "persona"),
+    ("generate a scored JSON schema", "graph"),
+    ("parse and format JSON data into a well-defined schema", "info"),
+    ("advanced mental health reasoning agent", "rag"),
+    ("compassionate and skilled therapist", "chat"),
+    ("Return one item in results per entry", "journal_batch"),
+    ("fill every part of the response schema", "journal_entry"),
+    ("quantify the emotional content", "emotion"),
+    ("Summarize this psychological analysis", "summary"),
+    ("executive summary", "executive_summary"),
+    ("Analyze this journal entry as a psychologist", "journal_analysis"),
+    ("therapy questionnaire responses", "chat_extraction"),
+    ("Markdown format", "json_to_md"),
+]
+
+PHRASES = [
+    "Reports ongoing stress at work", "Sleeps poorly during busy weeks", "Close to a sibling",
+    "Exercises to manage anxiety", "Not Provided", "Feels self-critical about performance",
+    "Enjoys time outdoors with friends", "Previously diagnosed with generalized anxiety",
+]
+LABELS = ["Summary", "Details", "Duration", "Impact", "Notes"]
+TRAITS = ["Confidence", "Self-worth", "Competence", "Resilience", "Optimism"]
+PEOPLE = ["Family", "Friends", "Partner", "Colleagues", "Sibling"]
+SYMPTOMS = ["Anxiety", "Insomnia", "Irritability", "Low mood", "Fatigue"]
+ENTRY_ID = re.compile(r'"entry_id":"([^"]*)"')
+RAG_SECTIONS = [
+    "EXTRACTED INFORMATION", "SYMPTOM ANALYSIS", "BEHAVIORAL PATTERNS", "PSYCHOLOGICAL FORMULATION",
+    "RISK ASSESSMENT", "STRENGTHS AND RESOURCES", "RECOMMENDATIONS",
+]
+
+
+class FakeAPIError(Exception):
+    """Carries .code like google.genai.errors.APIError, so retries and breakers treat it the same"""
+
+    def __init__(self, code, message="injected by fake_genai"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _text(value):
+    # Prompt text of contents / system_instruction (str, list, Content or Part)
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return "\n".join(_text(item) for item in value)
+    parts = getattr(value, "parts", None)
+    if parts is not None:
+        return "\n".join(part.text or "" for part in parts)
+    return getattr(value, "text", None) or ""
+
+
+def _pick(rng, options, count):
+    return rng.sample(options, min(count, len(options)))
+
+
+def _info(rng):
+    return {
+        section: [{"label": label, "value": rng.choice(PHRASES)} for label in _pick(rng, LABELS, 2)]
+        for section in PersonaInfo.model_fields
+    }
+
+
+def _graph(rng):
+    return {
+        "selfPerception": [{"name": name, "score": rng.randint(1, 10)} for name in _pick(rng, TRAITS, 3)],
+        "relationships": [{"name": name, "score": rng.randint(1, 10)} for name in _pick(rng, PEOPLE, 3)],
+        "symptoms": [{"name": name, "severity": rng.randint(1, 10)} for name in _pick(rng, SYMPTOMS, 3)],
+    }
+
+
+def _bullets(rng, count):
+    return "\n".join(f"- {phrase}" for phrase in _pick(rng, PHRASES, count))
+
+
+def _journal_entry(rng):
+    return {
+        "analysis": canned_reply("journal_analysis", rng),
+        "insights": _pick(rng, PHRASES, 2),
+        "emotions": {emotion: round(rng.random(), 2) for emotion in EMOTIONS},
+    }
+
+
+def canned_reply(kind, rng, json_mode=False, prompt=""):
+    """Reply text for one kind of prompt; JSON replies come fenced, as Gemini often sends them, unless json_mode"""
+    if kind == "persona":
+        return json.dumps({"info": _info(rng), "graph": _graph(rng)})
+    if kind in ("info", "graph", "emotion", "rag", "chat_extraction"):
+        if kind == "info":
+            data = _info(rng)
+        elif kind == "graph":
+            data = _graph(rng)
+        elif kind == "emotion":
+            data = {emotion: round(rng.random(), 2) for emotion in EMOTIONS}
+        elif kind == "rag":
+            data = {section: " ".join(_pick(rng, PHRASES, 4)) for section in RAG_SECTIONS}
+        else:
+            data = {
+                "Personal Information": {"Name": "unclear", "Age": "unclear"},
+                "Employment & Lifestyle": {"Employment Status": rng.choice(PHRASES)},
+                "Mental Health History": {"Past Diagnoses": rng.choice(PHRASES)},
+                "Support System": {"Social Support": rng.choice(PHRASES)},
+            }
+        text = json.dumps(data, indent=2)
+        return text if json_mode else f"```json\n{text}\n```"
+    if kind == "journal_entry":
+        return json.dumps(_journal_entry(rng))
+    if kind == "journal_batch":
+        # One result per entry_id listed in the prompt
+        return json.dumps({"results": [
+            {"entry_id": entry_id, **_journal_entry(rng)} for entry_id in ENTRY_ID.findall(prompt)
+        ]})
+    if kind == "summary":
+        return _bullets(rng, 2)
+    if kind == "journal_analysis":
+        categories = ["Emotional state", "Cognitive patterns", "Stress and coping", "Behavioral patterns",
+                      "Concerns and growth", "Recommendations"]
+        return "\n".join(f"**{category}**\n{_bullets(rng, 2)}" for category in categories)
+    if kind == "executive_summary":
+        return "\n\n".join(f"### {title}\n{_bullets(rng, 2)}"
+                           for title in ("Key Patterns", "Emotional Trends", "Recommendations"))
+    if kind == "json_to_md":
+        return "# Profile\n\n" + "\n\n".join(f"## {title}\n{_bullets(rng, 3)}"
+                                             for title in ("Background", "Experiences", "Well-being"))
+    if kind == "chat":
+        return " ".join(
+            ["It sounds like this has been weighing on you."] + _pick(rng, PHRASES, 3)
+            + ["What feels most important to talk through right now?"]
+        )
+    return "Canned reply from the offline Gemini stand-in."
+
+
+def _response(text, prompt_chars=0, usage=True):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=math.ceil(prompt_chars / 4),
+            candidates_token_count=math.ceil(len(text) / 4),
+            total_token_count=math.ceil(prompt_chars / 4) + math.ceil(len(text) / 4),
+        ) if usage else None,
+    )
+
+
+class FakeClient:
+    """
+    Same surface as the genai.Client calls this service makes: models.get,
+    models.generate_content(_stream), their client.aio twins, and aio.caches.
+    """
+
+    def __init__(self):
+        self._rng = random.Random(FAKE_GENAI_SEED)
+        self._caches = {}
+        self._cache_ids = itertools.count(1)
+        self.calls = 0
+        self.models = _Models(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self), caches=_AsyncCaches(self))
+
+    def _plan(self, model, contents, config):
+        """(reply text, prompt chars, latency seconds, error or None) for one call"""
+        self.calls += 1
+        system = _text(getattr(config, "system_instruction", None))
+        cached = getattr(config, "cached_content", None)
+        if cached:
+            if cached not in self._caches:
+                return None, 0, 0.05, FakeAPIError(404, f"cached content {cached} not found")
+            system = self._caches[cached]
+        prompt = _text(contents)
+
+        kind = next((kind for marker, kind in MARKERS if marker in system), None)
+        kind = kind or next((kind for marker, kind in MARKERS if marker in prompt), None)
+        if kind is None:
+            kind = "persona" if getattr(config, "response_schema", None) is not None else "default"
+        json_mode = getattr(config, "response_mime_type", None) == "application/json"
+        # Same prompt, same reply
+        seed = int(hashlib.sha256(f"{model}\n{system}\n{prompt}".encode("utf-8")).hexdigest()[:16], 16)
+        text = canned_reply(kind, random.Random(seed), json_mode, prompt)
+
+        latency = FAKE_GENAI_LATENCY_MS / 1000 * math.exp(self._rng.gauss(0, FAKE_GENAI_LATENCY_SIGMA))
+        error = None
+        if self._rng.random() < FAKE_GENAI_ERROR_RATE:
+            error = FakeAPIError(self._rng.choice(FAKE_GENAI_ERROR_CODES))
+        return text, len(system) + len(prompt), latency, error
+
+    @staticmethod
+    def _chunks(text):
+        return [text[i:i + FAKE_GENAI_CHUNK_CHARS] for i in range(0, len(text), FAKE_GENAI_CHUNK_CHARS)] or [""]
+
+    def close(self):
+        pass
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, model):
+        return SimpleNamespace(name=f"models/{model}")
+
+    def generate_content(self, model, contents, config=None):
+        text, prompt_chars, latency, error = self._client._plan(model, contents, config)
+        if error is not None:
+            time.sleep(latency * FAKE_GENAI_FIRST_CHUNK)
+            raise error
+        time.sleep(latency)
+        return _response(text, prompt_chars)
+
+    def generate_content_stream(self, model, contents, config=None):
+        text, prompt_chars, latency, error = self._client._plan(model, contents, config)
+        time.sleep(latency * FAKE_GENAI_FIRST_CHUNK)
+        if error is not None:
+            raise error
+        chunks = self._client._chunks(text)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(latency * (1 - FAKE_GENAI_FIRST_CHUNK) / (len(chunks) - 1))
+            yield _response(chunk, prompt_chars, usage=i == len(chunks) - 1)
+
+
+class _AsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def get(self, model):
+        return SimpleNamespace(name=f"models/{model}")
+
+    async def generate_content(self, model, contents, config=None):
+        text, prompt_chars, latency, error = self._client._plan(model, contents, config)
+        if error is not None:
+            await asyncio.sleep(latency * FAKE_GENAI_FIRST_CHUNK)
+            raise error
+        await asyncio.sleep(latency)
+        return _response(text, prompt_chars)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        # Like the real client, nothing is "sent" until the first chunk is pulled
+        async def stream():
+            text, prompt_chars, latency, error = self._client._plan(model, contents, config)
+            await asyncio.sleep(latency * FAKE_GENAI_FIRST_CHUNK)
+            if error is not None:
+                raise error
+            chunks = self._client._chunks(text)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(latency * (1 - FAKE_GENAI_FIRST_CHUNK) / (len(chunks) - 1))
+                yield _response(chunk, prompt_chars, usage=i == len(chunks) - 1)
+        return stream()
+
+
+class _AsyncCaches:
+    def __init__(self, client):
+        self._client = client
+
+    async def create(self, model, config):
+        name = f"cachedContents/fake-{next(self._client._cache_ids)}"
+        self._client._caches[name] = _text(config.system_instruction)
+        return SimpleNamespace(name=name, model=model)
+
+    async def update(self, name, config):
+        if name not in self._client._caches:
+            raise FakeAPIError(404, f"cached content {name} not found")
+        return SimpleNamespace(name=name)
+
+    async def delete(self, name):
+        self._client._caches.pop(name, None)
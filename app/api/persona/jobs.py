@@ -0,0 +1,414 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from clients import get_firestore
+from pools import run_in_pool
+from metrics import current_route
+
+load_dotenv()
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# "firestore" keeps jobs in the reportJobs collection, "local" in JSON files under JOB_STORE_DIR
+JOB_STORE = os.getenv("JOB_STORE", "firestore")
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", ".jobs")
+# A worker owns a job while its lease is fresh; it renews every third of this.
+# Jobs whose owner stopped renewing are taken over by another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Firestore documents are capped at 1 MiB, so stored reports are split into chunks below that
+ARTIFACT_CHUNK_BYTES = 900 * 1024
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+UNFINISHED = (QUEUED, RUNNING)
+
+
+def _claimable(job, owner, now):
+    # Unfinished, and either ours already or its owner's lease has run out
+    if job is None or job.get("status") not in UNFINISHED:
+        return False
+    return job.get("owner") in (None, owner) or job.get("leaseUntil", 0) <= now
+
+
+class FirestoreJobStore:
+    """Job documents in the top-level `reportJobs` collection"""
+
+    def _collection(self):
+        return get_firestore().collection("reportJobs")
+
+    def save(self, job):
+        self._collection().document(job["id"]).set(job)
+
+    def load(self, job_id):
+        doc = self._collection().document(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def unfinished(self):
+        query = self._collection().where("status", "in", list(UNFINISHED))
+        return [doc.to_dict() for doc in query.stream()]
+
+    def claim(self, job_id, owner, lease_seconds):
+        """Take or renew the job's lease; the job with the new lease, or None if someone else holds it"""
+        from google.cloud import firestore
+
+        ref = self._collection().document(job_id)
+
+        @firestore.transactional
+        def take(transaction):
+            snapshot = ref.get(transaction=transaction)
+            job = snapshot.to_dict() if snapshot.exists else None
+            now = time.time()
+            if not _claimable(job, owner, now):
+                return None
+            job["owner"] = owner
+            job["leaseUntil"] = now + lease_seconds
+            transaction.update(ref, {"owner": owner, "leaseUntil": job["leaseUntil"]})
+            return job
+
+        return take(get_firestore().transaction())
+
+    def _artifacts(self):
+        return get_firestore().collection("reportArtifacts")
+
+    def save_artifact(self, artifact):
+        """Keep a job's document with the job, as `reportArtifacts/{id}` plus its `chunks`"""
+        ref = self._artifacts().document(artifact.id)
+        chunks = [artifact.data[i:i + ARTIFACT_CHUNK_BYTES] for i in range(0, len(artifact.data), ARTIFACT_CHUNK_BYTES)]
+        for index, chunk in enumerate(chunks):
+            ref.collection("chunks").document(str(index)).set({"data": chunk})
+        # Written last, so a reader never sees a document whose chunks are not all there
+        ref.set({"filename": artifact.filename, "contentType": artifact.content_type,
+                 "chunks": len(chunks), "createdAt": artifact.created})
+
+    def load_artifact(self, artifact_id):
+        """(data, filename, content_type) of a stored document, or None"""
+        ref = self._artifacts().document(artifact_id)
+        doc = ref.get()
+        if not doc.exists:
+            return None
+        meta = doc.to_dict()
+        chunks = [ref.collection("chunks").document(str(index)).get() for index in range(meta["chunks"])]
+        if not all(chunk.exists for chunk in chunks):
+            return None
+        return b"".join(chunk.to_dict()["data"] for chunk in chunks), meta["filename"], meta["contentType"]
+
+
+class LocalJobStore:
+    """One JSON file per job; good enough for a single machine or local dev"""
+
+    def __init__(self, directory=JOB_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job):
+        # Write then rename so a crash never leaves a half-written job behind
+        tmp_path = self._path(job["id"]) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, self._path(job["id"]))
+
+    def load(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def unfinished(self):
+        jobs = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                job = self.load(name[:-len(".json")])
+                if job and job.get("status") in UNFINISHED:
+                    jobs.append(job)
+        return jobs
+
+    @contextmanager
+    def _locked(self):
+        # One flock()ed file serializes claims between processes on this machine
+        import fcntl
+
+        with open(os.path.join(self.directory, ".claim.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def claim(self, job_id, owner, lease_seconds):
+        with self._locked():
+            job = self.load(job_id)
+            now = time.time()
+            if not _claimable(job, owner, now):
+                return None
+            job["owner"] = owner
+            job["leaseUntil"] = now + lease_seconds
+            self.save(job)
+            return job
+
+    def _artifact_path(self, artifact_id, suffix):
+        return os.path.join(self.directory, "artifacts", f"{artifact_id}{suffix}")
+
+    def save_artifact(self, artifact):
+        os.makedirs(os.path.join(self.directory, "artifacts"), exist_ok=True)
+        data_path = self._artifact_path(artifact.id, ".bin")
+        with open(data_path + ".tmp", "wb") as f:
+            f.write(artifact.data)
+        os.replace(data_path + ".tmp", data_path)
+        # The metadata file is written last and marks the document complete
+        meta_path = self._artifact_path(artifact.id, ".json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"filename": artifact.filename, "contentType": artifact.content_type,
+                       "createdAt": artifact.created}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def load_artifact(self, artifact_id):
+        try:
+            with open(self._artifact_path(artifact_id, ".json")) as f:
+                meta = json.load(f)
+            with open(self._artifact_path(artifact_id, ".bin"), "rb") as f:
+                return f.read(), meta["filename"], meta["contentType"]
+        except FileNotFoundError:
+            return None
+
+
+class JobQueue:
+    """
+    Runs registered job kinds on a fixed number of asyncio workers.
+
+    Every state change is written to the store. Each job carries an owner and
+    a lease that its worker renews while the job is queued or running here;
+    when a worker dies its leases run out and another worker (or the next
+    start) takes the jobs over. A worker that finds its lease taken stops
+    the job instead of running it twice.
+    """
+
+    def __init__(self, store, concurrency=JOB_CONCURRENCY, lease_seconds=JOB_LEASE_SECONDS):
+        self.store = store
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers = {}
+        self._queue = None
+        self._workers = []
+        # Jobs this worker holds the lease of (queued here or running), and the tasks running them
+        self._held = {}
+        self._running = {}
+
+    def register(self, kind, handler):
+        """handler(progress, **params) -> JSON-serializable result; see JobProgress"""
+        self.handlers[kind] = handler
+
+    async def _save(self, job):
+        job["updatedAt"] = time.time()
+        await run_in_pool("firestore", self.store.save, dict(job))
+
+    async def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "status": QUEUED,
+            "progress": 0,
+            "stage": "queued",
+            "attempts": 0,
+            "result": None,
+            "error": None,
+            "emailed": False,
+            "owner": self.owner,
+            "leaseUntil": time.time() + self.lease_seconds,
+            "createdAt": time.time(),
+        }
+        await self._save(job)
+        self._held[job["id"]] = job
+        await self._queue.put(job)
+        return job
+
+    async def get(self, job_id):
+        return await run_in_pool("firestore", self.store.load, job_id)
+
+    async def save_artifact(self, artifact):
+        """
+        Keep a finished job's document in the job store. Job results are read
+        after restarts and from other workers, so a download handle in one must
+        not depend on this process's in-memory artifact store.
+        """
+        await run_in_pool("firestore", self.store.save_artifact, artifact)
+
+    async def load_artifact(self, artifact_id):
+        """(data, filename, content_type) saved by save_artifact, or None"""
+        # Ids come from the download URL: anything but a hex id is not one of ours
+        if not artifact_id.isalnum():
+            return None
+        return await run_in_pool("firestore", self.store.load_artifact, artifact_id)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        # Resume jobs left over from a previous run whose owner is gone, oldest first
+        resumed = await self.resume_expired()
+        if resumed:
+            print(f"Resuming {resumed} unfinished report jobs")
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._workers.append(asyncio.create_task(self._keeper()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def resume_expired(self):
+        """Queue here every unfinished job whose lease has run out; returns how many"""
+        leftovers = await run_in_pool("firestore", self.store.unfinished)
+        now = time.time()
+        resumed = 0
+        for job in sorted(leftovers, key=lambda j: j.get("createdAt", 0)):
+            if job["id"] in self._held or job.get("kind") not in self.handlers or not _claimable(job, None, now):
+                continue
+            claimed = await run_in_pool("firestore", self.store.claim, job["id"], self.owner, self.lease_seconds)
+            if claimed is None:
+                # Another worker got there first
+                continue
+            claimed["status"] = QUEUED
+            claimed["stage"] = "resumed"
+            self._held[claimed["id"]] = claimed
+            await self._queue.put(claimed)
+            resumed += 1
+        return resumed
+
+    async def _keeper(self):
+        # Renew our leases; once per lease period, take over jobs of dead workers
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            for job_id, job in list(self._held.items()):
+                try:
+                    claimed = await run_in_pool("firestore", self.store.claim, job_id, self.owner, self.lease_seconds)
+                except Exception as e:
+                    print(f"Could not renew the lease of job {job_id}: {e}")
+                    continue
+                if claimed is None:
+                    self._lost(job_id)
+                else:
+                    job["leaseUntil"] = claimed["leaseUntil"]
+            ticks += 1
+            if ticks % 3 == 0:
+                try:
+                    await self.resume_expired()
+                except Exception as e:
+                    print(f"Could not look for orphaned jobs: {e}")
+
+    def _lost(self, job_id):
+        # Another worker took the job over (our lease ran out): stop our copy
+        print(f"Lost the lease of job {job_id}; leaving it to its new owner")
+        self._held.pop(job_id, None)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job["id"] not in self._held:
+                    continue
+                task = asyncio.create_task(self._run(job))
+                self._running[job["id"]] = task
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    if not task.cancelled() or job["id"] in self._held:
+                        # The worker itself is shutting down
+                        task.cancel()
+                        raise
+                finally:
+                    self._running.pop(job["id"], None)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        # Label this job's stage metrics by job kind rather than "background"
+        current_route.set(f"job:{job['kind']}")
+        job["status"] = RUNNING
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["startedAt"] = time.time()
+        await self._save(job)
+
+        progress = JobProgress(job, self._save)
+        try:
+            result = await self.handlers[job["kind"]](progress, **job["params"])
+        except asyncio.CancelledError:
+            # Worker shut down mid-job (or the lease was lost): leave it as running
+            # so whoever holds the lease next resumes it
+            raise
+        except Exception as e:
+            job["error"] = str(e)
+            if job["attempts"] < JOB_MAX_ATTEMPTS and getattr(e, "status_code", 500) >= 500:
+                job["status"] = QUEUED
+                job["stage"] = "retrying"
+                await self._save(job)
+                await self._queue.put(job)
+            else:
+                job["status"] = FAILED
+                job["stage"] = "failed"
+                job["finishedAt"] = time.time()
+                await self._save(job)
+                self._held.pop(job["id"], None)
+            return
+
+        job["status"] = SUCCEEDED
+        job["progress"] = 100
+        job["stage"] = "done"
+        job["result"] = result
+        job["error"] = None
+        job["finishedAt"] = time.time()
+        await self._save(job)
+        self._held.pop(job["id"], None)
+
+
+class JobProgress:
+    """
+    What a job handler gets as `progress`: await progress(percent, stage)
+    records how far it got. `emailed` / mark_emailed() let a handler send its
+    email only once, even if the job is retried or resumed after sending it.
+    """
+
+    def __init__(self, job, save):
+        self._job = job
+        self._save = save
+
+    async def __call__(self, percent, stage):
+        self._job["progress"] = percent
+        self._job["stage"] = stage
+        await self._save(self._job)
+
+    @property
+    def emailed(self):
+        return bool(self._job.get("emailed"))
+
+    async def mark_emailed(self):
+        self._job["emailed"] = True
+        await self._save(self._job)
+
+
+def public_view(job):
+    """What GET /jobs/{id} returns; params can hold the user's email so they stay private"""
+    return {key: value for key, value in job.items() if key != "params"}
+
+
+job_queue = JobQueue(LocalJobStore() if JOB_STORE == "local" else FirestoreJobStore())
@@ -0,0 +1,428 @@
+import asyncio
+import hashlib
+import os
+from dotenv import load_dotenv
+from google.genai import types
+
+from llm import generate_text, generate_json
+from json_repair import parse_json
+from metrics import JOURNAL_ENTRIES, JOURNAL_STORED
+from prompts import compact_json, count_tokens
+from routing import ROUTES, route_model
+from schemas import JournalEntryAnalysis, JournalEntryResult, JournalBatchAnalysis
+
+load_dotenv()
+
+# Journal entries analyzed at once per batch; Gemini calls are further capped process-wide by LLM_CONCURRENCY
+JOURNAL_CONCURRENCY = int(os.getenv("JOURNAL_CONCURRENCY", "8"))
+# "combined": analysis, summary and emotions in one structured-output call; "separate": three calls
+JOURNAL_ANALYSIS = os.getenv("JOURNAL_ANALYSIS", "combined")
+# Combined mode only: entries packed into one call (1 = one call per entry), and the
+# input tokens of entry text one batch may hold
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "1"))
+JOURNAL_BATCH_TOKENS = int(os.getenv("JOURNAL_BATCH_TOKENS", "6000"))
+# "on": keep each entry's analysis on its Firestore doc and reuse it until the entry is edited
+JOURNAL_STORE = os.getenv("JOURNAL_STORE", "on")
+# Bump when the prompts or the record shape change, so stored analyses are redone
+ANALYSIS_VERSION = "1"
+
+EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
+
+PSYCHOLOGIST = "You are an expert psychologist analyzing journal entries."
+EMOTION_TOOL = "You are an emotion analysis tool. Return ONLY valid JSON."
+
+
+class JournalRecord:
+    """
+    One journal entry and, once analyzed, its analysis, summary and emotion
+    scores. Both the persona and the MindLog paths pass these around; slots
+    keep a report over hundreds of entries small in memory and when pickled
+    to the render pool.
+    """
+    __slots__ = ("entry_id", "title", "date", "content", "analysis", "summary", "emotions")
+
+    def __init__(self, entry_id, title="", date=None, content="", analysis=None, summary=None, emotions=None):
+        self.entry_id = str(entry_id)
+        self.title = title
+        self.date = date
+        self.content = content
+        self.analysis = analysis
+        self.summary = summary
+        self.emotions = emotions
+
+    def analyzed(self, analysis, summary, emotions):
+        self.analysis, self.summary, self.emotions = analysis, summary, emotions
+        return self
+
+    def to_dict(self, content=True):
+        # For prompts and JSON; the persona prompts take the analysis, not the raw text
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        if not content:
+            del data["content"]
+        return data
+
+    def __repr__(self):
+        return f"JournalRecord({self.entry_id!r}, {self.title!r}, analyzed={self.analysis is not None})"
+
+
+def analysis_prompt(entry):
+    return f"""
+        Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
+
+        Title: {entry.title}
+        Date: {entry.date}
+        Content: {entry.content}
+
+        Provide a concise yet comprehensive analysis covering:
+        1. Emotional state (primary and secondary emotions)
+        2. Cognitive patterns (positive/negative, rational/irrational)
+        3. Stress indicators and coping mechanisms
+        4. Notable behavioral patterns
+        5. Key concerns or growth opportunities
+        6. Specific recommendations for improvement
+
+        Format your response with clear bullet points for each category.
+        """
+
+
+def summary_prompt(analysis_text):
+    return f"""
+        Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
+        {analysis_text}
+
+        Focus on the most important takeaways that the journal writer should pay attention to.
+        Format as bullet points.
+        """
+
+
+def emotion_prompt(entry):
+    return f"""
+        Analyze this journal entry and quantify the emotional content:
+        {entry.content}
+
+        Return ONLY a JSON dictionary with values between 0-1 for these emotions:
+        {EMOTIONS}
+        Example: {{"Joy": 0.5, "Sadness": 0.3, "Anger": 0.1, "Fear": 0.2, "Surprise": 0.0, "Disgust": 0.0, "Neutral": 0.4}}
+        """
+
+
+def combined_prompt(entry):
+    return f"""
+        Analyze this journal entry as a psychologist and fill every part of the response schema:
+
+        Title: {entry.title}
+        Date: {entry.date}
+        Content: {entry.content}
+
+        analysis: concise yet comprehensive, with clear bullet points for each category:
+        1. Emotional state (primary and secondary emotions)
+        2. Cognitive patterns (positive/negative, rational/irrational)
+        3. Stress indicators and coping mechanisms
+        4. Notable behavioral patterns
+        5. Key concerns or growth opportunities
+        6. Specific recommendations for improvement
+
+        insights: the 1-2 most important actionable takeaways the journal writer should pay attention to.
+
+        emotions: how strongly the entry expresses each of {EMOTIONS}, from 0 to 1.
+        """
+
+
+def batch_prompt(entries):
+    return f"""
+        Analyze each of the journal entries below as a psychologist, independently of the others.
+        Return one item in results per entry, with its entry_id copied exactly, filled in like this:
+
+        analysis: concise yet comprehensive, with clear bullet points for each category:
+        1. Emotional state (primary and secondary emotions)
+        2. Cognitive patterns (positive/negative, rational/irrational)
+        3. Stress indicators and coping mechanisms
+        4. Notable behavioral patterns
+        5. Key concerns or growth opportunities
+        6. Specific recommendations for improvement
+
+        insights: the 1-2 most important actionable takeaways the journal writer should pay attention to.
+
+        emotions: how strongly the entry expresses each of {EMOTIONS}, from 0 to 1.
+
+        Entries:
+        {compact_json([_entry_fields(entry) for entry in entries])}
+        """
+
+
+def _entry_fields(entry):
+    return {"entry_id": entry.entry_id, "title": entry.title, "date": entry.date, "content": entry.content}
+
+
+def pack_batches(entries, size=JOURNAL_BATCH_SIZE, budget=JOURNAL_BATCH_TOKENS):
+    """
+    Split entries, in order, into batches of at most `size` entries and
+    `budget` tokens of entry text. An entry over the budget on its own gets
+    a batch to itself.
+
+    Returns:
+        list: lists of indexes into `entries`
+    """
+    batches, current, used = [], [], 0
+    for index, entry in enumerate(entries):
+        tokens = count_tokens(compact_json(_entry_fields(entry)))
+        if current and (len(current) >= size or used + tokens > budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Calls that produce an analysis in each mode (batch mode retries misses one by one)
+MODE_TASKS = {
+    "separate": ["journal_analysis", "summary", "emotion"],
+    "combined": ["journal_entry"],
+    "batch": ["journal_batch", "journal_entry"],
+}
+
+
+def analysis_mode():
+    if JOURNAL_ANALYSIS != "combined":
+        return "separate"
+    return "batch" if JOURNAL_BATCH_SIZE > 1 else "combined"
+
+
+def analysis_setup():
+    """Everything besides the entry that shapes its analysis: prompt version, mode, and each call's model and settings"""
+    mode = analysis_mode()
+    return [ANALYSIS_VERSION, mode, [[task, route_model(task), ROUTES.get(task, {}).get("config", {})] for task in MODE_TASKS[mode]]]
+
+
+def entry_hash(entry, setup=None):
+    """Key of a stored analysis: changes when the entry is edited or the analysis setup changes"""
+    setup = analysis_setup() if setup is None else setup
+    return hashlib.sha256(compact_json([setup, entry.title, entry.content]).encode()).hexdigest()
+
+
+def stored_record(entry, stored, setup=None):
+    """The entry, analyzed from its stored analysis, or None if there is none, it is stale or incomplete"""
+    if not isinstance(stored, dict) or stored.get("hash") != entry_hash(entry, setup):
+        return None
+    analysis, summary, emotions = stored.get("analysis"), stored.get("summary"), stored.get("emotions")
+    if analysis is None or summary is None or not isinstance(emotions, dict):
+        return None
+    return entry.analyzed(analysis, summary, emotions)
+
+
+_stored_hits = 0
+_stored_misses = 0
+
+
+def stored_stats():
+    lookups = _stored_hits + _stored_misses
+    return {
+        "version": ANALYSIS_VERSION,
+        "mode": analysis_mode(),
+        "hits": _stored_hits,
+        "misses": _stored_misses,
+        "hitRate": round(_stored_hits / lookups, 3) if lookups else 0.0,
+    }
+
+
+async def _ask(prompt, task, system_prompt=PSYCHOLOGIST):
+    # Same call shape as data.analyze_with_llm: system prompt and prompt as one string part
+    return await generate_text([f"{system_prompt}\n\n{prompt}"], task=task)
+
+
+async def analyze_entry_combined(entry):
+    """
+    Analysis, summary and emotion scores of one entry from a single call,
+    constrained to the JournalEntryAnalysis schema.
+
+    Raises:
+        ValueError (pydantic.ValidationError included): if the reply does not fit the schema
+    """
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=JournalEntryAnalysis,
+    )
+    reply = JournalEntryAnalysis.model_validate(
+        await generate_json([f"{PSYCHOLOGIST}\n\n{combined_prompt(entry)}"], task="journal_entry", config=config)
+    )
+    # Same summary shape as the three-call path, so charts and PDFs need no change
+    return entry.analyzed(
+        reply.analysis, "\n".join(f"- {insight}" for insight in reply.insights), reply.emotions.model_dump()
+    )
+
+
+async def analyze_batch(entries):
+    """
+    Analysis, summary and emotion scores of several entries from one call.
+
+    Each item of the reply is validated on its own, so one malformed or cut
+    off item only loses that entry.
+
+    Returns:
+        dict: entry_id -> the entry, analyzed, for every entry the reply
+        covered; entries it left out are missing and left unanalyzed
+    """
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=JournalBatchAnalysis,
+    )
+    reply = await generate_json([f"{PSYCHOLOGIST}\n\n{batch_prompt(entries)}"], task="journal_batch", config=config)
+    by_id = {entry.entry_id: entry for entry in entries}
+
+    records = {}
+    items = reply.get("results", []) if isinstance(reply, dict) else []
+    for item in items:
+        try:
+            result = JournalEntryResult.model_validate(item)
+        except ValueError as e:
+            print(f"Dropping malformed item of a journal batch: {e}")
+            continue
+        entry = by_id.get(result.entry_id.strip())
+        if entry is None or result.entry_id.strip() in records:
+            continue
+        records[entry.entry_id] = entry.analyzed(
+            result.analysis, "\n".join(f"- {insight}" for insight in result.insights), result.emotions.model_dump()
+        )
+    return records
+
+
+async def analyze_entry(entry):
+    """
+    Analysis -> summary chain and the emotion scores of one entry. In
+    combined mode (the default) that is one structured call; otherwise, or
+    if its reply does not fit the schema, three calls, with the emotion call
+    running alongside the chain since it only needs the entry.
+    """
+    if JOURNAL_ANALYSIS == "combined":
+        try:
+            return await analyze_entry_combined(entry)
+        except ValueError as e:
+            print(f"Combined analysis of journal entry {entry.entry_id} failed, using separate calls: {e}")
+
+    async def analysis_and_summary():
+        analysis_text = await _ask(analysis_prompt(entry), "journal_analysis")
+        return analysis_text, await _ask(summary_prompt(analysis_text), "summary")
+
+    (analysis_text, summary_text), emotion_json = await asyncio.gather(
+        analysis_and_summary(), _ask(emotion_prompt(entry), "emotion", EMOTION_TOOL)
+    )
+    # Only an unparseable reply falls back to zeros; failed calls fail the entry
+    emotion_data = parse_json(emotion_json, task="emotion", default=None)
+    if not isinstance(emotion_data, dict):
+        print(f"Error parsing emotion data: {emotion_json!r}")
+        emotion_data = {e: 0 for e in EMOTIONS}
+    return entry.analyzed(analysis_text, summary_text, emotion_data)
+
+
+async def analyze_entries(entries, concurrency=JOURNAL_CONCURRENCY, stored=None, save=None):
+    """
+    Analyze journal entries in parallel, at most `concurrency` calls at a
+    time. With JOURNAL_BATCH_SIZE > 1 entries are packed into batched calls
+    (see pack_batches) and any entry a batch reply misses is retried alone.
+
+    Args:
+        entries (list): JournalRecords, in date order
+        stored (dict): entry_id -> analysis saved by an earlier run; entries whose
+            hash still matches are reused without a call
+        save: async callable taking {entry_id: analysis} for the entries analyzed
+            now; a failed save is logged, not raised
+
+    Returns:
+        list: the entries that were analyzed (in place), in the same order as
+        `entries`. An entry whose calls fail is logged and left out rather
+        than failing the batch.
+
+    Raises:
+        The first entry's error, if every entry failed (e.g. the request budget
+        ran out or the circuit is open), so callers do not mistake it for no data
+    """
+    global _stored_hits, _stored_misses
+    setup = analysis_setup()
+    reused = {}
+    if stored is not None:
+        for index, entry in enumerate(entries):
+            record = stored_record(entry, stored.get(entry.entry_id), setup)
+            if record is not None:
+                reused[index] = record
+        _stored_hits += len(reused)
+        _stored_misses += len(entries) - len(reused)
+        JOURNAL_STORED.labels(result="hit").inc(len(reused))
+        JOURNAL_STORED.labels(result="miss").inc(len(entries) - len(reused))
+    pending = [index for index in range(len(entries)) if index not in reused]
+    outcomes = await _analyze([entries[index] for index in pending], concurrency) if pending else []
+    outcomes = dict(zip(pending, outcomes))
+
+    results, errors, fresh = [], [], {}
+    for index, entry in enumerate(entries):
+        if index in reused:
+            JOURNAL_ENTRIES.labels(outcome="stored").inc()
+            results.append(reused[index])
+            continue
+        outcome = outcomes[index]
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            print(f"Analysis of journal entry {entry.entry_id} failed: {outcome}")
+            JOURNAL_ENTRIES.labels(outcome="failed").inc()
+            errors.append(outcome)
+        else:
+            JOURNAL_ENTRIES.labels(outcome="ok").inc()
+            results.append(outcome)
+            fresh[entry.entry_id] = {
+                "hash": entry_hash(entry, setup),
+                "analysis": outcome.analysis,
+                "summary": outcome.summary,
+                "emotions": outcome.emotions,
+            }
+    if errors and not results:
+        raise errors[0]
+    if save is not None and fresh:
+        try:
+            await save(fresh)
+        except Exception as e:
+            print(f"Could not store {len(fresh)} journal analyses: {e}")
+    return results
+
+
+async def _analyze(entries, concurrency):
+    # One outcome per entry, in order: its record or the exception that failed it
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(entry):
+        async with slots:
+            return await analyze_entry(entry)
+
+    if JOURNAL_ANALYSIS == "combined" and JOURNAL_BATCH_SIZE > 1:
+        outcomes = [None] * len(entries)
+
+        async def run_batch(indexes):
+            batch = [entries[index] for index in indexes]
+            records = {}
+            if len(batch) > 1:
+                async with slots:
+                    try:
+                        records = await analyze_batch(batch)
+                    except ValueError as e:
+                        print(f"Journal batch reply unusable, analyzing its {len(batch)} entries one by one: {e}")
+                    except Exception as e:
+                        # API error after retries: the whole batch fails, other batches go on
+                        for index in indexes:
+                            outcomes[index] = e
+                        return
+            # Entries the batch left out (or a batch of one) get a call of their own
+            missing = [index for index in indexes if entries[index].entry_id not in records]
+            if len(batch) > 1 and missing:
+                JOURNAL_ENTRIES.labels(outcome="batch_missing").inc(len(missing))
+            retried = await asyncio.gather(*(run(entries[index]) for index in missing), return_exceptions=True)
+            for index, outcome in zip(missing, retried):
+                outcomes[index] = outcome
+            for index in indexes:
+                if outcomes[index] is None:
+                    outcomes[index] = records[entries[index].entry_id]
+
+        await asyncio.gather(*(run_batch(indexes) for indexes in pack_batches(entries)))
+    else:
+        outcomes = await asyncio.gather(*(run(entry) for entry in entries), return_exceptions=True)
+    return outcomes
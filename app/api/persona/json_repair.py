@@ -0,0 +1,261 @@
+import json
+import re
+
+from metrics import LLM_JSON_PARSE
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+# Runs of ordinary characters inside a string, consumed in one step instead of char by char
+_STRING_RUN = {'"': re.compile(r'[^"\\]+'), "'": re.compile(r"[^'\\]+")}
+_BARE_RUN = re.compile(r"[^\s,:\[\]{}\"']+")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+_LITERALS = {"true": True, "false": False, "null": None, "none": None}
+
+# default for parse_json: raise instead of returning a fallback
+RAISE = object()
+
+
+def _bare_value(token):
+    # Unquoted token: a literal, a number, or (as a last resort) the text itself
+    literal = token.lower()
+    if literal in _LITERALS:
+        return _LITERALS[literal]
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+class JSONStreamParser:
+    """
+    Tolerant incremental JSON parser for model output.
+
+        parser = JSONStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        value = parser.close()
+
+    Each chunk is parsed as it arrives, so by the time a stream ends only
+    the closing brackets are left to do. Anything before the first { or [
+    (a ```json fence, a preamble sentence) and anything after the value
+    closes (the closing fence, trailing prose) is ignored. Repaired on the
+    way: trailing and missing commas, missing colons, single-quoted strings,
+    unquoted keys, Python literals (True / None), and output cut off at the
+    token limit (open strings and containers are closed, a dangling key is
+    dropped).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.done = False
+        self.repaired = False
+        self._started = False
+        # One frame per open container: [container, pending key, expecting]
+        # expecting is "key", "colon", "value" or "comma"
+        self._stack = []
+        self._string = None  # [quote, chars, pending escape] while inside a string
+        self._bare = None  # chars of an unquoted token being read
+
+    def feed(self, chunk):
+        """Parse another piece of the text; True once the top-level value is complete"""
+        i, n = 0, len(chunk)
+        while i < n and not self.done:
+            if self._string is not None:
+                i = self._feed_string(chunk, i)
+                continue
+            if self._bare is not None:
+                match = _BARE_RUN.match(chunk, i)
+                if match:
+                    self._bare.append(match.group())
+                    i = match.end()
+                    continue
+                self._end_bare()
+                continue
+
+            char = chunk[i]
+            i += 1
+            if not self._started:
+                if char in "{[":
+                    self._started = True
+                    self._open(char)
+                continue
+            if char in " \t\r\n":
+                continue
+            if char in "{[":
+                self._before_value()
+                self._open(char)
+            elif char in "}]":
+                self._close_top()
+            elif char == ",":
+                frame = self._stack[-1]
+                if frame[2] == "comma":
+                    frame[2] = "key" if isinstance(frame[0], dict) else "value"
+                else:
+                    # Doubled or misplaced comma
+                    self.repaired = True
+            elif char == ":":
+                frame = self._stack[-1]
+                if frame[2] == "colon":
+                    frame[2] = "value"
+                else:
+                    self.repaired = True
+            elif char in "\"'":
+                self._before_value()
+                if char == "'":
+                    self.repaired = True
+                self._string = [char, [], None]
+            else:
+                self._before_value()
+                self._bare = [char]
+        return self.done
+
+    def _feed_string(self, chunk, i):
+        quote, chars, escape = self._string
+        if escape is not None:
+            # Inside a backslash escape, possibly split across chunks (\uXXXX)
+            escape += chunk[i]
+            i += 1
+            if escape[0] == "u":
+                if len(escape) < 5:
+                    self._string[2] = escape
+                    return i
+                try:
+                    chars.append(chr(int(escape[1:], 16)))
+                except ValueError:
+                    chars.append("\\" + escape)
+            else:
+                chars.append(_ESCAPES.get(escape, escape))
+            self._string[2] = None
+            return i
+        match = _STRING_RUN[quote].match(chunk, i)
+        if match:
+            chars.append(match.group())
+            return match.end()
+        if chunk[i] == "\\":
+            self._string[2] = ""
+            return i + 1
+        # Closing quote
+        self._string = None
+        self._emit("".join(chars))
+        return i + 1
+
+    def _end_bare(self):
+        token = "".join(self._bare)
+        self._bare = None
+        frame = self._stack[-1] if self._stack else None
+        if frame is not None and frame[2] == "key":
+            # Unquoted key
+            self.repaired = True
+            self._emit(token)
+            return
+        value = _bare_value(token)
+        if isinstance(value, str) or token in ("True", "False", "None"):
+            self.repaired = True
+        self._emit(value)
+
+    def _before_value(self):
+        # A value starting where a comma or colon was due: assume the missing one
+        frame = self._stack[-1] if self._stack else None
+        if frame is None:
+            return
+        if frame[2] == "comma":
+            self.repaired = True
+            frame[2] = "key" if isinstance(frame[0], dict) else "value"
+        elif frame[2] == "colon":
+            self.repaired = True
+            frame[2] = "value"
+
+    def _open(self, char):
+        if char == "{":
+            self._stack.append([{}, None, "key"])
+        else:
+            self._stack.append([[], None, "value"])
+
+    def _close_top(self):
+        container, key, expecting = self._stack.pop()
+        if expecting in ("colon", "value") and isinstance(container, dict):
+            # Key without a value: drop it
+            self.repaired = True
+        self._emit(container)
+
+    def _emit(self, value):
+        if not self._stack:
+            self.root = value
+            self.done = True
+            return
+        frame = self._stack[-1]
+        container = frame[0]
+        if isinstance(container, dict):
+            if frame[2] == "key":
+                frame[1] = value if isinstance(value, str) else json.dumps(value)
+                frame[2] = "colon"
+                return
+            container[frame[1]] = value
+        else:
+            container.append(value)
+        frame[2] = "comma"
+
+    def close(self):
+        """
+        Finish parsing, closing whatever the text left open.
+
+        Raises:
+            ValueError: if the text held no { or [ at all
+        """
+        if not self._started:
+            raise ValueError("no JSON object or array in the model output")
+        if not self.done:
+            # Truncated output
+            self.repaired = True
+            if self._string is not None:
+                chars = self._string[1]
+                self._string = None
+                self._emit("".join(chars))
+            if self._bare is not None:
+                self._end_bare()
+            while not self.done:
+                self._close_top()
+        return self.root
+
+
+def strip_fences(text):
+    return _FENCE.sub("", text)
+
+
+def parse_json(text, task="llm", default=RAISE):
+    """
+    Parse JSON out of a model reply, repairing it when needed (see JSONStreamParser).
+
+    Args:
+        text (str): The reply
+        task (str): Labels the outcome (clean, repaired, failed) in metrics
+        default: Returned when no JSON can be recovered; raises ValueError if not given
+    """
+    if text:
+        try:
+            # Well-formed replies take the fast path through the C parser
+            value = json.loads(strip_fences(text))
+            LLM_JSON_PARSE.labels(task=task, outcome="clean").inc()
+            return value
+        except ValueError:
+            pass
+    parser = JSONStreamParser()
+    return finish(parser, task, default, text or "")
+
+
+def finish(parser, task="llm", default=RAISE, text=""):
+    """close() a parser fed with `text` (if given) and record how it went"""
+    try:
+        if text:
+            parser.feed(text)
+        value = parser.close()
+    except ValueError:
+        LLM_JSON_PARSE.labels(task=task, outcome="failed").inc()
+        if default is RAISE:
+            raise
+        return default
+    LLM_JSON_PARSE.labels(task=task, outcome="repaired" if parser.repaired else "clean").inc()
+    return value
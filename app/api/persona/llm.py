@@ -0,0 +1,211 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+from clients import get_genai, get_vertex
+from llm_cache import llm_cache, cache_key
+from metrics import stage
+from resilience import resilient_call, call_timeout, breaker_stats
+from prompts import record_usage, contents_chars
+from context_cache import prefix_cache, STALE_CACHE_CODES
+from json_repair import JSONStreamParser, RAISE, finish, parse_json
+from routing import resolve
+
+load_dotenv()
+
+# Gemini requests in flight at once across the process. They are coroutines on
+# the event loop (client.aio), not threads, so this can be far above a pool size.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "128"))
+
+_slots = None
+_waiting = 0
+
+
+def _semaphore():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _slots
+
+
+@asynccontextmanager
+async def _slot():
+    # One of the LLM_CONCURRENCY request slots
+    global _waiting
+    _waiting += 1
+    try:
+        await _semaphore().acquire()
+    finally:
+        _waiting -= 1
+    try:
+        yield
+    finally:
+        _semaphore().release()
+
+
+async def _with_prefix(prefix, model, config):
+    """
+    (inline_config, call_config) for a registered prefix: the inline form
+    carries the preamble itself, the call form references its context cache
+    when one is live (otherwise both are the same).
+    """
+    if prefix is None:
+        return config, config
+    inline = prefix_cache.inline_config(prefix, config)
+    cache_name = await prefix_cache.lookup(prefix, model)
+    return inline, (prefix_cache.cached_config(cache_name, inline) if cache_name else inline)
+
+
+def _stale_cache(e, inline, call_config):
+    # The referenced context cache expired or was deleted between lookup and call
+    return call_config is not inline and getattr(e, "code", None) in STALE_CACHE_CODES
+
+
+def _response_key(model, contents, config, prefix):
+    # Keyed on the inline form, so re-creating a context cache does not invalidate responses
+    key_config = prefix_cache.inline_config(prefix, config) if prefix else config
+    return cache_key(model, contents, key_config)
+
+
+async def generate_text(contents, task, model=None, config=None, cache=True, vertex=False, hedge=True,
+                        prefix=None):
+    """
+    One generate_content call on the async client, through the response cache.
+
+    Args:
+        contents: Prompt string, or a list of strings / Content parts
+        task (str): Labels the call in metrics (llm_<task>) and cache counters, and picks its route
+        model (str): Overrides the task's model from routing.ROUTES
+        config: Optional GenerateContentConfig, over the route's defaults; part of the cache key
+        cache (bool): False skips the cache lookup and store for this call
+        vertex (bool): Use the Vertex AI client instead of the API-key one
+        hedge (bool): Allow a hedged duplicate request (when LLM_HEDGE_DELAY is set)
+        prefix (str): Name of a preamble registered with context_cache.prefix_cache;
+            contents is then only the per-call suffix
+
+    Returns:
+        str: The response text
+
+    Raises:
+        resilience.DeadlineExceeded, resilience.CircuitOpen, or the last API error once retries are spent
+    """
+    model, config = resolve(task, model, config)
+    key = _response_key(model, contents, config, prefix) if cache else None
+    if key is not None:
+        text = llm_cache.get(key, task)
+        if text is not None:
+            return text
+
+    client = get_vertex() if vertex else get_genai()
+
+    async def call(call_config):
+        return await resilient_call(
+            lambda: client.aio.models.generate_content(model=model, contents=contents, config=call_config),
+            task, "vertex" if vertex else "genai", hedge=hedge,
+        )
+
+    async with _slot():
+        with stage(f"llm_{task}"):
+            inline, call_config = await _with_prefix(prefix, model, config)
+            try:
+                response = await call(call_config)
+            except Exception as e:
+                if not _stale_cache(e, inline, call_config):
+                    raise
+                prefix_cache.invalidate(prefix)
+                response = await call(inline)
+
+    record_usage(task, getattr(response, "usage_metadata", None), contents_chars(contents))
+    text = response.text if response else None
+    if key is not None:
+        llm_cache.put(key, text)
+    return text
+
+
+async def stream_text(contents, task, model=None, config=None, vertex=False, prefix=None):
+    """
+    Async generator of (text, usage_metadata) per chunk as Gemini produces it.
+    usage_metadata is None except on the chunks that carry token counts.
+    Streams are never cached or hedged; opening the stream is retried, and
+    each later chunk must arrive within the per-call timeout. `prefix` works
+    as in generate_text.
+    """
+    model, config = resolve(task, model, config)
+    client = get_vertex() if vertex else get_genai()
+
+    def open_stream(call_config):
+        async def first_chunk():
+            # The request is only sent when the first chunk is pulled, so that is what gets retried
+            stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=call_config)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+        return resilient_call(first_chunk, task, "vertex" if vertex else "genai")
+
+    usage = None
+    async with _slot():
+        with stage(f"llm_{task}"):
+            inline, call_config = await _with_prefix(prefix, model, config)
+            try:
+                stream, chunk = await open_stream(call_config)
+            except Exception as e:
+                if not _stale_cache(e, inline, call_config):
+                    raise
+                prefix_cache.invalidate(prefix)
+                stream, chunk = await open_stream(inline)
+            while chunk is not None:
+                # Counts are cumulative; the last chunk that carries them is the total
+                usage = chunk.usage_metadata or usage
+                text = ""
+                if chunk.candidates and chunk.candidates[0].content:
+                    for part in chunk.candidates[0].content.parts:
+                        text += part.text or ""
+                yield text, chunk.usage_metadata
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), call_timeout())
+                except StopAsyncIteration:
+                    chunk = None
+    record_usage(task, usage, contents_chars(contents))
+
+
+async def generate_json(contents, task, model=None, config=None, cache=True, vertex=False, prefix=None,
+                        default=RAISE):
+    """
+    Like generate_text, but returns the reply parsed as JSON.
+
+    The reply is streamed and parsed chunk by chunk as it arrives (see
+    json_repair.JSONStreamParser), so parsing overlaps with generation, and
+    fences, trailing prose, truncation and small syntax slips are repaired
+    instead of wasting the call. Only replies that parse are cached.
+
+    Raises:
+        ValueError: if no JSON can be recovered and no default is given
+    """
+    model, config = resolve(task, model, config)
+    key = _response_key(model, contents, config, prefix) if cache else None
+    if key is not None:
+        text = llm_cache.get(key, task)
+        if text is not None:
+            return parse_json(text, task, default)
+
+    parser = JSONStreamParser()
+    parts = []
+    async for text, _ in stream_text(contents, task, model=model, config=config, vertex=vertex, prefix=prefix):
+        parts.append(text)
+        parser.feed(text)
+    value = finish(parser, task, default)
+    if key is not None and parser.root is not None:
+        llm_cache.put(key, "".join(parts))
+    return value
+
+
+def llm_stats():
+    return {
+        "kind": "async",
+        "size": LLM_CONCURRENCY,
+        "active": LLM_CONCURRENCY - _slots._value if _slots is not None else 0,
+        "queued": _waiting,
+        "breakers": breaker_stats(),
+    }
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from metrics import LLM_CACHE
+
+load_dotenv()
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Path of the on-disk tier (SQLite). Empty disables it and keeps the cache in memory only.
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+
+
+def _jsonable(value):
+    # json.dumps fallback for SDK objects inside contents / config
+    if isinstance(value, type) and hasattr(value, "model_json_schema"):
+        # A pydantic class used as response_schema: key on its schema, so editing it invalidates entries
+        return value.model_json_schema()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+def cache_key(model, contents, config=None):
+    """
+    Content address of one generate_content call: sha256 over the model, the
+    prompt and the generation config, so any change to either is a new entry.
+    """
+    blob = json.dumps({"model": model, "contents": contents, "config": config}, sort_keys=True, default=_jsonable)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class DiskTier:
+    """SQLite table of key -> (text, stored_at); survives restarts and is shared by workers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, text TEXT, stored_at REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, ttl):
+        row = self._connect().execute(
+            "SELECT text, stored_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time() - ttl:
+            return None
+        return row
+
+    def put(self, key, text, stored_at):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, text, stored_at))
+
+    def purge(self, ttl):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache WHERE stored_at < ?", (time.time() - ttl,))
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM response text: an in-memory LRU with TTL in front
+    of an optional SQLite tier. Only successful, non-empty responses are
+    stored, so errors are always retried.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS, db_path=LLM_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.disk = DiskTier(db_path) if db_path else None
+        if self.disk is not None:
+            self.disk.purge(ttl)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key, task="unknown"):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                text, stored_at = item
+                if stored_at >= time.time() - self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    LLM_CACHE.labels(task=task, result="hit").inc()
+                    return text
+                del self._items[key]
+
+        if self.disk is not None:
+            row = self.disk.get(key, self.ttl)
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self.disk_hits += 1
+                LLM_CACHE.labels(task=task, result="disk_hit").inc()
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        LLM_CACHE.labels(task=task, result="miss").inc()
+        return None
+
+    def put(self, key, text):
+        if not text:
+            return
+        stored_at = time.time()
+        self._remember(key, text, stored_at)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, text, stored_at)
+            except sqlite3.Error as e:
+                print(f"LLM cache disk write failed: {e}")
+
+    def _remember(self, key, text, stored_at):
+        with self._lock:
+            self._items[key] = (text, stored_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._items),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+            "disk": self.disk.path if self.disk is not None else None,
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "hitRate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+llm_cache = LLMCache()
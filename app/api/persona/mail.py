@@ -13,6 +13,7 @@ from reportlab.graphics.renderPDF import drawToFile
 from reportlab.graphics.shapes import Rect, String, Group
 from reportlab.lib.colors import HexColor
 
+import io
 import textwrap
 import json
 from datetime import datetime
@@ -25,6 +26,7 @@ import sys
 from lxml.html.diff import htmldiff
 from os import environ as env
 import smtplib
+from metrics import stage
 from dotenv import load_dotenv
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -240,9 +242,14 @@ def draw_metric_box(c, x, y, name, score, width=200):
     # Add space after metric box
     return y - box_height - 15
 
-def create_pdf_from_json(json_data, filename):
-    """Enhanced PDF creation with improved styling, layout, and fixed logo"""
-    c = canvas.Canvas(filename, pagesize=letter)
+def create_pdf_from_json(json_data, filename=None):
+    """
+    Enhanced PDF creation with improved styling, layout, and fixed logo
+
+    Writes to `filename` if given, otherwise renders in memory and returns the PDF bytes.
+    """
+    buffer = io.BytesIO() if filename is None else None
+    c = canvas.Canvas(filename if buffer is None else buffer, pagesize=letter)
     width, height = letter
     margin = 50
     y = height - margin
@@ -450,16 +457,24 @@ def create_pdf_from_json(json_data, filename):
     c.drawRightString(width - margin, 30, f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     c.save()
+    if buffer is not None:
+        print("✅ Enhanced PDF report generated in memory")
+        return buffer.getvalue()
     print(f"✅ Enhanced PDF report generated: {filename}")
 
 
-def sendEmail(Name, To, subject, message, attachment_path=None):
-    s = smtplib.SMTP("smtp.gmail.com", 587)
-    s.starttls()
+def sendEmail(Name, To, subject, message, attachment_path=None, attachment=None, attachment_name="report.pdf"):
+    """
+    Send an email, optionally with one attachment taken either from
+    `attachment_path` on disk or from the in-memory `attachment` bytes.
+    """
+    with stage("smtp_connect"):
+        s = smtplib.SMTP("smtp.gmail.com", 587)
+        s.starttls()
 
-    email = env["EMAIL"]
-    password = env["PASSWORD"]
-    s.login(email, password)
+        email = env["EMAIL"]
+        password = env["PASSWORD"]
+        s.login(email, password)
 
     msg = MIMEMultipart("mixed")
     msg["Subject"] = subject
@@ -475,9 +490,17 @@ def sendEmail(Name, To, subject, message, attachment_path=None):
 
     if attachment_path:
         with open(attachment_path, "rb") as f:
-            part = MIMEApplication(f.read(), Name=os.path.basename(attachment_path))
-            part["Content-Disposition"] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-            msg.attach(part)
+            attachment = f.read()
+        attachment_name = os.path.basename(attachment_path)
+
+    if attachment is not None:
+        part = MIMEApplication(attachment, Name=attachment_name)
+        part["Content-Disposition"] = f'attachment; filename="{attachment_name}"'
+        msg.attach(part)
 
-    s.sendmail(Name, To, msg.as_string())
+    # as_string() is where the attachment gets base64-encoded
+    with stage("base64_encode"):
+        raw_message = msg.as_string()
+    with stage("smtp_send"):
+        s.sendmail(Name, To, raw_message)
     s.quit()
\ No newline at end of file
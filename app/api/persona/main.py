@@ -1,23 +1,79 @@
-from datetime import datetime
-import uuid
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 import os
 import json
-from tempfile import NamedTemporaryFile
-
-from data import data_chat_extraction, analyze_journal_entries,gen_mindlogpdf,json_to_md,save_to_pdf
-from conv import extract_information_gemini, generate_rag, extract_graph_info
-from mail import create_pdf_from_json, sendEmail  # You need to define this
-
-from data import create_pdf_from_json_chat
-from chat import reflection_chatbot
-from dataSync import isPersonaUpdateNeeded, personaInfo, updatePersona
-import json
-
-app = FastAPI()
+import time
+from contextlib import asynccontextmanager
+
+from chat import reflection_chatbot, reflection_chatbot_stream
+from dataSync import stalePersona, refreshPersona
+from pools import pool_stats, shutdown_pools
+from llm import llm_stats
+from reports import ReportError, generate_persona_report, generate_mindlog_report, generate_chat_summary
+from jobs import job_queue, public_view
+from clients import registry
+from artifacts import artifact_store, parse_range
+from metrics import current_route, route_label, render_metrics
+from admission import admission, Overloaded, INTERACTIVE, BATCH
+from llm_cache import llm_cache
+from resilience import request_budget, CircuitOpen, DeadlineExceeded
+from context_cache import prefix_cache
+from routing import routes
+from journal_engine import stored_stats
+
+
+# Total time the LLM calls of one request may take, retries included
+CHAT_BUDGET_SECONDS = float(os.getenv("CHAT_BUDGET_SECONDS", "60"))
+REPORT_BUDGET_SECONDS = float(os.getenv("REPORT_BUDGET_SECONDS", "900"))
+# Most journal entries one MindLog report analyzes; larger requests are cut down to it
+MINDLOG_MAX_DAYS = int(os.getenv("MINDLOG_MAX_DAYS", "90"))
+
+
+async def report_job(progress, authId, email):
+    # Queued jobs wait for a batch slot instead of being turned away
+    async with admission.slot(authId, BATCH, reject=False):
+        with request_budget(REPORT_BUDGET_SECONDS):
+            return await generate_persona_report(authId, email, progress)
+
+
+async def mindlog_job(progress, authId, email, numdays):
+    # Job results live in the job document, so they carry a download handle, not the PDF.
+    # The PDF is stored with the job, so the handle stays good wherever and whenever it is read
+    async with admission.slot(authId, BATCH, reject=False):
+        with request_budget(REPORT_BUDGET_SECONDS):
+            pdf_bytes = await generate_mindlog_report(authId, email, numdays, progress)
+    artifact = artifact_store.put(pdf_bytes, "MindLogReport.pdf")
+    await job_queue.save_artifact(artifact)
+    return {"message": "Report emailed", "download": artifact.handle(expires=False)}
+
+
+job_queue.register("report", report_job)
+job_queue.register("mindlog", mindlog_job)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Open the shared Firestore / Gemini clients before taking traffic
+    await registry.warm_up()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await prefix_cache.close()
+    shutdown_pools()
+    registry.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def label_route(request: Request, call_next):
+    # Everything done for this request (including on the thread pools) is labelled with its route
+    current_route.set(route_label(request.scope, request.app.routes))
+    return await call_next(request)
 
 origins = [
     "http://localhost.tiangolo.com",
@@ -36,6 +92,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+def too_busy(e):
+    """429 for a request admission control turned away"""
+    return JSONResponse(
+        content={"error": e.message, "retryAfter": e.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def unavailable(e):
+    """503 while the Gemini circuit is open, 504 when the request's budget ran out"""
+    headers = {"Retry-After": str(e.retry_after)} if isinstance(e, CircuitOpen) else None
+    return JSONResponse(content={"error": str(e)}, status_code=e.status_code, headers=headers)
+
+
+def mindlog_days(value):
+    """`numdays` of a MindLog request as an int capped at MINDLOG_MAX_DAYS; ValueError if it is not a positive whole number"""
+    if value is None or isinstance(value, bool):
+        raise ValueError("numdays must be a positive whole number")
+    try:
+        days = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("numdays must be a positive whole number")
+    if days < 1:
+        raise ValueError("numdays must be a positive whole number")
+    return min(days, MINDLOG_MAX_DAYS)
+
+
+async def accepted(kind, params):
+    """Enqueue a report job and answer 202 with where to poll for it"""
+    job = await job_queue.submit(kind, params)
+    return JSONResponse(
+        content={"jobId": job["id"], "status": job["status"], "statusUrl": f"/jobs/{job['id']}"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job['id']}"},
+    )
+
+
 @app.post("/getReport")
 async def get_report(request: Request):
     try:
@@ -46,74 +141,21 @@ async def get_report(request: Request):
         if not authId or not user_email:
             return JSONResponse(content={"error": "Missing authId or email in request"}, status_code=400)
 
-        # If update is needed → update and return, skip further processing
-        if isPersonaUpdateNeeded(authId):
-            info_json, graph_json = await updatePersona(authId)
-            # Step: Generate PDF report from saved persona data
-            data = {
-                "info": info_json,
-                "graph": graph_json
-            }
-
-            with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                pdf_path = tmp.name
-                create_pdf_from_json(data, pdf_path)
-
-            # Step: Send Email with PDF
-            sendEmail(
-                Name="SoulScript System",
-                To=user_email,
-                subject="Your Therapy Assessment Report",
-                message="Attached is your report. Please review the PDF for detailed insights.",
-                attachment_path=pdf_path
-            )
-
-            os.remove(pdf_path)
-            return JSONResponse(content={
-                "info": info_json,
-                "graph": graph_json,
-                "status": "Persona updated and stored. Skipping PDF generation."
-            }, status_code=200)
-
-        # Otherwise, fetch stored persona info and proceed to report/email
-        persona_raw = personaInfo(authId)
-        if not persona_raw:
-            return JSONResponse(content={"error": "Stored persona data not found"}, status_code=404)
-
-        persona_data = json.loads(persona_raw)
-        info_json = persona_data.get("Info")
-        graph_json = persona_data.get("Graph")
-
-        if not info_json or not graph_json:
-            return JSONResponse(content={"error": "Incomplete persona data"}, status_code=500)
-
-        # Step: Generate PDF report from saved persona data
-        data = {
-            "info": info_json,
-            "graph": graph_json
-        }
-
-        with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            pdf_path = tmp.name
-            create_pdf_from_json(data, pdf_path)
-
-        # Step: Send Email with PDF
-        sendEmail(
-            Name="SoulScript System",
-            To=user_email,
-            subject="Your Therapy Assessment Report",
-            message="Attached is your report. Please review the PDF for detailed insights.",
-            attachment_path=pdf_path
-        )
-
-        os.remove(pdf_path)
-
-        return JSONResponse(content={
-            "info": info_json,
-            "graph": graph_json,
-            "status": "Email sent using previously saved persona info."
-        }, status_code=200)
-
+        # "async": true → queue the report and return a job id right away
+        if payload.get("async"):
+            return await accepted("report", {"authId": authId, "email": user_email})
+
+        async with admission.slot(authId, BATCH):
+            with request_budget(REPORT_BUDGET_SECONDS):
+                result = await generate_persona_report(authId, user_email)
+        return JSONResponse(content=result, status_code=200)
+
+    except Overloaded as e:
+        return too_busy(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return unavailable(e)
+    except ReportError as e:
+        return JSONResponse(content={"error": e.message}, status_code=e.status_code)
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
@@ -124,29 +166,105 @@ async def chat(request: Request):
         payload = await request.json()
         authId = payload.get("authId")
         user_message = payload.get("userMessage")
-        user_info = personaInfo(authId)
 
         if not authId or not user_message:
             return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
 
-        if not isPersonaUpdateNeeded(authId) or not user_info is None:
+        async with admission.slot(authId, INTERACTIVE):
+            # Answer with the stored persona right away; a stale one is refreshed in the background
+            user_info, persona_age, refreshing = await stalePersona(authId)
+
             # Generate RAG response
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
-        else:
-            # Update persona and then generate RAG response
-            updatePersona(authId, user_message)
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
+            with request_budget(CHAT_BUDGET_SECONDS):
+                rag_response = await reflection_chatbot(user_message=user_message, user_info=user_info)
         if not rag_response:
             return JSONResponse(content={"error": "No response generated"}, status_code=404)
 
-        return JSONResponse(content={"response": rag_response}, status_code=200)
+        return JSONResponse(content={
+            "response": rag_response,
+            "personaAgeSeconds": persona_age,
+            "personaRefreshing": refreshing
+        }, status_code=200)
 
+    except Overloaded as e:
+        return too_busy(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return unavailable(e)
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
 
-import base64
-from fastapi.responses import JSONResponse
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Same input as /chat, answered as Server-Sent Events:
+      event: chunk  {"text": ...}          one per model chunk, as it arrives
+      event: done   {"response": ..., ...} full text plus timing / token counts
+      event: error  {"error": ...}
+    """
+    try:
+        payload = await request.json()
+        authId = payload.get("authId")
+        user_message = payload.get("userMessage")
+    except (ValueError, AttributeError):
+        # Not JSON, or JSON that is not an object
+        return JSONResponse(content={"error": "Request body must be a JSON object"}, status_code=400)
+
+    if not authId or not user_message:
+        return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
+
+    # Admit before the stream starts so a busy server can still answer with a plain 429
+    try:
+        ticket = await admission.acquire(authId, INTERACTIVE)
+    except Overloaded as e:
+        return too_busy(e)
+
+    async def events():
+        started = time.perf_counter()
+        first_token_at = None
+        response_text = ""
+        usage = None
+        try:
+            user_info, persona_age, refreshing = await stalePersona(authId)
+            with request_budget(CHAT_BUDGET_SECONDS):
+                async for text, chunk_usage in reflection_chatbot_stream(user_message=user_message, user_info=user_info):
+                    if chunk_usage is not None:
+                        usage = chunk_usage
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    response_text += text
+                    yield sse("chunk", {"text": text})
+
+            yield sse("done", {
+                "response": response_text,
+                "timeToFirstTokenMs": round(1000 * (first_token_at - started), 1) if first_token_at else None,
+                "totalMs": round(1000 * (time.perf_counter() - started), 1),
+                "promptTokens": getattr(usage, "prompt_token_count", None),
+                "outputTokens": getattr(usage, "candidates_token_count", None),
+                "totalTokens": getattr(usage, "total_token_count", None),
+                "personaAgeSeconds": persona_age,
+                "personaRefreshing": refreshing,
+            })
+        except Exception as e:
+            yield sse("error", {"error": f"Internal server error: {str(e)}"})
+        finally:
+            ticket.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Covers a client that disconnects before the stream starts
+        background=BackgroundTask(ticket.release),
+    )
+
 
 @app.post("/getMindLogReport")
 async def get_report(request: Request):
@@ -154,49 +272,39 @@ async def get_report(request: Request):
         payload = await request.json()
         authId = payload.get("authId")
         user_email = payload.get("email")
-        numdays = payload.get("numdays")
 
         if not authId or not user_email:
             return JSONResponse(content={"error": "Missing authId or email"}, status_code=400)
+        # Bounds how much of the journal one report pages through and analyzes
+        try:
+            numdays = mindlog_days(payload.get("numdays"))
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+
+        if payload.get("async"):
+            return await accepted("mindlog", {"authId": authId, "email": user_email, "numdays": numdays})
 
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = uuid.uuid4().hex[:8]
-        filename = f"mindlog_{authId}_{timestamp}_{unique_id}"
-        pdf_path = gen_mindlogpdf(authId, numdays, filename)
-
-        # Send email
-        sendEmail(
-            Name="SoulScript System",
-            To=user_email,
-            subject="Your MindLog Report",
-            message="Attached is your report.",
-            attachment_path=pdf_path
-        )
-
-        # Convert PDF to base64
-        with open(pdf_path, "rb") as pdf_file:
-            encoded_pdf = base64.b64encode(pdf_file.read()).decode("utf-8")
-
-        # Clean up
-        os.remove(pdf_path)
-        os.remove(f"{filename}-mood_trend.png") 
-        os.remove(f"{filename}-emotional_composition.png") 
-        os.remove(f"{filename}-emotion_radar.png") 
+        # The buffer that was emailed is the one served for download
+        async with admission.slot(authId, BATCH):
+            with request_budget(REPORT_BUDGET_SECONDS):
+                pdf_bytes = await generate_mindlog_report(authId, user_email, numdays)
+        artifact = artifact_store.put(pdf_bytes, "MindLogReport.pdf")
 
         return JSONResponse(content={
-            "message": "Report emailed and returned as base64",
-            "pdf_base64": encoded_pdf
+            "message": "Report emailed and available for download",
+            "download": artifact.handle()
         })
 
+    except Overloaded as e:
+        return too_busy(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return unavailable(e)
+    except ReportError as e:
+        return JSONResponse(content={"error": e.message}, status_code=e.status_code)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
-import base64
-from tempfile import NamedTemporaryFile
-from fastapi.responses import JSONResponse
-
 @app.post("/getChatSummary")
 async def get_report(request: Request):
     try:
@@ -204,35 +312,153 @@ async def get_report(request: Request):
         authId = payload.get("authId")
         user_email = payload.get("email")
 
-        # Step 1: Extract chat + journal data
-        chat_data = data_chat_extraction(authId, "json")
-        md_data = json_to_md(chat_data)
+        async with admission.slot(authId, BATCH):
+            with request_budget(REPORT_BUDGET_SECONDS):
+                pdf_bytes = await generate_chat_summary(authId, user_email)
+        artifact = artifact_store.put(pdf_bytes, "ChatSummary.pdf")
 
-        # Step 2: Generate PDF into a temp file
-        with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            pdf_path = tmp.name
-            save_to_pdf(md_data, pdf_path)
+        return JSONResponse(content={
+            "status": "Email sent with report",
+            "download": artifact.handle()
+        }, status_code=200)
 
-        # Step 3: Send PDF via Email
-        sendEmail(
-            Name="SoulScript System",
-            To=user_email,
-            subject="Your Therapy Assessment Report",
-            message="Attached is your report. Please review the PDF for detailed insights.",
-            attachment_path=pdf_path
-        )
+    except Overloaded as e:
+        return too_busy(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return unavailable(e)
+    except Exception as e:
+        return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
-        # Step 4: Encode PDF as base64 for frontend
-        with open(pdf_path, "rb") as f:
-            encoded_pdf = base64.b64encode(f.read()).decode("utf-8")
 
-        # Step 5: Clean up
-        os.remove(pdf_path)
+@app.post("/rebuildPersona")
+async def rebuild_persona(request: Request):
+    """Rebuild the persona from the whole history instead of merging the latest changes"""
+    try:
+        payload = await request.json()
+        authId = payload.get("authId")
 
-        return JSONResponse(content={
-            "status": "Email sent with report",
-            "pdf_base64": encoded_pdf
-        }, status_code=200)
+        if not authId:
+            return JSONResponse(content={"error": "Missing authId in request"}, status_code=400)
+
+        async with admission.slot(authId, BATCH):
+            with request_budget(REPORT_BUDGET_SECONDS):
+                info_json, graph_json = await refreshPersona(authId, full=True)
 
+        return JSONResponse(content={"info": info_json, "graph": graph_json}, status_code=200)
+
+    except Overloaded as e:
+        return too_busy(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        return unavailable(e)
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
+
+
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+@app.api_route("/reports/{artifact_id}", methods=["GET", "HEAD"])
+async def download_report(artifact_id: str, request: Request, download: bool = False):
+    """
+    Raw PDF produced by /getMindLogReport or /getChatSummary, with ETag
+    revalidation and single-range requests for resumable downloads.
+    """
+    artifact = artifact_store.get(artifact_id)
+    if artifact is None:
+        # A report job's PDF, made before a restart or by another worker
+        stored = await job_queue.load_artifact(artifact_id)
+        if stored is None:
+            return JSONResponse(content={"error": "Report not found or expired"}, status_code=404)
+        data, filename, content_type = stored
+        artifact = artifact_store.put(data, filename, content_type, artifact_id)
+
+    disposition = "attachment" if download else "inline"
+    headers = {
+        "ETag": artifact.etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": f'{disposition}; filename="{artifact.filename}"',
+    }
+    if request.headers.get("if-none-match") == artifact.etag:
+        return Response(status_code=304, headers=headers)
+
+    size = len(artifact.data)
+    start, end, status_code = 0, size - 1, 200
+    # If-Range: only honour the range if the client still has this version
+    if_range = request.headers.get("if-range")
+    byte_range = parse_range(request.headers.get("range"), size) if if_range in (None, artifact.etag) else None
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=artifact.content_type)
+
+    def body():
+        view = memoryview(artifact.data)
+        for offset in range(start, end + 1, DOWNLOAD_CHUNK):
+            yield bytes(view[offset:min(offset + DOWNLOAD_CHUNK, end + 1)])
+
+    return StreamingResponse(body(), status_code=status_code, headers=headers, media_type=artifact.content_type)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    # Status and progress of a queued report
+    job = await job_queue.get(job_id)
+    if not job:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return JSONResponse(content=public_view(job), status_code=200)
+
+
+@app.get("/pools")
+async def get_pool_stats():
+    # Queue depth and wait time per resource pool
+    return JSONResponse(content={**pool_stats(), "llm": llm_stats()}, status_code=200)
+
+
+@app.get("/admission")
+async def get_admission_stats():
+    # In-flight, queued and rejected counts per priority class
+    return JSONResponse(content=admission.stats(), status_code=200)
+
+
+@app.get("/llm-cache")
+async def get_llm_cache_stats():
+    # Size and hit rate of the LLM response cache
+    return JSONResponse(content=llm_cache.stats(), status_code=200)
+
+
+@app.get("/context-caches")
+async def get_context_cache_stats():
+    # Which instruction preambles are live as Gemini cached content
+    return JSONResponse(content=prefix_cache.stats(), status_code=200)
+
+
+@app.get("/journal-analyses")
+async def get_journal_analysis_stats():
+    # Hit rate of per-entry analyses stored on journal entries
+    return JSONResponse(content=stored_stats(), status_code=200)
+
+
+@app.get("/llm-routes")
+async def get_llm_routes():
+    # Model and default generation settings per call site
+    return JSONResponse(content=routes(), status_code=200)
+
+
+@app.get("/clients")
+async def get_client_stats():
+    # Creation, warm-up and reuse counts of the shared clients
+    return JSONResponse(content=registry.stats(), status_code=200)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Per-stage latency histograms and counters, labelled by route (Prometheus format)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
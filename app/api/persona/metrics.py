@@ -0,0 +1,138 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.routing import Match
+
+# Route the current work is done for. Set per request by the middleware in
+# main.py (and per job by the job workers); thread pools inherit it.
+current_route = contextvars.ContextVar("current_route", default="background")
+
+# LLM calls run for seconds, Firestore for milliseconds; one bucket set covers both
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "persona_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["stage", "route"],
+    buckets=BUCKETS,
+)
+STAGE_TOTAL = Counter(
+    "persona_stage_total",
+    "Pipeline stage executions by outcome",
+    ["stage", "route", "outcome"],
+)
+ADMISSION_REJECTED = Counter(
+    "persona_admission_rejected_total",
+    "Requests turned away with 429 by admission control",
+    ["priority", "reason"],
+)
+LLM_CACHE = Counter(
+    "persona_llm_cache_total",
+    "LLM response cache lookups by result (hit, disk_hit, miss)",
+    ["task", "result"],
+)
+LLM_ATTEMPTS = Counter(
+    "persona_llm_attempts_total",
+    "Gemini call attempts by outcome (ok, retryable, timeout, error)",
+    ["task", "backend", "outcome"],
+)
+LLM_HEDGES = Counter(
+    "persona_llm_hedges_total",
+    "Hedged duplicate Gemini requests, by which copy answered first",
+    ["task", "winner"],
+)
+LLM_BREAKER_STATE = Gauge(
+    "persona_llm_breaker_state",
+    "Circuit breaker state per Gemini backend (0 closed, 1 half-open, 2 open)",
+    ["backend"],
+)
+LLM_TOKENS = Counter(
+    "persona_llm_tokens_total",
+    "Tokens billed by Gemini, by task and kind (prompt, output)",
+    ["task", "kind"],
+)
+PROMPT_TOKENS = Histogram(
+    "persona_llm_prompt_tokens",
+    "Prompt size in tokens per Gemini call",
+    ["task"],
+    buckets=(256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072),
+)
+PROMPT_TRUNCATED = Counter(
+    "persona_prompt_truncated_total",
+    "Prompts whose user data was cut down to fit the token budget",
+    ["task"],
+)
+CONTEXT_CACHE_LOOKUPS = Counter(
+    "persona_context_cache_total",
+    "Context cache lookups per prefix (hit, created, extended, inline, too_small, failed, invalidated)",
+    ["prefix", "result"],
+)
+LLM_BREAKER_REJECTED = Counter(
+    "persona_llm_breaker_rejected_total",
+    "Gemini calls failed fast because the circuit was open",
+    ["backend"],
+)
+LLM_JSON_PARSE = Counter(
+    "persona_llm_json_parse_total",
+    "JSON replies parsed per task (clean, repaired, failed)",
+    ["task", "outcome"],
+)
+JOURNAL_ENTRIES = Counter(
+    "persona_journal_entries_total",
+    "Journal entries analyzed, by outcome (ok, failed, batch_missing, stored)",
+    ["outcome"],
+)
+JOURNAL_STORED = Counter(
+    "persona_journal_stored_total",
+    "Stored per-entry journal analyses looked up (hit, miss)",
+    ["result"],
+)
+PERSONA_UPDATES = Counter(
+    "persona_updates_total",
+    "Persona refreshes by how they were done (merged, unchanged, rebuilt)",
+    ["mode"],
+)
+
+
+def route_label(scope, routes):
+    """
+    Path template of the route a request will hit (/jobs/{job_id}), or
+    "unmatched", so scanners and 404s cannot grow the label set. Middleware
+    runs before routing sets scope["route"], hence the match here.
+    """
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as pipeline stage `name`, labelled with the current route.
+    Works around awaits too, so it can wrap async code.
+
+    Stage names: firestore_read, firestore_write, llm_<task> (rag, info, graph,
+    journal_analysis, summary, emotion, executive_summary, json_to_md,
+    chat_extraction, chat, persona_extraction), chart_render, pdf_build, smtp_connect, smtp_send,
+    base64_encode.
+    """
+    route = current_route.get()
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=name, route=route).observe(time.perf_counter() - started)
+        STAGE_TOTAL.labels(stage=name, route=route, outcome=outcome).inc()
+
+
+def render_metrics():
+    """Prometheus text exposition: (body, content_type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of recent wait samples kept per pool for the percentile figures
+WAIT_SAMPLES = 512
+
+
+def _timed_call(fn, args, kwargs):
+    # Runs inside the worker (thread or process) so the start time is taken
+    # where the work actually begins, not where it was submitted.
+    started = time.time()
+    return started, fn(*args, **kwargs)
+
+
+class Pool:
+    """
+    Bounded executor for one resource class.
+
+    Concurrency is capped by a semaphore in front of the executor, so callers
+    that cannot get a slot wait on the event loop (and are counted as queued)
+    instead of piling up inside the executor where they would be invisible.
+    """
+
+    def __init__(self, name, size, processes=False):
+        self.name = name
+        self.size = size
+        self.processes = processes
+        self._executor = None
+        self._slots = None
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.processes:
+                # spawn, not fork: the parent holds live gRPC channels (Firestore,
+                # Vertex) that must not be duplicated into the children
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix=f"{self.name}-pool"
+                )
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        try:
+            if self.processes:
+                call = (_timed_call, fn, args, kwargs)
+            else:
+                # Threads run in a copy of the caller's context so contextvars
+                # (e.g. the route label used by metrics) carry over
+                call = (contextvars.copy_context().run, _timed_call, fn, args, kwargs)
+            started, result = await loop.run_in_executor(self._get_executor(), *call)
+            self._record_wait(max(0.0, started - submitted))
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    def _record_wait(self, wait):
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._waits.append(wait)
+
+    def stats(self):
+        waits = sorted(self._waits)
+        done = self.completed + self.failed
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            "kind": "process" if self.processes else "thread",
+            "size": self.size,
+            "queued": self.queued,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(1000 * self.total_wait / done, 2) if done else 0.0,
+            "p95_wait_ms": round(1000 * pct(0.95), 2),
+            "max_wait_ms": round(1000 * self.max_wait, 2),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# One pool per resource class so a slow report cannot starve chat traffic.
+# Gemini calls are not here: they run on the event loop through llm.py (client.aio).
+# - firestore: Firestore reads and writes (network bound, short)
+# - render:    matplotlib / ReportLab / WeasyPrint (CPU bound, separate processes)
+# - smtp:      outgoing mail (network bound, rate limited by the provider)
+POOLS = {
+    "firestore": Pool("firestore", int(os.getenv("FIRESTORE_POOL_SIZE", "8"))),
+    "render": Pool("render", int(os.getenv("RENDER_POOL_SIZE", str(os.cpu_count() or 2))), processes=True),
+    "smtp": Pool("smtp", int(os.getenv("SMTP_POOL_SIZE", "2"))),
+}
+
+
+async def run_in_pool(kind, fn, *args, **kwargs):
+    """
+    Run a blocking function on the pool for its resource class.
+
+    Args:
+        kind (str): One of "firestore", "render" or "smtp"
+        fn: The blocking callable. Must be picklable for the "render" pool.
+
+    Returns:
+        Whatever fn returns.
+    """
+    return await POOLS[kind].run(fn, *args, **kwargs)
+
+
+def pool_stats():
+    return {name: pool.stats() for name, pool in POOLS.items()}
+
+
+def shutdown_pools():
+    for pool in POOLS.values():
+        pool.shutdown()
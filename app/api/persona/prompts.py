@@ -0,0 +1,165 @@
+import json
+import math
+import os
+import threading
+from dotenv import load_dotenv
+
+from metrics import LLM_TOKENS, PROMPT_TOKENS, PROMPT_TRUNCATED
+
+load_dotenv()
+
+# Input tokens one prompt may use; the user data in it is cut down to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "32000"))
+
+# Starting guess for Gemini's characters per token, corrected from the
+# prompt_token_count of real responses (see record_usage)
+_chars_per_token = 4.0
+_ratio_lock = threading.Lock()
+
+
+def compact_json(data):
+    """JSON without indentation or padding; indent=4 roughly doubles the tokens of nested data"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def count_tokens(text):
+    """Local token estimate, calibrated against the usage metadata of earlier calls"""
+    return math.ceil(len(text) / _chars_per_token)
+
+
+def contents_chars(contents):
+    # Characters of prompt text in a contents value (str, list of str, or Content objects)
+    if isinstance(contents, str):
+        return len(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(contents_chars(item) for item in contents)
+    parts = getattr(contents, "parts", None)
+    if parts:
+        return sum(len(part.text or "") for part in parts)
+    return 0
+
+
+def record_usage(task, usage, prompt_chars=0):
+    """Export the prompt / output token counts of one call and recalibrate count_tokens"""
+    global _chars_per_token
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or 0
+    output_tokens = getattr(usage, "candidates_token_count", None) or 0
+    LLM_TOKENS.labels(task=task, kind="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(task=task, kind="output").inc(output_tokens)
+    if prompt_tokens:
+        PROMPT_TOKENS.labels(task=task).observe(prompt_tokens)
+    if prompt_tokens and prompt_chars > 1000:
+        with _ratio_lock:
+            _chars_per_token = 0.9 * _chars_per_token + 0.1 * (prompt_chars / prompt_tokens)
+
+
+class PromptBuilder:
+    """
+    Assembles a prompt from fixed text blocks and user-data blocks, then
+    keeps it under a token budget by dropping the oldest data first.
+
+        prompt = (PromptBuilder("info")
+                  .text(INSTRUCTIONS)
+                  .data("Input", user_history)
+                  .build())
+
+    Data blocks are serialized with compact_json. Lists lose their oldest
+    items first, dicts their first keys, and strings their beginning; a
+    marker line says how much was left out, so the model knows.
+    """
+
+    def __init__(self, task, budget=PROMPT_TOKEN_BUDGET):
+        self.task = task
+        self.budget = budget
+        self._blocks = []
+
+    def text(self, text):
+        self._blocks.append({"fixed": True, "text": text})
+        return self
+
+    def data(self, title, value, oldest_first=True, empty="Not provided."):
+        """
+        Args:
+            title (str): Heading put above the block ("" for none)
+            value: list / dict / str / anything JSON-serializable
+            oldest_first (bool): False if the newest items come first (e.g. journal
+                entries queried in descending date order)
+        """
+        if isinstance(value, dict):
+            items = [{key: item} for key, item in value.items()]
+        elif isinstance(value, (list, tuple)):
+            items = list(value)
+        else:
+            items = None
+        if items is not None and not oldest_first:
+            items.reverse()
+        self._blocks.append({
+            "fixed": False,
+            "title": title,
+            "value": value,
+            "items": items,
+            "dict": isinstance(value, dict),
+            "reversed": not oldest_first,
+            "dropped": 0,
+            "text": self._render_value(value) if value not in (None, "", [], {}) else empty,
+        })
+        return self
+
+    @staticmethod
+    def _render_value(value):
+        return value if isinstance(value, str) else compact_json(value)
+
+    def _render_items(self, block):
+        items = block["items"]
+        if block["reversed"]:
+            items = list(reversed(items))
+        if block["dict"]:
+            merged = {}
+            for item in items:
+                merged.update(item)
+            items = merged
+        omitted = f"[{block['dropped']} earlier items omitted to fit the input budget]\n" if block["dropped"] else ""
+        return omitted + compact_json(items)
+
+    def _render_block(self, block):
+        if block["fixed"] or not block["title"]:
+            return block["text"]
+        return f"# {block['title']}\n{block['text']}"
+
+    def _total(self):
+        return sum(count_tokens(self._render_block(block)) for block in self._blocks)
+
+    def _shrink(self, block, excess):
+        """Cut roughly `excess` tokens from a data block; False once nothing more can go"""
+        if block["items"] and len(block["items"]) > 1:
+            # Drop oldest items until enough is gone (always keep the newest one)
+            while excess > 0 and len(block["items"]) > 1:
+                removed = block["items"].pop(0)
+                block["dropped"] += 1
+                excess -= count_tokens(compact_json(removed))
+            block["text"] = self._render_items(block)
+            return True
+        # A single item or plain text: keep the end, which is the newest part
+        block["items"] = None
+        marker = "[earlier text omitted to fit the input budget]\n"
+        text = block["text"][len(marker):] if block["text"].startswith(marker) else block["text"]
+        keep = max(0, len(text) - math.ceil(excess * _chars_per_token))
+        if keep >= len(text):
+            return False
+        block["text"] = marker + (text[-keep:] if keep else "")
+        return True
+
+    def build(self):
+        total = self._total()
+        if total > self.budget:
+            PROMPT_TRUNCATED.labels(task=self.task).inc()
+            # Shrink the largest data block first until the prompt fits
+            shrinkable = [block for block in self._blocks if not block["fixed"]]
+            while total > self.budget and shrinkable:
+                block = max(shrinkable, key=lambda b: len(b["text"]))
+                if not self._shrink(block, total - self.budget):
+                    shrinkable.remove(block)
+                total = self._total()
+        return "\n".join(self._render_block(block) for block in self._blocks)
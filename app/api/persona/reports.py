@@ -0,0 +1,154 @@
+import json
+
+from data import data_chat_extraction, collect_mindlog_analysis, render_mindlog_charts, build_mindlog_pdf, json_to_md, save_to_pdf
+from mail import create_pdf_from_json, sendEmail
+from dataSync import isPersonaUpdateNeeded, personaInfo, refreshPersona
+from pools import run_in_pool
+from metrics import stage
+
+
+class ReportError(Exception):
+    """A report could not be produced; status_code is what the route should answer with"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+async def _no_progress(percent, stage):
+    pass
+
+
+async def _send_once(progress, **email):
+    # A job retried or resumed after its email went out (jobs.JobProgress) must not send it again
+    if getattr(progress, "emailed", False):
+        return
+    await run_in_pool("smtp", sendEmail, **email)
+    mark_emailed = getattr(progress, "mark_emailed", None)
+    if mark_emailed is not None:
+        await mark_emailed()
+
+
+async def generate_persona_report(authId, user_email, progress=_no_progress):
+    """
+    Build the therapy assessment PDF from the persona (refreshing it first if
+    needed) and email it to the user.
+
+    Returns:
+        dict: {"info", "graph", "status"} as returned by /getReport
+    """
+    # If update is needed → refresh persona first
+    await progress(5, "checking persona")
+    if await run_in_pool("firestore", isPersonaUpdateNeeded, authId):
+        await progress(10, "refreshing persona")
+        info_json, graph_json = await refreshPersona(authId)
+        status = "Persona updated and stored. Skipping PDF generation."
+    else:
+        # Otherwise, fetch stored persona info and proceed to report/email
+        persona_raw = await run_in_pool("firestore", personaInfo, authId)
+        if not persona_raw:
+            raise ReportError("Stored persona data not found", 404)
+
+        persona_data = json.loads(persona_raw)
+        info_json = persona_data.get("Info")
+        graph_json = persona_data.get("Graph")
+
+        if not info_json or not graph_json:
+            raise ReportError("Incomplete persona data", 500)
+        status = "Email sent using previously saved persona info."
+
+    # Step: Generate PDF report from persona data (in memory)
+    await progress(70, "rendering pdf")
+    data = {
+        "info": info_json,
+        "graph": graph_json
+    }
+    with stage("pdf_build"):
+        pdf_bytes = await run_in_pool("render", create_pdf_from_json, data)
+
+    # Step: Send Email with PDF
+    await progress(90, "sending email")
+    await _send_once(
+        progress,
+        Name="SoulScript System",
+        To=user_email,
+        subject="Your Therapy Assessment Report",
+        message="Attached is your report. Please review the PDF for detailed insights.",
+        attachment=pdf_bytes,
+        attachment_name="TherapyAssessmentReport.pdf"
+    )
+
+    return {
+        "info": info_json,
+        "graph": graph_json,
+        "status": status
+    }
+
+
+async def generate_mindlog_report(authId, user_email, numdays, progress=_no_progress):
+    """
+    Analyze the last `numdays` journal entries, render the MindLog PDF and
+    email it to the user.
+
+    Returns:
+        bytes: The rendered PDF
+    """
+    await progress(5, "analyzing journal entries")
+    collected = await collect_mindlog_analysis(authId, numdays)
+    if collected is None:
+        raise ReportError("No journal entries found", 404)
+    analysis_results, executive_summary = collected
+
+    await progress(70, "rendering pdf")
+    # Charts and PDF run in worker processes, so they are timed from here
+    with stage("chart_render"):
+        charts = await run_in_pool("render", render_mindlog_charts, analysis_results)
+    with stage("pdf_build"):
+        pdf_bytes = await run_in_pool("render", build_mindlog_pdf, analysis_results, charts, executive_summary)
+
+    # Send email
+    await progress(90, "sending email")
+    await _send_once(
+        progress,
+        Name="SoulScript System",
+        To=user_email,
+        subject="Your MindLog Report",
+        message="Attached is your report.",
+        attachment=pdf_bytes,
+        attachment_name="MindLogReport.pdf"
+    )
+
+    return pdf_bytes
+
+
+async def generate_chat_summary(authId, user_email, progress=_no_progress):
+    """
+    Summarize the user's questionnaire answers as a Markdown PDF and email it.
+
+    Returns:
+        bytes: The rendered PDF
+    """
+    # Step 1: Extract chat + journal data
+    await progress(10, "extracting chat data")
+    chat_data = await data_chat_extraction(authId, "json")
+    md_data = await json_to_md(chat_data)
+
+    # Step 2: Generate PDF in memory
+    await progress(70, "rendering pdf")
+    with stage("pdf_build"):
+        pdf_bytes = await run_in_pool("render", save_to_pdf, md_data)
+
+    # Step 3: Send PDF via Email
+    await progress(90, "sending email")
+    await _send_once(
+        progress,
+        Name="SoulScript System",
+        To=user_email,
+        subject="Your Therapy Assessment Report",
+        message="Attached is your report. Please review the PDF for detailed insights.",
+        attachment=pdf_bytes,
+        attachment_name="ChatSummary.pdf"
+    )
+
+    return pdf_bytes
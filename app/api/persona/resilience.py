@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from metrics import LLM_ATTEMPTS, LLM_HEDGES, LLM_BREAKER_STATE, LLM_BREAKER_REJECTED
+
+load_dotenv()
+
+# Longest a single Gemini attempt may take, even with budget to spare
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# Send a duplicate request if the first has not answered after this many seconds (0 = off)
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+# Consecutive failures that open a backend's circuit, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# HTTP codes from the Gemini / Vertex APIs worth another attempt
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+# Absolute time.monotonic() by which the current request must be done
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request-level budget ran out before the LLM work finished"""
+    status_code = 504
+
+
+class CircuitOpen(Exception):
+    """The backend failed repeatedly; calls fail fast until the cooldown ends"""
+    status_code = 503
+
+    def __init__(self, backend, retry_after):
+        super().__init__(f"{backend} is unavailable, retry in {retry_after}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+@contextmanager
+def request_budget(seconds):
+    """
+    Give all LLM calls made inside the block (including in tasks it spawns)
+    a shared deadline `seconds` from now. Nested budgets can only shorten it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def call_timeout():
+    """Timeout for the next attempt: LLM_CALL_TIMEOUT capped by what is left of the budget"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return LLM_CALL_TIMEOUT
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request budget exhausted")
+    return min(LLM_CALL_TIMEOUT, remaining)
+
+
+def is_retryable(e):
+    # google.genai.errors.APIError carries the HTTP status as .code
+    if isinstance(e, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(e, "code", None) in RETRYABLE_CODES
+
+
+class CircuitBreaker:
+    """
+    closed -> open after LLM_BREAKER_FAILURES consecutive failures; open ->
+    half-open after LLM_BREAKER_COOLDOWN, letting one trial call through;
+    the trial's outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, backend, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.backend = backend
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        LLM_BREAKER_STATE.labels(backend=backend).set(self.state)
+
+    def _set(self, state):
+        self.state = state
+        LLM_BREAKER_STATE.labels(backend=self.backend).set(state)
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            waited = time.monotonic() - self.opened_at
+            if waited < self.cooldown:
+                LLM_BREAKER_REJECTED.labels(backend=self.backend).inc()
+                raise CircuitOpen(self.backend, max(1, int(self.cooldown - waited)))
+            self._set(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                LLM_BREAKER_REJECTED.labels(backend=self.backend).inc()
+                raise CircuitOpen(self.backend, 1)
+            self._trial_running = True
+
+    def abandon(self):
+        self._trial_running = False
+
+    def record(self, ok):
+        self._trial_running = False
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self._set(self.CLOSED)
+            return
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+            self._set(self.OPEN)
+
+    def stats(self):
+        return {
+            "state": {self.CLOSED: "closed", self.HALF_OPEN: "half_open", self.OPEN: "open"}[self.state],
+            "consecutiveFailures": self.consecutive_failures,
+        }
+
+
+breakers = {name: CircuitBreaker(name) for name in ("genai", "vertex")}
+
+
+async def _hedged(make_call, task, timeout):
+    """Run make_call(); if it is still pending after LLM_HEDGE_DELAY, race a second copy"""
+    loop = asyncio.get_running_loop()
+    # Both copies share the one per-attempt deadline
+    deadline = loop.time() + timeout
+    first = asyncio.ensure_future(make_call())
+    second = None
+    try:
+        done, _ = await asyncio.wait({first}, timeout=min(LLM_HEDGE_DELAY, timeout))
+        if done:
+            return first.result()
+        if loop.time() >= deadline:
+            raise asyncio.TimeoutError()
+
+        second = asyncio.ensure_future(make_call())
+        pending = {first, second}
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for future in done:
+                if future.exception() is None:
+                    LLM_HEDGES.labels(task=task, winner="hedge" if future is second else "primary").inc()
+                    return future.result()
+        # Both copies failed: surface the primary's error
+        return first.result()
+    finally:
+        for future in (first, second):
+            if future is not None:
+                future.cancel()
+
+
+async def resilient_call(make_call, task, backend, hedge=False):
+    """
+    Await make_call() (a zero-argument coroutine factory) with a per-attempt
+    deadline, retries with full-jitter exponential backoff on retryable errors,
+    optional hedging, and the backend's circuit breaker in front.
+    """
+    breaker = breakers[backend]
+    attempt = 0
+    while True:
+        attempt += 1
+        timeout = call_timeout()
+        breaker.before_call()
+        try:
+            if hedge and LLM_HEDGE_DELAY > 0:
+                result = await _hedged(make_call, task, timeout)
+            else:
+                result = await asyncio.wait_for(make_call(), timeout)
+        except asyncio.CancelledError:
+            # Caller went away: says nothing about the backend, but frees a half-open trial
+            breaker.abandon()
+            raise
+        except Exception as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            retryable = is_retryable(e)
+            # Only backend trouble counts against the circuit, not bad requests
+            breaker.record(not retryable)
+            LLM_ATTEMPTS.labels(
+                task=task, backend=backend,
+                outcome="timeout" if timed_out else ("retryable" if retryable else "error"),
+            ).inc()
+            if not retryable or attempt >= LLM_MAX_ATTEMPTS:
+                raise
+            backoff = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (attempt - 1)))
+            # Do not sleep past the budget; the next call_timeout() raises if it is gone
+            deadline = _deadline.get()
+            if deadline is not None:
+                backoff = min(backoff, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(backoff)
+            continue
+
+        breaker.record(True)
+        LLM_ATTEMPTS.labels(task=task, backend=backend, outcome="ok").inc()
+        return result
+
+
+def breaker_stats():
+    return {name: breaker.stats() for name, breaker in breakers.items()}
@@ -0,0 +1,62 @@
+import json
+import os
+from dotenv import load_dotenv
+from google.genai import types
+
+load_dotenv()
+
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gemini-2.0-flash")
+SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "gemini-2.0-flash-lite")
+
+# Model and default generation settings per call site (the `task` passed to llm.py).
+# A call site's own GenerateContentConfig wins over these for any field it sets.
+# Check a change with `python bench.py` before shipping it.
+ROUTES = {
+    # Multi-section reasoning over all of a user's data
+    "rag": {"model": DEFAULT_MODEL},
+    "persona_extraction": {"model": DEFAULT_MODEL},
+    "persona_merge": {"model": DEFAULT_MODEL},
+    "info": {"model": DEFAULT_MODEL},
+    "graph": {"model": DEFAULT_MODEL},
+    "chat": {"model": DEFAULT_MODEL},
+    "chat_extraction": {"model": DEFAULT_MODEL},
+    "journal_analysis": {"model": DEFAULT_MODEL},
+    "journal_entry": {"model": DEFAULT_MODEL},
+    "journal_batch": {"model": DEFAULT_MODEL},
+    "executive_summary": {"model": DEFAULT_MODEL},
+    "json_to_md": {"model": DEFAULT_MODEL},
+    # One or two bullet points from an analysis already written
+    "summary": {"model": SMALL_MODEL, "config": {"temperature": 0.3, "max_output_tokens": 512}},
+    # Seven numbers as JSON
+    "emotion": {
+        "model": SMALL_MODEL,
+        "config": {"temperature": 0.0, "max_output_tokens": 256, "response_mime_type": "application/json"},
+    },
+}
+
+# LLM_ROUTES='{"emotion": {"model": "gemini-2.0-flash"}}' replaces single entries without a deploy
+ROUTES.update(json.loads(os.getenv("LLM_ROUTES", "{}")))
+
+
+def route_model(task):
+    return ROUTES.get(task, {}).get("model", DEFAULT_MODEL)
+
+
+def resolve(task, model=None, config=None):
+    """
+    (model, config) for one call: an explicit model wins over the route, and
+    the route's settings fill in only the config fields the caller left unset.
+    """
+    entry = ROUTES.get(task, {})
+    model = model or entry.get("model", DEFAULT_MODEL)
+    defaults = entry.get("config")
+    if not defaults:
+        return model, config
+    if config is None:
+        return model, types.GenerateContentConfig(**defaults)
+    unset = {field: value for field, value in defaults.items() if getattr(config, field, None) is None}
+    return model, (config.model_copy(update=unset) if unset else config)
+
+
+def routes():
+    return {task: {"model": route_model(task), "config": entry.get("config", {})} for task, entry in ROUTES.items()}
@@ -0,0 +1,78 @@
+from typing import List
+from pydantic import BaseModel, Field
+
+
+# Typed shapes of the persona JSON stored in Firestore and drawn by the
+# frontend. Also handed to Gemini as response_schema, so the model is
+# constrained to produce exactly this structure.
+
+
+class LabelValue(BaseModel):
+    label: str
+    value: str
+
+
+class PersonaInfo(BaseModel):
+    demographics: List[LabelValue]
+    familyEmployment: List[LabelValue]
+    therapyReasons: List[LabelValue]
+    mentalHealthHistory: List[LabelValue]
+    traumaAndAdverseExperiences: List[LabelValue]
+    substanceUse: List[LabelValue]
+    healthAndLifestyle: List[LabelValue]
+    medicalAndMedicationHistory: List[LabelValue]
+    behavioralPatterns: List[LabelValue]
+    riskAssessment: List[LabelValue]
+    psychologicalFormulation: List[LabelValue]
+    strengthsAndResources: List[LabelValue]
+    therapyRecommendations: List[LabelValue]
+
+
+class Score(BaseModel):
+    name: str
+    score: int = Field(ge=1, le=10)
+
+
+class Severity(BaseModel):
+    name: str
+    severity: int = Field(ge=1, le=10)
+
+
+class PersonaGraph(BaseModel):
+    selfPerception: List[Score]
+    relationships: List[Score]
+    symptoms: List[Severity]
+
+
+class PersonaExtraction(BaseModel):
+    info: PersonaInfo
+    graph: PersonaGraph
+
+
+class EmotionScores(BaseModel):
+    Joy: float = Field(ge=0, le=1)
+    Sadness: float = Field(ge=0, le=1)
+    Anger: float = Field(ge=0, le=1)
+    Fear: float = Field(ge=0, le=1)
+    Surprise: float = Field(ge=0, le=1)
+    Disgust: float = Field(ge=0, le=1)
+    Neutral: float = Field(ge=0, le=1)
+
+
+class JournalEntryAnalysis(BaseModel):
+    # Analysis, summary and emotion scores of one journal entry in a single reply
+    analysis: str
+    insights: List[str] = Field(min_length=1, max_length=2)
+    emotions: EmotionScores
+
+
+class JournalEntryResult(BaseModel):
+    # One entry of a batched reply; entry_id comes first so the model states which entry it is on
+    entry_id: str
+    analysis: str
+    insights: List[str] = Field(min_length=1, max_length=2)
+    emotions: EmotionScores
+
+
+class JournalBatchAnalysis(BaseModel):
+    results: List[JournalEntryResult]
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import uuid
+from dotenv import load_dotenv
+
+from pools import run_in_pool
+
+load_dotenv()
+
+# "firestore" coordinates all workers through lease documents, "local" uses
+# lock files and only coordinates processes on the same machine
+LEASE_BACKEND = os.getenv("LEASE_BACKEND", "firestore")
+LEASE_DIR = os.getenv("LEASE_DIR", ".leases")
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "300"))
+LEASE_POLL_SECONDS = float(os.getenv("LEASE_POLL_SECONDS", "2"))
+
+
+def lease_id(key):
+    # Keys carry user input (authId); hashed, they are safe as a file name or document id
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class LeaseLost(RuntimeError):
+    """The lease guarding a run could not be renewed, so the run was stopped"""
+
+
+class FirestoreLeaseBackend:
+    """
+    Leases are documents in `collection`: {"owner": ..., "expiresAt": ...}.
+
+    A lease whose expiresAt has passed is treated as free, so a worker that dies
+    mid-refresh only blocks others for at most one TTL.
+    """
+
+    def __init__(self, client_factory, collection="personaLeases", ttl=LEASE_TTL_SECONDS):
+        self._client_factory = client_factory
+        self._db = None
+        self.collection = collection
+        self.ttl = ttl
+
+    def _ref(self, key):
+        if self._db is None:
+            self._db = self._client_factory()
+        return self._db.collection(self.collection).document(lease_id(key))
+
+    def acquire(self, key):
+        from google.cloud import firestore
+
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        ref = self._ref(key)
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.to_dict().get("expiresAt", 0) > time.time():
+                return None
+            transaction.set(ref, {"owner": owner, "expiresAt": time.time() + self.ttl})
+            return owner
+
+        return claim(self._db.transaction())
+
+    def renew(self, key, lease):
+        """True if the lease is still ours (and now extended)"""
+        ref = self._ref(key)
+        snapshot = ref.get()
+        if snapshot.exists and snapshot.to_dict().get("owner") == lease:
+            ref.update({"expiresAt": time.time() + self.ttl})
+            return True
+        return False
+
+    def release(self, key, lease):
+        ref = self._ref(key)
+        snapshot = ref.get()
+        if snapshot.exists and snapshot.to_dict().get("owner") == lease:
+            ref.delete()
+
+    def is_held(self, key):
+        snapshot = self._ref(key).get()
+        return snapshot.exists and snapshot.to_dict().get("expiresAt", 0) > time.time()
+
+
+class LocalLeaseBackend:
+    """Stand-in backend using flock()ed files; the OS drops the lock if the process dies"""
+
+    def __init__(self, directory=LEASE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{lease_id(key)}.lock")
+
+    def acquire(self, key):
+        import fcntl
+
+        fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def renew(self, key, lease):
+        # flock() holds for as long as this process keeps the fd open
+        return True
+
+    def release(self, key, lease):
+        import fcntl
+
+        fcntl.flock(lease, fcntl.LOCK_UN)
+        os.close(lease)
+
+    def is_held(self, key):
+        lease = self.acquire(key)
+        if lease is None:
+            return True
+        self.release(key, lease)
+        return False
+
+
+class SingleFlight:
+    """
+    At most one call of `fn` per key at a time, across tasks and processes.
+
+    Callers in this process share one task per key. That task first takes the
+    backend lease; if another process holds it, it waits for the lease to go
+    away and then asks `load_remote` for the other process's result. If
+    `load_remote` returns None (the other process failed or died) it tries to
+    take the lease and run `fn` itself.
+
+    A run marked strong (a forced full refresh) is never satisfied by a weaker
+    one: it waits out an in-flight weak run here, and with load_remote=None
+    it never takes another process's result, but runs `fn` once it holds the
+    lease. Weak callers happily join a strong run.
+    """
+
+    def __init__(self, backend, poll_interval=LEASE_POLL_SECONDS):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self._inflight = {}
+
+    def inflight(self, key):
+        return key in self._inflight
+
+    async def run(self, key, fn, load_remote, strong=False):
+        while True:
+            entry = self._inflight.get(key)
+            if entry is None:
+                entry = (asyncio.create_task(self._lead(key, fn, load_remote)), strong)
+                self._inflight[key] = entry
+                entry[0].add_done_callback(
+                    lambda _, entry=entry: self._inflight.pop(key) if self._inflight.get(key) is entry else None
+                )
+                break
+            if entry[1] or not strong:
+                break
+            # A weaker run is in flight: let it finish (its outcome is not ours), then lead our own
+            await asyncio.wait({entry[0]})
+        # shield: one impatient caller being cancelled must not cancel the shared refresh
+        return await asyncio.shield(entry[0])
+
+    async def _lead(self, key, fn, load_remote):
+        while True:
+            lease = await run_in_pool("firestore", self.backend.acquire, key)
+            if lease is not None:
+                work = asyncio.ensure_future(fn())
+                keep_alive = asyncio.create_task(self._keep_alive(key, lease, work))
+                try:
+                    return await work
+                except asyncio.CancelledError:
+                    if keep_alive.done() and work.cancelled():
+                        raise LeaseLost(f"lease on {key} was lost mid-run") from None
+                    raise
+                finally:
+                    keep_alive.cancel()
+                    await run_in_pool("firestore", self.backend.release, key, lease)
+
+            # Another process is refreshing: wait for it, then reuse what it stored
+            while await run_in_pool("firestore", self.backend.is_held, key):
+                await asyncio.sleep(self.poll_interval)
+            if load_remote is not None:
+                result = await load_remote()
+                if result is not None:
+                    return result
+
+    async def _keep_alive(self, key, lease, work):
+        # Renew every third of the TTL. A failed renew is retried while the lease
+        # still has time left; once it would lapse (or it is someone else's) the
+        # work is cancelled, since another process may already be taking over
+        interval = LEASE_TTL_SECONDS / 3
+        expires_at = time.time() + LEASE_TTL_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                held = await run_in_pool("firestore", self.backend.renew, key, lease)
+            except Exception as e:
+                print(f"Renewing the lease on {key} failed: {e}")
+                if time.time() + interval < expires_at:
+                    continue
+                held = False
+            if not held:
+                print(f"Lost the lease on {key}; cancelling the run it guarded")
+                work.cancel()
+                return
+            expires_at = time.time() + LEASE_TTL_SECONDS
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The backend is a flat set of modules imported from app/api/persona
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Offline and quick: Gemini calls go to fake_genai, with no added latency or errors,
+# and the response cache stays in memory
+os.environ["FAKE_GENAI"] = "on"
+os.environ["FAKE_GENAI_LATENCY_MS"] = "0"
+os.environ["FAKE_GENAI_ERROR_RATE"] = "0"
+os.environ["LLM_CACHE_DB"] = ""
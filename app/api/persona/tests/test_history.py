@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+try:
+    import data
+    import dataSync
+    from dataSync import historyDelta, historyMark
+except (ImportError, OSError) as e:
+    # data.py pulls in the whole report stack (weasyprint needs pango, etc.)
+    pytest.skip(f"report dependencies unavailable: {e}", allow_module_level=True)
+
+from journal_engine import JournalRecord
+
+
+def test_list_history_delta_is_the_answers_after_the_watermark():
+    mark = historyMark(["a", "b"])
+    assert historyDelta(["a", "b", "c"], mark) == ["c"]
+    assert historyDelta(["a", "b"], mark) == []
+
+
+def test_map_history_delta_is_the_new_keys():
+    mark = historyMark({"q1": "a"})
+    assert historyDelta({"q1": "a", "q2": "b"}, mark) == {"q2": "b"}
+
+
+def test_edited_or_removed_answers_need_a_rebuild():
+    list_mark = historyMark(["a", "b"])
+    assert historyDelta(["a", "edited", "c"], list_mark) is None
+    assert historyDelta(["a"], list_mark) is None
+
+    map_mark = historyMark({"q1": "a", "q2": "b"})
+    assert historyDelta({"q1": "edited", "q2": "b"}, map_mark) is None
+    assert historyDelta({"q2": "b"}, map_mark) is None
+
+
+def test_empty_history_is_no_change():
+    assert historyDelta([], historyMark([])) == []
+
+
+def test_a_failed_entry_holds_back_itself_and_newer_entries(monkeypatch):
+    start = datetime(2026, 1, 1)
+    # Newest first, as fetch_journal_entries returns them
+    records = [JournalRecord(f"e{i}", f"t{i}", start + timedelta(days=i), "c") for i in reversed(range(8))]
+    seen = {}
+
+    async def fetch(authId, limit=None, since=None):
+        seen["limit"] = limit
+        return list(records), {}
+
+    async def analyze(authId, entries, stored):
+        return [entry.analyzed("a", "s", {}) for entry in entries if entry.entry_id != "e4"]
+
+    monkeypatch.setattr(data, "fetch_journal_entries", fetch)
+    monkeypatch.setattr(data, "analyze_stored", analyze)
+
+    analyses, through = asyncio.run(data.analyze_journal_entries("user", since=start))
+    # Every entry after the watermark is fetched, not just the latest 5
+    assert seen["limit"] is None
+    assert [analysis["entry_id"] for analysis in analyses] == ["e3", "e2", "e1", "e0"]
+    assert through == start + timedelta(days=3)
+
+
+def test_no_new_entries_keeps_the_watermark(monkeypatch):
+    since = datetime(2026, 1, 1)
+
+    async def fetch(authId, limit=None, since=None):
+        return [], {}
+
+    monkeypatch.setattr(data, "fetch_journal_entries", fetch)
+    assert asyncio.run(data.analyze_journal_entries("user", since=since)) == ([], since)
+
+
+def test_update_merges_from_the_stored_watermark_or_rebuilds_without_one(monkeypatch):
+    calls = []
+
+    async def merge(authId, persona, watermark):
+        calls.append(("merge", persona, watermark))
+        return "merged"
+
+    async def rebuild(authId):
+        calls.append(("rebuild",))
+        return "rebuilt"
+
+    monkeypatch.setattr(dataSync, "PERSONA_UPDATE", "incremental")
+    monkeypatch.setattr(dataSync, "mergePersona", merge)
+    monkeypatch.setattr(dataSync, "rebuildPersona", rebuild)
+
+    record = {"Info": '{"Info": {}}', "Date": datetime(2026, 1, 1), "Watermark": {"historyCount": 2}}
+    monkeypatch.setattr(dataSync, "personaRecord", lambda authId: record)
+    assert asyncio.run(dataSync.updatePersona("u1")) == "merged"
+    assert calls[-1] == ("merge", {"Info": {}}, {"historyCount": 2})
+
+    # No persona yet (an empty document) or one written before watermarks
+    for record in ({}, {"Info": '{"Info": {}}'}):
+        monkeypatch.setattr(dataSync, "personaRecord", lambda authId, record=record: record)
+        assert asyncio.run(dataSync.updatePersona("u1")) == "rebuilt"
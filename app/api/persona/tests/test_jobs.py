@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from artifacts import ArtifactStore
+from jobs import JobQueue, LocalJobStore, QUEUED, RUNNING, SUCCEEDED
+
+
+def stored_job(store, job_id, owner, lease_until, status=RUNNING):
+    job = {
+        "id": job_id, "kind": "report", "params": {"n": job_id}, "status": status, "progress": 0,
+        "stage": "running", "attempts": 1, "result": None, "error": None, "emailed": False,
+        "owner": owner, "leaseUntil": lease_until, "createdAt": time.time(),
+    }
+    store.save(job)
+    return job
+
+
+def queue(store, handler, lease_seconds=0.3):
+    jobs = JobQueue(store, concurrency=2, lease_seconds=lease_seconds)
+    jobs.register("report", handler)
+    return jobs
+
+
+async def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def test_claim_is_exclusive_while_the_lease_is_fresh(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    stored_job(store, "a", owner=None, lease_until=0, status=QUEUED)
+
+    assert store.claim("a", "worker-1", 60)["owner"] == "worker-1"
+    assert store.claim("a", "worker-2", 60) is None
+    # Renewing our own lease always works
+    assert store.claim("a", "worker-1", 60) is not None
+
+
+def test_claim_takes_over_an_expired_lease(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    stored_job(store, "a", owner="dead-worker", lease_until=time.time() - 1)
+
+    assert store.claim("a", "worker-2", 60)["owner"] == "worker-2"
+
+
+def test_finished_jobs_are_never_claimed(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    stored_job(store, "a", owner=None, lease_until=0, status=SUCCEEDED)
+
+    assert store.claim("a", "worker-1", 60) is None
+
+
+def test_start_resumes_only_jobs_whose_lease_expired(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    stored_job(store, "live", owner="other-worker", lease_until=time.time() + 60)
+    stored_job(store, "orphan", owner="dead-worker", lease_until=time.time() - 1)
+    ran = []
+
+    async def handler(progress, n):
+        ran.append(n)
+        return {"n": n}
+
+    async def main():
+        jobs = queue(store, handler)
+        await jobs.start()
+        await wait_for(lambda: store.load("orphan")["status"] == SUCCEEDED)
+        await jobs.stop()
+
+    asyncio.run(main())
+    assert ran == ["orphan"]
+    assert store.load("live")["status"] == RUNNING
+
+
+def test_a_dead_workers_job_is_taken_over_once(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    ran = []
+
+    async def handler(progress, n):
+        ran.append(n)
+        await asyncio.sleep(0.4)
+        return {"n": n}
+
+    async def main():
+        first, second = queue(store, handler), queue(store, handler)
+        await first.start()
+        await second.start()
+        job = await first.submit("report", {"n": 1})
+        await wait_for(lambda: ran)
+        # The first worker dies without finishing or renewing
+        for task in first._workers:
+            task.cancel()
+        await wait_for(lambda: store.load(job["id"])["status"] == SUCCEEDED)
+        await second.stop()
+        return job, second.owner
+
+    job, new_owner = asyncio.run(main())
+    assert ran == [1, 1]
+    assert store.load(job["id"])["owner"] == new_owner
+
+
+def test_a_retry_does_not_email_again(tmp_path):
+    store = LocalJobStore(str(tmp_path))
+    emails, attempts = [], []
+
+    async def handler(progress, n):
+        attempts.append(n)
+        if not progress.emailed:
+            emails.append(n)
+            await progress.mark_emailed()
+        if len(attempts) == 1:
+            # Fails after the email went out, e.g. while storing the artifact
+            raise RuntimeError("failed after sending")
+        return {"n": n}
+
+    async def main():
+        jobs = queue(store, handler)
+        await jobs.start()
+        job = await jobs.submit("report", {"n": 1})
+        await wait_for(lambda: store.load(job["id"])["status"] == SUCCEEDED)
+        await jobs.stop()
+
+    asyncio.run(main())
+    assert attempts == [1, 1]
+    assert emails == [1]
+
+
+def test_a_job_download_outlives_the_process_that_made_it(tmp_path):
+    async def scenario():
+        # Another worker (or this one before a restart) rendered and stored the PDF
+        made = ArtifactStore().put(b"%PDF-1.7 report", "MindLogReport.pdf")
+        await queue(LocalJobStore(str(tmp_path)), None).save_artifact(made)
+        assert "expiresIn" not in made.handle(expires=False)
+
+        # A fresh process has nothing in memory but finds it in the job store
+        jobs = queue(LocalJobStore(str(tmp_path)), None)
+        assert ArtifactStore().get(made.id) is None
+        assert await jobs.load_artifact(made.id) == (b"%PDF-1.7 report", "MindLogReport.pdf", "application/pdf")
+        assert await jobs.load_artifact("0" * 32) is None
+        assert await jobs.load_artifact("..") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+import journal_engine
+from journal_engine import EMOTIONS, JournalRecord, analyze_entries, pack_batches
+from llm_cache import llm_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    llm_cache.clear()
+
+
+def entries(n, words=30):
+    return [JournalRecord(f"e{i}", f"Title {i}", f"2026-01-{i + 1:02d}", f"entry {i} " * words) for i in range(n)]
+
+
+def batch_mode(monkeypatch, size):
+    # pack_batches binds its defaults at import, so the size is passed through here
+    monkeypatch.setattr(journal_engine, "JOURNAL_ANALYSIS", "combined")
+    monkeypatch.setattr(journal_engine, "JOURNAL_BATCH_SIZE", size)
+    monkeypatch.setattr(journal_engine, "pack_batches", lambda entries: pack_batches(entries, size=size))
+
+
+def test_entries_are_analyzed_through_the_fake_client():
+    results = asyncio.run(analyze_entries(entries(5)))
+    assert [record.entry_id for record in results] == [f"e{i}" for i in range(5)]
+    for record in results:
+        assert record.analysis and record.summary
+        assert set(record.emotions) == set(EMOTIONS)
+
+
+def test_order_is_kept_and_a_failed_entry_is_left_out(monkeypatch):
+    async def analyze_entry(entry):
+        # Finish in reverse order; one entry fails
+        await asyncio.sleep(0.01 * (10 - int(entry.entry_id[1:])))
+        if entry.entry_id == "e3":
+            raise RuntimeError("503 from the model")
+        return entry.analyzed("a", "s", {})
+
+    monkeypatch.setattr(journal_engine, "analyze_entry", analyze_entry)
+    results = asyncio.run(analyze_entries(entries(6)))
+    assert [record.entry_id for record in results] == ["e0", "e1", "e2", "e4", "e5"]
+
+
+def test_every_entry_failing_raises_the_first_error(monkeypatch):
+    async def analyze_entry(entry):
+        raise RuntimeError(f"failed {entry.entry_id}")
+
+    monkeypatch.setattr(journal_engine, "analyze_entry", analyze_entry)
+    with pytest.raises(RuntimeError, match="failed e0"):
+        asyncio.run(analyze_entries(entries(3)))
+
+
+def test_at_most_concurrency_entries_run_at_once(monkeypatch):
+    running, peak = 0, 0
+
+    async def analyze_entry(entry):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return entry.analyzed("a", "s", {})
+
+    monkeypatch.setattr(journal_engine, "analyze_entry", analyze_entry)
+    assert len(asyncio.run(analyze_entries(entries(12), concurrency=3))) == 12
+    assert peak == 3
+
+
+def test_pack_batches_respects_size_and_token_budget():
+    records = entries(7)
+    assert pack_batches(records, size=3, budget=10**6) == [[0, 1, 2], [3, 4, 5], [6]]
+
+    # An entry over the budget on its own still gets a batch
+    long_one = entries(1, words=2000)
+    assert pack_batches(records[:2] + long_one + records[2:3], size=10, budget=200) == [[0, 1], [2], [3]]
+
+
+def test_entries_a_batch_reply_missed_are_retried_alone(monkeypatch):
+    singles = []
+
+    async def analyze_batch(batch):
+        # The reply covers only the first entry of each batch
+        first = batch[0]
+        return {first.entry_id: first.analyzed("batched", "s", {})}
+
+    async def analyze_entry(entry):
+        singles.append(entry.entry_id)
+        return entry.analyzed("single", "s", {})
+
+    batch_mode(monkeypatch, 3)
+    monkeypatch.setattr(journal_engine, "analyze_batch", analyze_batch)
+    monkeypatch.setattr(journal_engine, "analyze_entry", analyze_entry)
+
+    results = asyncio.run(analyze_entries(entries(6)))
+    assert [record.entry_id for record in results] == [f"e{i}" for i in range(6)]
+    assert sorted(singles) == ["e1", "e2", "e4", "e5"]
+    assert [record.analysis for record in results] == ["batched", "single", "single"] * 2
+
+
+def test_batch_mode_through_the_fake_client(monkeypatch):
+    batch_mode(monkeypatch, 4)
+    calls = []
+    real_batch = journal_engine.analyze_batch
+
+    async def analyze_batch(batch):
+        calls.append(len(batch))
+        return await real_batch(batch)
+
+    monkeypatch.setattr(journal_engine, "analyze_batch", analyze_batch)
+    results = asyncio.run(analyze_entries(entries(9)))
+    assert calls == [4, 4]
+    assert [record.entry_id for record in results] == [f"e{i}" for i in range(9)]
+    assert all(set(record.emotions) == set(EMOTIONS) for record in results)
@@ -0,0 +1,51 @@
+import pytest
+
+from json_repair import JSONStreamParser, parse_json
+
+
+def test_clean_json_and_fences():
+    assert parse_json('{"a": [1, 2]}') == {"a": [1, 2]}
+    assert parse_json('```json\n{"a": 1}\n```') == {"a": 1}
+
+
+def test_prose_around_the_value_is_ignored():
+    assert parse_json('Here it is: {"a": 1} Hope that helps!') == {"a": 1}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1,}', {"a": 1}),
+    ('{"a": 1 "b": 2}', {"a": 1, "b": 2}),
+    ("{'a': 'x'}", {"a": "x"}),
+    ('{a: 1}', {"a": 1}),
+    ('{"a": True, "b": None}', {"a": True, "b": None}),
+    ('[1, 2,, 3]', [1, 2, 3]),
+])
+def test_common_model_mistakes_are_repaired(text, expected):
+    assert parse_json(text) == expected
+
+
+def test_output_cut_off_at_the_token_limit_is_closed():
+    assert parse_json('{"a": [1, 2], "b": "unfinish') == {"a": [1, 2], "b": "unfinish"}
+    # A dangling key without a value is dropped
+    assert parse_json('{"a": 1, "b":') == {"a": 1}
+
+
+def test_escapes_split_across_chunks():
+    parser = JSONStreamParser()
+    for chunk in ('{"a": "caf', "\\u00", 'e9\\n"}'):
+        parser.feed(chunk)
+    assert parser.close() == {"a": "café\n"}
+    assert not parser.repaired
+
+
+def test_feed_reports_when_the_value_is_complete():
+    parser = JSONStreamParser()
+    assert parser.feed('{"a": ') is False
+    assert parser.feed('1} trailing') is True
+
+
+def test_no_json_at_all():
+    with pytest.raises(ValueError):
+        parse_json("I cannot help with that.")
+    assert parse_json("I cannot help with that.", default=None) is None
+    assert parse_json("", default={}) == {}
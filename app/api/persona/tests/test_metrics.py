@@ -0,0 +1,34 @@
+from fastapi import FastAPI
+
+from metrics import route_label
+
+app = FastAPI()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    pass
+
+
+@app.post("/getReport")
+async def get_report():
+    pass
+
+
+def scope(path, method="GET"):
+    return {"type": "http", "path": path, "method": method, "root_path": "", "path_params": {}}
+
+
+def test_per_id_paths_share_their_route_template():
+    assert route_label(scope("/jobs/abc"), app.routes) == "/jobs/{job_id}"
+    assert route_label(scope("/jobs/def"), app.routes) == "/jobs/{job_id}"
+
+
+def test_a_known_path_with_another_method_keeps_its_template():
+    assert route_label(scope("/getReport"), app.routes) == "/getReport"
+    assert route_label(scope("/getReport", "POST"), app.routes) == "/getReport"
+
+
+def test_unknown_paths_collapse_to_one_label():
+    labels = {route_label(scope(path), app.routes) for path in ("/wp-admin", "/../etc/passwd", "/jobs", "/x" * 50)}
+    assert labels == {"unmatched"}
@@ -0,0 +1,44 @@
+import pytest
+
+try:
+    from fastapi.testclient import TestClient
+    import main
+except (ImportError, OSError) as e:
+    # main.py pulls in the whole report stack (weasyprint needs pango, etc.)
+    pytest.skip(f"report dependencies unavailable: {e}", allow_module_level=True)
+
+
+@pytest.mark.parametrize("value, days", [(7, 7), ("30", 30), (7.0, 7), (100000, main.MINDLOG_MAX_DAYS)])
+def test_numdays_is_coerced_and_capped(value, days):
+    assert main.mindlog_days(value) == days
+
+
+@pytest.mark.parametrize("value", [None, 0, -3, "seven", "", True, [7], {}])
+def test_numdays_must_be_a_positive_whole_number(value):
+    with pytest.raises(ValueError):
+        main.mindlog_days(value)
+
+
+@pytest.mark.parametrize("body", [{}, {"numdays": "seven"}, {"numdays": 0}, {"numdays": None, "async": True}])
+def test_bad_numdays_is_a_400_before_anything_runs(monkeypatch, body):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no report or job for a bad request")
+
+    monkeypatch.setattr(main, "generate_mindlog_report", fail)
+    monkeypatch.setattr(main, "accepted", fail)
+    response = TestClient(main.app).post("/getMindLogReport", json={"authId": "u1", "email": "a@b.c", **body})
+    assert response.status_code == 400
+    assert "numdays" in response.json()["error"]
+
+
+def test_async_requests_queue_the_capped_value(monkeypatch):
+    queued = {}
+
+    async def accepted(kind, params):
+        queued.update(params)
+        return main.JSONResponse(content={}, status_code=202)
+
+    monkeypatch.setattr(main, "accepted", accepted)
+    body = {"authId": "u1", "email": "a@b.c", "numdays": "5000", "async": True}
+    assert TestClient(main.app).post("/getMindLogReport", json=body).status_code == 202
+    assert queued["numdays"] == main.MINDLOG_MAX_DAYS
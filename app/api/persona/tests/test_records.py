@@ -0,0 +1,39 @@
+import asyncio
+import pickle
+from datetime import datetime
+
+import pytest
+
+from journal_engine import EMOTIONS, JournalRecord, analyze_entries
+from llm_cache import llm_cache
+
+
+def record():
+    return JournalRecord(7, "A walk", datetime(2026, 3, 1, 9, 30), "Went for a long walk.")
+
+
+def test_a_record_has_no_instance_dict():
+    with pytest.raises(AttributeError):
+        record().mood = "fine"
+
+
+def test_a_record_survives_the_trip_to_the_render_pool():
+    original = record().analyzed("- calm", "- a calm day", {emotion: 0.1 for emotion in EMOTIONS})
+    copy = pickle.loads(pickle.dumps(original))
+    assert copy.to_dict() == original.to_dict()
+    assert copy.entry_id == "7"
+
+
+def test_to_dict_can_leave_the_entry_text_out():
+    data = record().analyzed("- calm", "- a calm day", {}).to_dict(content=False)
+    assert "content" not in data
+    assert data["analysis"] == "- calm"
+    assert set(record().to_dict()) == set(JournalRecord.__slots__)
+
+
+def test_entries_are_analyzed_in_place():
+    llm_cache.clear()
+    records = [record(), JournalRecord("8", "Work", datetime(2026, 3, 2), "A long day at work.")]
+    results = asyncio.run(analyze_entries(records))
+    assert all(result is original for result, original in zip(results, records))
+    assert all(original.analysis and original.emotions for original in records)
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import journal_engine
+from journal_engine import JournalRecord, analyze_entries, entry_hash, stored_record, stored_stats
+from llm_cache import llm_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    llm_cache.clear()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # Entries that went to the (fake) model, in combined mode
+    seen = []
+    real_entry = journal_engine.analyze_entry
+
+    async def analyze_entry(entry):
+        seen.append(entry.entry_id)
+        return await real_entry(entry)
+
+    monkeypatch.setattr(journal_engine, "JOURNAL_ANALYSIS", "combined")
+    monkeypatch.setattr(journal_engine, "JOURNAL_BATCH_SIZE", 1)
+    monkeypatch.setattr(journal_engine, "analyze_entry", analyze_entry)
+    return seen
+
+
+def entries(n):
+    return [JournalRecord(f"e{i}", f"Title {i}", f"2026-02-{i + 1:02d}", f"what happened on day {i}") for i in range(n)]
+
+
+def first_run(records):
+    saved = {}
+
+    async def save(fresh):
+        saved.update(fresh)
+
+    asyncio.run(analyze_entries(records, stored={}, save=save))
+    return saved
+
+
+def test_stored_analyses_are_reused_without_a_call(calls):
+    saved = first_run(entries(3))
+    assert sorted(saved) == ["e0", "e1", "e2"]
+    calls.clear()
+
+    before = stored_stats()
+    results = asyncio.run(analyze_entries(entries(3), stored=saved))
+    assert calls == []
+    assert [record.analysis for record in results] == [saved[f"e{i}"]["analysis"] for i in range(3)]
+    after = stored_stats()
+    assert after["hits"] - before["hits"] == 3
+    assert after["misses"] == before["misses"]
+
+
+def test_an_edited_entry_is_analyzed_again_and_only_it_is_saved(calls):
+    saved = first_run(entries(3))
+    calls.clear()
+
+    edited = entries(3)
+    edited[1].content = "I rewrote this entry"
+    resaved = {}
+
+    async def save(fresh):
+        resaved.update(fresh)
+
+    asyncio.run(analyze_entries(edited, stored=saved, save=save))
+    assert calls == ["e1"]
+    assert list(resaved) == ["e1"]
+    assert resaved["e1"]["hash"] == entry_hash(edited[1])
+    assert resaved["e1"]["hash"] != saved["e1"]["hash"]
+
+
+def test_the_hash_follows_mode_and_model(monkeypatch):
+    entry = entries(1)[0]
+    monkeypatch.setattr(journal_engine, "JOURNAL_ANALYSIS", "combined")
+    monkeypatch.setattr(journal_engine, "JOURNAL_BATCH_SIZE", 1)
+    combined = entry_hash(entry)
+
+    monkeypatch.setattr(journal_engine, "JOURNAL_BATCH_SIZE", 5)
+    assert entry_hash(entry) != combined
+    monkeypatch.setattr(journal_engine, "JOURNAL_ANALYSIS", "separate")
+    assert entry_hash(entry) != combined
+
+    monkeypatch.setattr(journal_engine, "JOURNAL_ANALYSIS", "combined")
+    monkeypatch.setattr(journal_engine, "JOURNAL_BATCH_SIZE", 1)
+    assert entry_hash(entry) == combined
+    monkeypatch.setattr(journal_engine, "route_model", lambda task: "gemini-other")
+    assert entry_hash(entry) != combined
+
+
+@pytest.mark.parametrize("missing", ["analysis", "summary", "emotions"])
+def test_an_incomplete_stored_analysis_is_a_miss(missing):
+    entry = entries(1)[0]
+    stored = {"hash": entry_hash(entry), "analysis": "a", "summary": "s", "emotions": {"Joy": 0.5}}
+    assert stored_record(JournalRecord("e0", entry.title, entry.date, entry.content), dict(stored)) is not None
+    del stored[missing]
+    assert stored_record(entry, stored) is None
+
+
+def test_a_failed_save_does_not_fail_the_analysis(calls):
+    async def save(fresh):
+        raise RuntimeError("firestore unavailable")
+
+    results = asyncio.run(analyze_entries(entries(2), stored={}, save=save))
+    assert [record.entry_id for record in results] == ["e0", "e1"]
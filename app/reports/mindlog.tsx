@@ -71,8 +71,8 @@ const MindLogReportViewer: React.FC = () => {
       if (!res.ok) throw new Error(`API error: ${res.statusText}`)
 
       const data = await res.json()
-      const base64 = data.pdf_base64
-      setPdfUrl(`data:application/pdf;base64,${base64}`)
+      // The API returns a download handle; the PDF itself is fetched from it
+      setPdfUrl(`http://127.0.0.1:8000${data.download.url}`)
       setProgress(100)
     } catch (err: any) {
       setError(err.message || "Failed to generate report.")
@@ -86,7 +86,7 @@ const MindLogReportViewer: React.FC = () => {
   const downloadPdf = () => {
     if (!pdfUrl) return
     const link = document.createElement("a")
-    link.href = pdfUrl
+    link.href = `${pdfUrl}?download=1`
     link.download = "MindLogReport.pdf"
     link.click()
   }